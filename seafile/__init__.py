@@ -4,9 +4,27 @@
 from __future__ import absolute_import
 from __future__ import unicode_literals
 
-from .seafile import SeaFile
+import importlib
 
 __version__ = '0.1.0'
 __author__ = 'Henning Hraban Ramm'
 __author_email__ = 'hraban@fiee.net'
 __licence__ = 'MIT'
+
+# imported on first use, so that `import seafile` doesn’t load
+# PyFilesystem2 and requests
+_lazy = {
+    'Connection': '.seafileapi',
+    'SeafileFS': '.seafilefs',
+    'SeaFileOpener': '.opener',
+}
+
+__all__ = list(_lazy)
+
+
+def __getattr__(name):
+    if name in _lazy:
+        value = getattr(importlib.import_module(_lazy[name], __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError('module %r has no attribute %r' % (__name__, name))
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""
+Import-time benchmark: ``python -m seafile.benchmark`` imports the modules
+in fresh interpreters and fails if one takes longer than its budget
+or loads a dependency it should only load when used.
+"""
+import subprocess
+import sys
+
+# module: (budget in seconds, modules it must not load)
+IMPORT_BUDGETS = {
+    'seafile': (0.05, ('requests', 'fs', 'seafile.seafileapi')),
+    'seafile.seafileapi': (0.15, ('requests', 'fs', 'sqlite3')),
+}
+
+SCRIPT = """
+import sys, time
+start = time.perf_counter()
+import %s
+print(time.perf_counter() - start)
+print(' '.join(name for name in %r if name in sys.modules))
+"""
+
+
+def import_time(module, unwanted=(), repeat=5):
+    """
+    Return the best time of `repeat` imports of `module` in fresh interpreters
+    and the `unwanted` modules it loaded.
+    """
+    best, loaded = None, []
+    for _ in range(repeat):
+        output = subprocess.check_output(
+            [sys.executable, '-c', SCRIPT % (module, tuple(unwanted))],
+            universal_newlines=True)
+        lines = output.splitlines() + ['']
+        seconds = float(lines[0])
+        best = seconds if best is None else min(best, seconds)
+        loaded = lines[1].split()
+    return best, loaded
+
+
+def check_import_times(budgets=None, repeat=5):
+    """
+    Import every module of `budgets` (default `IMPORT_BUDGETS`) and
+    return a list of messages about those over budget.
+    """
+    failures = []
+    for module, (budget, unwanted) in sorted((budgets or IMPORT_BUDGETS).items()):
+        seconds, loaded = import_time(module, unwanted, repeat)
+        print('import %-20s %6.1f ms (budget %.0f ms)' % (module, seconds * 1000, budget * 1000))
+        if seconds > budget:
+            failures.append('import %s took %.1f ms, budget %.0f ms' % (module, seconds * 1000, budget * 1000))
+        if loaded:
+            failures.append('import %s loaded %s' % (module, ', '.join(loaded)))
+    return failures
+
+
+if __name__ == '__main__':
+    failures = check_import_times()
+    for failure in failures:
+        print(failure)
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""
+Caches for `SeafileFS`, validated by library head commit.
+"""
+import threading
+import time
+import logging
+
+
+class LibraryCache(object):
+    """
+    Cache of metadata, listings and contents of one library,
+    tagged with the head commit id the entries were read at.
+    """
+
+    kinds = ('info', 'listing', 'content')
+
+    def __init__(self, lib_id):
+        self.lib_id = lib_id
+        self.commit = None  # None: check again before using the entries
+        self.checked = 0.0
+        self.entries = dict((kind, {}) for kind in self.kinds)
+        self.missing = {}  # path: expiry time
+        self.dirs = set()  # paths of directories known to exist
+        self.check_lock = threading.Lock()
+
+    def clear(self):
+        for kind in self.kinds:
+            self.entries[kind].clear()
+
+
+class CommitCache(object):
+    """
+    Per-library caches of a `Connection`.
+
+    Every library is checked with one `library_info` call at most
+    every `interval` seconds; while its head commit stays the same,
+    all entries are kept, as soon as it moves, all are dropped.
+
+    Paths known to be missing are remembered for `missing_ttl` seconds
+    (at most `max_missing` of them per library), directories known to exist
+    until a write into one of them fails; both are independent of the head
+    commit, only writes to a path drop it from the missing ones. Our own
+    writes mark the other entries for a check, so that changes by others
+    after them are still noticed.
+    """
+
+    def __init__(self, connection, interval=30, missing_ttl=5, max_missing=100000):
+        self.connection = connection
+        self.interval = interval
+        self.missing_ttl = missing_ttl
+        self.max_missing = max_missing
+        self.libraries = {}
+        self._lock = threading.Lock()
+
+    def _library(self, lib_id):
+        library = self.libraries.get(lib_id)
+        if library is None:
+            with self._lock:
+                library = self.libraries.setdefault(lib_id, LibraryCache(lib_id))
+        return library
+
+    def _fresh(self, library):
+        return library.commit is not None and time.time() - library.checked < self.interval
+
+    def validate(self, lib_id):
+        """
+        Make sure the cache of library `lib_id` is not older than `interval`.
+        Only one thread checks a library, the others wait for its result.
+        Return the current head commit id
+        """
+        library = self._library(lib_id)
+        if self._fresh(library):
+            return library.commit
+        with library.check_lock:
+            if self._fresh(library):
+                return library.commit
+            now = time.time()
+            commit = self.connection.library_head(lib_id)
+            with self._lock:
+                if commit != library.commit:
+                    logging.debug('Library %s moved from %s to %s' % (lib_id, library.commit, commit))
+                    library.clear()
+                    library.commit = commit
+                library.checked = now
+            return commit
+
+    def get(self, lib_id, kind, key):
+        """
+        Return the cached `kind` entry for `key` in library `lib_id` or None.
+        Lookups of fresh entries don’t take any lock.
+        """
+        if self.interval is None:
+            return None
+        self.validate(lib_id)
+        return self._library(lib_id).entries[kind].get(key)
+
+    def set(self, lib_id, kind, key, value):
+        """
+        Store `value` as `kind` entry for `key` in library `lib_id`.
+        """
+        if self.interval is None:
+            return
+        library = self._library(lib_id)
+        with self._lock:
+            library.entries[kind][key] = value
+
+    def invalidate(self, lib_id=None):
+        """
+        Drop everything cached for library `lib_id` (or all libraries),
+        e.g. after we changed it ourselves.
+        """
+        with self._lock:
+            if lib_id is None:
+                libraries = list(self.libraries.values())
+            else:
+                libraries = [self.libraries[lib_id]] if lib_id in self.libraries else []
+            for library in libraries:
+                library.clear()
+                library.commit = None
+
+    def is_missing(self, lib_id, path):
+        """
+        Tell if `path` (or one of its parents) of library `lib_id`
+        was found missing less than `missing_ttl` seconds ago.
+        """
+        library = self.libraries.get(lib_id)
+        if not self.missing_ttl or library is None or not library.missing:
+            return False
+        now = time.time()
+        while path not in ('', '/'):
+            expiry = library.missing.get(path)
+            if expiry is not None and expiry > now:
+                return True
+            path = path.rsplit('/', 1)[0]
+        return False
+
+    def add_missing(self, lib_id, path):
+        """
+        Remember that `path` of library `lib_id` doesn’t exist.
+        """
+        if not self.missing_ttl:
+            return
+        library = self._library(lib_id)
+        now = time.time()
+        with self._lock:
+            if len(library.missing) >= self.max_missing:
+                for _path, expiry in list(library.missing.items()):
+                    if expiry <= now:
+                        del library.missing[_path]
+                if len(library.missing) >= self.max_missing:
+                    library.missing.clear()
+            library.missing[path] = now + self.missing_ttl
+
+    def discard_missing(self, lib_id, path):
+        """
+        Forget that `path` and its parents of library `lib_id` were missing,
+        e.g. because we just created or wrote it.
+        """
+        library = self.libraries.get(lib_id)
+        if library is None or not library.missing:
+            return
+        with self._lock:
+            while path not in ('', '/'):
+                library.missing.pop(path, None)
+                path = path.rsplit('/', 1)[0]
+
+    def is_dir(self, lib_id, path):
+        """
+        Tell if `path` of library `lib_id` is a directory known to exist,
+        without a request.
+        """
+        if path in ('', '/'):
+            return True
+        if self.interval is None:
+            return False
+        library = self.libraries.get(lib_id)
+        return library is not None and path in library.dirs
+
+    def add_dir(self, lib_id, path):
+        """
+        Remember that directory `path` and so its parents of library `lib_id` exist.
+        """
+        library = self._library(lib_id)
+        with self._lock:
+            while path not in ('', '/'):
+                library.dirs.add(path)
+                library.missing.pop(path, None)
+                path = path.rsplit('/', 1)[0]
+
+    def discard_dir(self, lib_id, path):
+        """
+        Forget directory `path` and its subdirectories of library `lib_id`.
+        """
+        library = self.libraries.get(lib_id)
+        if library is None:
+            return
+        prefix = path.rstrip('/') + '/'
+        with self._lock:
+            library.dirs = set(d for d in library.dirs if d != path and not d.startswith(prefix))
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+On-disk cache of file contents for `SeafileFS`, keyed by Seafile file id.
+"""
+import os
+import re
+import tempfile
+import threading
+import logging
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+FILE_ID = re.compile(r'^[0-9a-f]{40}$')
+
+
+class ContentCache(object):
+    """
+    Contents of files in `directory`, named by their Seafile file id
+    (which changes with the content), at most `max_size` bytes;
+    the least recently used are evicted first.
+
+    Several processes may share one directory: files appear atomically
+    by rename, readers keep files open while they are evicted,
+    and only one process at a time evicts (where `fcntl` exists).
+    """
+
+    def __init__(self, directory, max_size=1024 * 1024 * 1024):
+        self.directory = directory
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._size = None  # bytes in the cache, as far as we know
+        self._lock = threading.Lock()
+        if not os.path.isdir(directory):
+            os.makedirs(directory, exist_ok=True)
+
+    def __getstate__(self):
+        return {'directory': self.directory, 'max_size': self.max_size}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def _path(self, file_id):
+        return os.path.join(self.directory, file_id[:2], file_id)
+
+    def get(self, file_id):
+        """
+        Return the content of `file_id` as a binary file open for reading,
+        or None. Files open before their eviction can still be read.
+        """
+        if not FILE_ID.match(file_id or ''):
+            return None
+        path = self._path(file_id)
+        try:
+            fileobj = open(path, 'rb')
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        try:
+            # the modification time is the time of last use
+            os.utime(fileobj.fileno() if os.utime in os.supports_fd else path, None)
+        except OSError:
+            pass
+        self.hits += 1
+        return fileobj
+
+    def add(self, file_id, write):
+        """
+        Store the content of `file_id`, written by `write(fileobj)`
+        into a new local file, and return it open for reading at its start.
+        """
+        if not FILE_ID.match(file_id or ''):
+            raise ValueError('Invalid file id %r' % file_id)
+        path = self._path(file_id)
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+        fileobj = os.fdopen(fd, 'w+b')
+        try:
+            write(fileobj)
+            fileobj.flush()
+            size = os.fstat(fileobj.fileno()).st_size
+            os.replace(temp_path, path)
+        except BaseException:
+            fileobj.close()
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            raise
+        # read-only, from the same open file: it may be evicted any time
+        with fileobj:
+            reader = os.fdopen(os.dup(fileobj.fileno()), 'rb')
+        reader.seek(0)
+        with self._lock:
+            if self._size is not None:
+                self._size += size
+            evict = self._size is None or self._size > self.max_size
+        if evict:
+            self.evict()
+        return reader
+
+    def _entries(self):
+        """Yield (last use, size, path) of all cached files."""
+        for root, _dirs, files in os.walk(self.directory):
+            for name in files:
+                if name.startswith('.'):
+                    # lock and files being written
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                yield stat.st_mtime, stat.st_size, path
+
+    def evict(self, target=0.9):
+        """
+        Remove the least recently used files until the cache
+        is below `target` times `max_size`.
+        """
+        with open(os.path.join(self.directory, '.lock'), 'a') as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            entries = sorted(self._entries())
+            size = sum(entry[1] for entry in entries)
+            if size > self.max_size:
+                for _used, file_size, path in entries:
+                    if size <= self.max_size * target:
+                        break
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        continue
+                    logging.debug('Evicted %s from content cache' % path)
+                    size -= file_size
+        with self._lock:
+            self._size = size
@@ -0,0 +1,484 @@
+# -*- coding: utf-8 -*-
+"""
+Local stand-in for a Seafile server, for load tests and experiments:
+the parts of the web API that `Connection` and `SeafileFS` use,
+kept in memory, with injectable latency, errors and throttling.
+
+    >>> server, url = serve(latency=0.01, error_rate=0.01, throttle_rate=0.02)
+    >>> fs = SeafileFS(server=url, username='test@example.com', password='test')
+"""
+import email.parser
+import email.policy
+import hashlib
+import io
+import json
+import random
+import re
+import threading
+import time
+import uuid
+import zipfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+
+# options of `FakeSeafile` that ``PUT /_fake/faults`` (JSON) may change
+FAULTS = ('latency', 'error_rate', 'throttle_rate', 'capacity', 'ranges')
+
+
+class Library(object):
+    """
+    Files and directories of one library in memory.
+    """
+
+    def __init__(self, name, lib_id=None):
+        self.id = lib_id or str(uuid.uuid4())
+        self.name = name
+        self.files = {}  # path: (content, mtime)
+        self.dirs = {'/': int(time.time())}  # path: mtime
+        self.commit = 0
+
+    def changed(self):
+        self.commit += 1
+
+    def entry(self, path):
+        """Return the dict of file or directory `path` like the API, or None."""
+        name = path.rsplit('/', 1)[1]
+        if path in self.files:
+            content, mtime = self.files[path]
+            return {'type': 'file', 'name': name, 'size': len(content), 'mtime': mtime,
+                    'id': hashlib.sha1(content).hexdigest()}
+        if path in self.dirs:
+            return {'type': 'dir', 'name': name, 'mtime': self.dirs[path],
+                    'id': hashlib.sha1(path.encode('utf-8')).hexdigest()}
+        return None
+
+    def children(self, path, recursive=False):
+        """Return the paths below directory `path`."""
+        prefix = path.rstrip('/') + '/'
+        paths = sorted(set(self.dirs) | set(self.files))
+        return [p for p in paths if p != '/' and p.startswith(prefix) and
+                (recursive or '/' not in p[len(prefix):])]
+
+    def add_dir(self, path):
+        while path not in self.dirs:
+            self.dirs[path] = int(time.time())
+            path = path.rsplit('/', 1)[0] or '/'
+
+    def remove(self, path):
+        prefix = path.rstrip('/') + '/'
+        for p in [p for p in self.files if p == path or p.startswith(prefix)]:
+            del self.files[p]
+        for p in [p for p in self.dirs if p == path or p.startswith(prefix)]:
+            del self.dirs[p]
+
+
+class FakeSeafile(object):
+    """
+    State of a stand-in server: libraries, tokens, uploaded blocks, zip tasks,
+    request counts and the faults to inject:
+    `latency`: seconds added to every response, or (min, max) of a uniform random delay
+    `error_rate`, `throttle_rate`: share of requests answered with 500, 429
+    `capacity`: max. number of concurrent requests, more are answered with 429
+    `ranges`: False to ignore Range headers of downloads, like some proxies
+    """
+
+    def __init__(self, username='test@example.com', password='test', latency=0,
+                 error_rate=0.0, throttle_rate=0.0, capacity=None, ranges=True, seed=None):
+        self.username = username
+        self.password = password
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.capacity = capacity
+        self.ranges = ranges
+        self.token = uuid.uuid4().hex
+        self.libraries = {}
+        self.blocks = {}  # block id: content
+        self.uploads = {}  # token: (library, parent directory)
+        self.zips = {}  # token: (library, parent directory, names)
+        self.counts = {}  # 'METHOD /path': number of requests
+        self.active = 0
+        self.random = random.Random(seed)
+        self.lock = threading.RLock()
+        self.add_library('My Library')
+
+    def add_library(self, name, lib_id=None):
+        library = Library(name, lib_id)
+        self.libraries[library.id] = library
+        return library
+
+    def library(self, name):
+        for library in self.libraries.values():
+            if library.name == name:
+                return library
+        return None
+
+    def fault(self):
+        """Return the status code of a fault to inject, or None."""
+        with self.lock:
+            if self.capacity is not None and self.active > self.capacity:
+                return 429
+            number = self.random.random()
+        if number < self.throttle_rate:
+            return 429
+        if number < self.throttle_rate + self.error_rate:
+            return 500
+        return None
+
+    def delay(self):
+        latency = self.latency
+        if isinstance(latency, (tuple, list)):
+            with self.lock:
+                latency = self.random.uniform(*latency)
+        if latency:
+            time.sleep(latency)
+
+
+class Handler(BaseHTTPRequestHandler):
+    """
+    Request handler of the stand-in server; `self.server.seafile` is the `FakeSeafile`.
+    """
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def send(self, code, body=b'', content_type='application/json', headers=None):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def handle_one_request(self):
+        seafile = self.server.seafile
+        with seafile.lock:
+            seafile.active += 1
+        try:
+            BaseHTTPRequestHandler.handle_one_request(self)
+        finally:
+            with seafile.lock:
+                seafile.active -= 1
+
+    def dispatch(self, method):
+        seafile = self.server.seafile
+        url = urlparse(self.path)
+        query = dict((key, values[0]) for key, values in parse_qs(url.query).items())
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        if url.path == '/_fake/faults':
+            # not part of the API: change the faults of a running server
+            return self.do_faults(method, body)
+        key = '%s %s' % (method, re.sub(r'/repos/[^/]+/', '/repos/<id>/', url.path))
+        with seafile.lock:
+            seafile.counts[key] = seafile.counts.get(key, 0) + 1
+        seafile.delay()
+        status = seafile.fault()
+        if status is not None:
+            return self.send(status, {'error_msg': 'injected %d' % status})
+        for pattern, handler in self.routes:
+            match = re.match(pattern, '%s %s' % (method, url.path))
+            if match:
+                if handler not in ('auth', 'download', 'upload', 'blocks', 'commit', 'zip'):
+                    if self.headers.get('Authorization') != 'Token ' + seafile.token:
+                        return self.send(401, {'detail': 'Invalid token'})
+                with seafile.lock:
+                    return getattr(self, 'do_' + handler)(query, body, *match.groups())
+        return self.send(404, {'error_msg': 'Unknown %s' % key})
+
+    def do_GET(self):
+        self.dispatch('GET')
+
+    def do_POST(self):
+        self.dispatch('POST')
+
+    def do_PUT(self):
+        self.dispatch('PUT')
+
+    def do_DELETE(self):
+        self.dispatch('DELETE')
+
+    routes = [
+        (r'POST /api2/auth-token/$', 'auth'),
+        (r'GET /api2/repos/$', 'libraries'),
+        (r'GET /api2/repos/([^/]+)/$', 'library'),
+        (r'GET /api2/repos/([^/]+)/dir/$', 'dir_list'),
+        (r'POST /api2/repos/([^/]+)/dir/$', 'dir_create'),
+        (r'DELETE /api2/repos/([^/]+)/dir/$', 'delete'),
+        (r'GET /api2/repos/([^/]+)/file/detail/$', 'file_info'),
+        (r'GET /api2/repos/([^/]+)/file/$', 'file_link'),
+        (r'DELETE /api2/repos/([^/]+)/file/$', 'delete'),
+        (r'GET /api2/repos/([^/]+)/upload-link/$', 'upload_link'),
+        (r'GET /api2/repos/([^/]+)/upload-blks-link/$', 'upload_link'),
+        (r'POST /api2/repos/([^/]+)/upload-blks-link/$', 'block_link'),
+        (r'GET /api2/search/$', 'search'),
+        (r'GET /api/v2.1/repos/([^/]+)/zip-task/$', 'zip_task'),
+        (r'GET /api/v2.1/query-zip-progress/$', 'zip_progress'),
+        (r'GET /seafhttp/files/([^/]+)/(.*)$', 'download'),
+        (r'POST /seafhttp/upload-api/([^/]+)$', 'upload'),
+        (r'POST /seafhttp/upload-raw-blks-api/([^/]+)$', 'blocks'),
+        (r'POST /seafhttp/upload-blks-api/([^/]+)$', 'commit'),
+        (r'GET /seafhttp/zip/([^/]+)$', 'zip'),
+    ]
+
+    @property
+    def base_url(self):
+        return 'http://%s:%d' % self.server.server_address[:2]
+
+    def _library(self, lib_id):
+        return self.server.seafile.libraries.get(lib_id)
+
+    @staticmethod
+    def _path(query, key='p'):
+        return '/' + unquote(query.get(key, '/')).strip('/')
+
+    def _form(self, body):
+        """Parse a multipart/form-data `body` into {name: (filename, content)}."""
+        message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+            b'Content-Type: ' + self.headers['Content-Type'].encode('utf-8') + b'\r\n\r\n' + body)
+        form = {}
+        for part in message.iter_parts():
+            name = part.get_param('name', header='content-disposition')
+            form.setdefault(name, []).append((part.get_filename(), part.get_payload(decode=True)))
+        return form
+
+    def do_faults(self, method, body):
+        seafile = self.server.seafile
+        with seafile.lock:
+            if method == 'PUT':
+                for key, value in json.loads(body.decode('utf-8')).items():
+                    if key not in FAULTS:
+                        return self.send(400, {'error_msg': 'Unknown fault %s' % key})
+                    setattr(seafile, key, value)
+            return self.send(200, dict((key, getattr(seafile, key)) for key in FAULTS))
+
+    def do_auth(self, query, body):
+        seafile = self.server.seafile
+        form = dict((key, values[0]) for key, values in parse_qs(body.decode('utf-8')).items())
+        if form.get('username') != seafile.username or form.get('password') != seafile.password:
+            return self.send(400, {'non_field_errors': ['Unable to login']})
+        return self.send(200, {'token': seafile.token})
+
+    def do_libraries(self, query, body):
+        return self.send(200, [
+            {'id': library.id, 'name': library.name, 'type': 'repo', 'permission': 'rw',
+             'size': sum(len(content) for content, _mtime in library.files.values()),
+             'mtime': max(library.dirs.values())}
+            for library in self.server.seafile.libraries.values()])
+
+    def do_library(self, query, body, lib_id):
+        library = self._library(lib_id)
+        if library is None:
+            return self.send(404, {'error_msg': 'Library not found'})
+        return self.send(200, {
+            'id': library.id, 'name': library.name, 'root': 'commit-%d' % library.commit,
+            'size': sum(len(content) for content, _mtime in library.files.values()),
+            'mtime': max(library.dirs.values())})
+
+    def do_dir_list(self, query, body, lib_id):
+        library = self._library(lib_id)
+        path = self._path(query)
+        if library is None or path not in library.dirs:
+            return self.send(404, {'error_msg': 'Folder not found'})
+        recursive = query.get('recursive') == '1'
+        entries = []
+        for child in library.children(path, recursive):
+            if query.get('t') == 'd' and child in library.files:
+                continue
+            entry = library.entry(child)
+            if recursive:
+                entry['parent_dir'] = child.rsplit('/', 1)[0] or '/'
+            entries.append(entry)
+        return self.send(200, entries)
+
+    def do_dir_create(self, query, body, lib_id):
+        library = self._library(lib_id)
+        path = self._path(query)
+        form = parse_qs(body.decode('utf-8'))
+        parent = path.rsplit('/', 1)[0] or '/'
+        if library is None or form.get('create_parents') != ['true'] and parent not in library.dirs:
+            return self.send(404, {'error_msg': 'Parent folder not found'})
+        library.add_dir(path)
+        library.changed()
+        return self.send(201, b'"success"')
+
+    def do_delete(self, query, body, lib_id):
+        library = self._library(lib_id)
+        if library is None:
+            return self.send(404, {'error_msg': 'Library not found'})
+        library.remove(self._path(query))
+        library.changed()
+        return self.send(200, b'"success"')
+
+    def do_file_info(self, query, body, lib_id):
+        library = self._library(lib_id)
+        path = self._path(query)
+        if library is None or path not in library.files:
+            return self.send(404, {'error_msg': 'File not found'})
+        return self.send(200, library.entry(path))
+
+    def do_file_link(self, query, body, lib_id):
+        library = self._library(lib_id)
+        path = self._path(query)
+        if library is None or path not in library.files:
+            return self.send(404, {'error_msg': 'File not found'})
+        return self.send(200, '%s/seafhttp/files/%s%s' % (self.base_url, lib_id, path))
+
+    def do_download(self, query, body, lib_id, path):
+        library = self._library(lib_id)
+        path = '/' + unquote(path)
+        if library is None or path not in library.files:
+            return self.send(404, b'File not found', 'text/plain')
+        content = library.files[path][0]
+        byte_range = self.headers.get('Range')
+        if byte_range and self.server.seafile.ranges:
+            start, _, stop = byte_range.split('=', 1)[1].partition('-')
+            start = int(start)
+            stop = int(stop) if stop else len(content) - 1
+            part = content[start:stop + 1]
+            return self.send(206, part, 'application/octet-stream', {
+                'Content-Range': 'bytes %d-%d/%d' % (start, start + len(part) - 1, len(content))})
+        return self.send(200, content, 'application/octet-stream')
+
+    def do_upload_link(self, query, body, lib_id):
+        token = uuid.uuid4().hex
+        self.server.seafile.uploads[token] = (lib_id, self._path(query))
+        if self.path.startswith('/api2/repos/%s/upload-blks-link/' % lib_id):
+            return self.send(200, '%s/seafhttp/upload-blks-api/%s' % (self.base_url, token))
+        return self.send(200, '%s/seafhttp/upload-api/%s' % (self.base_url, token))
+
+    def do_upload(self, query, body, token):
+        seafile = self.server.seafile
+        if token not in seafile.uploads:
+            return self.send(403, b'Invalid token', 'text/plain')
+        library = self._library(seafile.uploads[token][0])
+        form = self._form(body)
+        parent = '/' + form['parent_dir'][0][1].decode('utf-8').strip('/')
+        if parent not in library.dirs:
+            return self.send(404, b'Parent dir doesn\'t exist', 'text/plain')
+        uploaded = []
+        for filename, content in form.get('file', []):
+            library.files[parent.rstrip('/') + '/' + filename] = (content, int(time.time()))
+            uploaded.append({'name': filename, 'size': len(content),
+                             'id': hashlib.sha1(content).hexdigest()})
+        library.changed()
+        return self.send(200, uploaded)
+
+    def do_block_link(self, query, body, lib_id):
+        seafile = self.server.seafile
+        token = uuid.uuid4().hex
+        seafile.uploads[token] = (lib_id, '/')
+        block_ids = parse_qs(body.decode('utf-8'))['blklist'][0].split(',')
+        # like seahub: upload missing blocks to 'rawblksurl', then commit to 'commiturl'
+        return self.send(200, {'rawblksurl': '%s/seafhttp/upload-raw-blks-api/%s' % (self.base_url, token),
+                               'commiturl': '%s/seafhttp/upload-blks-api/%s' % (self.base_url, token),
+                               'blklist': [b for b in block_ids if b not in seafile.blocks]})
+
+    def do_blocks(self, query, body, token):
+        seafile = self.server.seafile
+        if token not in seafile.uploads:
+            return self.send(403, b'Invalid token', 'text/plain')
+        for filename, content in self._form(body).get('file', []):
+            if hashlib.sha1(content).hexdigest() != filename:
+                return self.send(400, b'Block id mismatch', 'text/plain')
+            seafile.blocks[filename] = content
+        return self.send(200, b'"success"')
+
+    def do_commit(self, query, body, token):
+        seafile = self.server.seafile
+        if token not in seafile.uploads:
+            return self.send(403, b'Invalid token', 'text/plain')
+        library = self._library(seafile.uploads[token][0])
+        form = dict((key, values[0]) for key, values in parse_qs(body.decode('utf-8')).items())
+        content = b''.join(seafile.blocks[b] for b in json.loads(form['blockids']))
+        if len(content) != int(form['file_size']):
+            return self.send(400, b'Size mismatch', 'text/plain')
+        parent = '/' + form['parent_dir'].strip('/')
+        library.files[parent.rstrip('/') + '/' + form['file_name']] = (content, int(time.time()))
+        library.changed()
+        return self.send(200, b'"success"')
+
+    def do_search(self, query, body):
+        seafile = self.server.seafile
+        extension = query.get('input_fexts', '')
+        results = []
+        for library in seafile.libraries.values():
+            if query.get('search_repo', 'all') not in ('all', library.id):
+                continue
+            for path, (content, mtime) in sorted(library.files.items()):
+                if path.endswith('.' + extension) or not extension and query.get('q', '') in path:
+                    results.append({'repo_id': library.id, 'name': path.rsplit('/', 1)[1],
+                                    'fullpath': path, 'size': len(content),
+                                    'last_modified': mtime, 'is_dir': False})
+        page, per_page = int(query.get('page', 1)), int(query.get('per_page', 10))
+        return self.send(200, {'total': len(results), 'has_more': page * per_page < len(results),
+                               'results': results[(page - 1) * per_page:page * per_page]})
+
+    def do_zip_task(self, query, body, lib_id):
+        token = uuid.uuid4().hex
+        dirents = parse_qs(urlparse(self.path).query).get('dirents', [])
+        self.server.seafile.zips[token] = (lib_id, self._path(query, 'parent_dir'), dirents)
+        return self.send(200, {'zip_token': token})
+
+    def do_zip_progress(self, query, body):
+        if query.get('token') not in self.server.seafile.zips:
+            return self.send(404, {'error_msg': 'Token not found'})
+        return self.send(200, {'zipped': 1, 'total': 1, 'failed': 0, 'failed_reason': ''})
+
+    def do_zip(self, query, body, token):
+        seafile = self.server.seafile
+        if token not in seafile.zips:
+            return self.send(404, b'Token not found', 'text/plain')
+        lib_id, parent, dirents = seafile.zips.pop(token)
+        library = self._library(lib_id)
+        archive = io.BytesIO()
+        prefix = parent.rstrip('/') + '/'
+        with zipfile.ZipFile(archive, 'w', zipfile.ZIP_DEFLATED) as zipped:
+            for name in dirents:
+                top = prefix + name
+                for path in [top] + library.children(top, recursive=True):
+                    if path in library.dirs:
+                        zipped.writestr(path[len(prefix):] + '/', b'')
+                    elif path in library.files:
+                        zipped.writestr(path[len(prefix):], library.files[path][0])
+        return self.send(200, archive.getvalue(), 'application/zip')
+
+
+def serve(host='127.0.0.1', port=0, **kwargs):
+    """
+    Start a stand-in server (kwargs of `FakeSeafile`) on a background thread.
+    Return the server (with its `FakeSeafile` as `seafile`) and its URL
+    """
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    server.seafile = FakeSeafile(**kwargs)
+    thread = threading.Thread(target=server.serve_forever, name='fake-seafile')
+    thread.daemon = True
+    thread.start()
+    return server, 'http://%s:%d' % server.server_address[:2]
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Local stand-in Seafile server')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--latency', type=float, default=0)
+    parser.add_argument('--error-rate', type=float, default=0)
+    parser.add_argument('--throttle-rate', type=float, default=0)
+    parser.add_argument('--capacity', type=int, default=None)
+    args = parser.parse_args()
+    server, url = serve(port=args.port, latency=args.latency, error_rate=args.error_rate,
+                        throttle_rate=args.throttle_rate, capacity=args.capacity)
+    print('Serving %s as test@example.com / test' % url)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+Glob patterns for `SeafileFS` and its metadata index.
+
+Patterns are matched against paths relative to a directory:
+``*``, ``?`` and ``[...]`` match within a name, ``**`` matches
+any number of directories, e.g. ``**/*.pdf`` or ``2018/*/report-??.txt``.
+"""
+import re
+from collections import namedtuple
+
+# like fs.glob.GlobMatch of newer PyFilesystem2 versions
+GlobMatch = namedtuple('GlobMatch', ['path', 'info'])
+
+
+def is_wild(segment):
+    """Tell if a pattern segment contains wildcards."""
+    return any(char in segment for char in '*?[')
+
+
+def split_pattern(pattern):
+    """
+    Split `pattern` into its leading literal directories
+    and the segments from the first wildcard on.
+    """
+    segments = [segment for segment in pattern.strip('/').split('/') if segment]
+    for position, segment in enumerate(segments):
+        if is_wild(segment):
+            return segments[:position], segments[position:]
+    return segments[:-1], segments[-1:]
+
+
+def _translate_segment(segment):
+    """Translate one name pattern into a regular expression."""
+    regex = ''
+    position, length = 0, len(segment)
+    while position < length:
+        char = segment[position]
+        position += 1
+        if char == '*':
+            regex += '[^/]*'
+        elif char == '?':
+            regex += '[^/]'
+        elif char == '[':
+            end = position
+            if end < length and segment[end] in '!^':
+                end += 1
+            if end < length and segment[end] == ']':
+                end += 1
+            end = segment.find(']', end)
+            if end < 0:
+                regex += '\\['
+            else:
+                chars = segment[position:end].replace('\\', '\\\\')
+                if chars[:1] in ('!', '^'):
+                    chars = '^' + chars[1:]
+                regex += '[%s]' % chars
+                position = end + 1
+        else:
+            regex += re.escape(char)
+    return regex
+
+
+def translate(pattern):
+    """
+    Translate `pattern` into a regular expression for relative paths.
+    """
+    segments = [segment for segment in pattern.strip('/').split('/') if segment]
+    regex = ''
+    for position, segment in enumerate(segments):
+        last = position == len(segments) - 1
+        if segment == '**':
+            regex += '(?:[^/]+/)*[^/]+' if last else '(?:[^/]+/)*'
+        else:
+            regex += _translate_segment(segment) + ('' if last else '/')
+    return '^%s$' % regex
+
+
+def compile_pattern(pattern, case_sensitive=True):
+    """
+    Return a compiled regular expression matching relative paths with `pattern`.
+    """
+    return re.compile(translate(pattern), 0 if case_sensitive else re.IGNORECASE)
+
+
+def sql_glob(segment):
+    """
+    Convert a name pattern into an SQLite GLOB pattern.
+    """
+    return segment.replace('[!', '[^')
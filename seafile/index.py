@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+"""
+Persistent SQLite index of library trees for `SeafileFS`,
+for path, glob, size and mtime queries without requests.
+"""
+import sqlite3
+import threading
+import time
+import logging
+
+from .globbing import compile_pattern, split_pattern, sql_glob
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS libraries (
+    lib_id TEXT PRIMARY KEY,
+    commit_id TEXT,
+    checked REAL
+);
+CREATE TABLE IF NOT EXISTS entries (
+    lib_id TEXT NOT NULL,
+    path TEXT NOT NULL,
+    parent TEXT NOT NULL,
+    name TEXT NOT NULL,
+    is_dir INTEGER NOT NULL,
+    size INTEGER,
+    mtime INTEGER,
+    id TEXT,
+    PRIMARY KEY (lib_id, path)
+);
+CREATE INDEX IF NOT EXISTS entries_parent ON entries (lib_id, parent);
+CREATE INDEX IF NOT EXISTS entries_name ON entries (lib_id, name);
+"""
+
+COLUMNS = 'path, name, is_dir, size, mtime, id'
+
+
+def _entry(row):
+    """Make an entry dict like those of `dir_list` from an index row."""
+    path, name, is_dir, size, mtime, id_ = row
+    entry = {'path': path, 'name': name, 'type': 'dir' if is_dir else 'file',
+             'size': size, 'mtime': mtime}
+    if id_ is not None:
+        entry['id'] = id_
+    return entry
+
+
+class MetadataIndex(object):
+    """
+    Index of the trees of libraries in SQLite database `filename`
+    (':memory:' for one that isn’t kept).
+
+    A library is read with one recursive listing and read again
+    when its head commit moved; the commit is checked at most every
+    `max_age` seconds, so query results are never older than that
+    (None: only check on `refresh`).
+    Several processes may share one database file.
+    """
+
+    def __init__(self, connection, filename=':memory:', max_age=60):
+        self.connection = connection
+        self.filename = filename
+        self.max_age = max_age
+        self._lock = threading.RLock()
+        self._library_locks = {}
+        self._db = sqlite3.connect(filename, timeout=30, check_same_thread=False)
+        with self._lock, self._db:
+            self._db.executescript(SCHEMA)
+
+    def __getstate__(self):
+        return {'connection': self.connection, 'filename': self.filename, 'max_age': self.max_age}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _library_lock(self, lib_id):
+        with self._lock:
+            return self._library_locks.setdefault(lib_id, threading.Lock())
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return self._db.execute(sql, params).fetchall()
+
+    def library_state(self, lib_id):
+        """
+        Return (commit id, time of last check) of library `lib_id`,
+        or (None, None) if it isn’t indexed.
+        """
+        rows = self._query('SELECT commit_id, checked FROM libraries WHERE lib_id = ?', (lib_id,))
+        return rows[0] if rows else (None, None)
+
+    def refresh(self, lib_id, force=False):
+        """
+        Make sure the index of library `lib_id` is not older than `max_age`,
+        re-read it if its head commit moved (or if `force`).
+        Only one thread reads a library, the others wait for it.
+        Return the indexed commit id.
+        """
+        with self._library_lock(lib_id):
+            commit, checked = self.library_state(lib_id)
+            now = time.time()
+            if (not force and commit is not None and
+                    (self.max_age is None or now - checked < self.max_age)):
+                return commit
+            head = self.connection.library_head(lib_id)
+            if head == commit and not force:
+                with self._lock, self._db:
+                    self._db.execute('UPDATE libraries SET checked = ? WHERE lib_id = ?',
+                                     (now, lib_id))
+                return commit
+            logging.info('Indexing library %s at commit %s' % (lib_id, head))
+            rows = self._rows(lib_id)
+            with self._lock, self._db:
+                self._db.execute('DELETE FROM entries WHERE lib_id = ?', (lib_id,))
+                self._db.executemany(
+                    'INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?)', rows)
+                self._db.execute('INSERT OR REPLACE INTO libraries VALUES (?, ?, ?)',
+                                 (lib_id, head, now))
+            return head
+
+    def _rows(self, lib_id):
+        """Read library `lib_id` with one recursive listing into index rows."""
+        rows = []
+        for entry in self.connection.dir_walk_iter(lib_id, '/'):
+            parent = '/' + entry.get('parent_dir', '/').strip('/')
+            path = parent.rstrip('/') + '/' + entry['name']
+            rows.append((lib_id, path, parent, entry['name'], entry.get('type') != 'file',
+                         entry.get('size'), entry.get('mtime'), entry.get('id')))
+        return rows
+
+    def forget(self, lib_id=None):
+        """
+        Drop the index of library `lib_id` (or all libraries).
+        """
+        with self._lock, self._db:
+            if lib_id is None:
+                self._db.execute('DELETE FROM entries')
+                self._db.execute('DELETE FROM libraries')
+            else:
+                self._db.execute('DELETE FROM entries WHERE lib_id = ?', (lib_id,))
+                self._db.execute('DELETE FROM libraries WHERE lib_id = ?', (lib_id,))
+
+    def entry(self, lib_id, path):
+        """
+        Return the entry dict of `path` of library `lib_id` or None.
+        """
+        self.refresh(lib_id)
+        rows = self._query('SELECT %s FROM entries WHERE lib_id = ? AND path = ?' % COLUMNS,
+                           (lib_id, path))
+        return _entry(rows[0]) if rows else None
+
+    def listdir(self, lib_id, path='/'):
+        """
+        Return the entry dicts of directory `path` of library `lib_id`.
+        """
+        self.refresh(lib_id)
+        rows = self._query('SELECT %s FROM entries WHERE lib_id = ? AND parent = ? ORDER BY name'
+                           % COLUMNS, (lib_id, path))
+        return [_entry(row) for row in rows]
+
+    def find(self, lib_id, path='/', pattern=None, name=None, files=True, dirs=True,
+             min_size=None, max_size=None, modified_after=None, modified_before=None):
+        """
+        Return the entry dicts (with their 'path') below directory `path`
+        of library `lib_id` that match all given conditions:
+        `pattern`: glob of the path relative to `path`, e.g. '**/*.pdf'
+        `name`: glob of the name
+        `files`, `dirs`: include files, directories
+        `min_size`, `max_size`: size in bytes
+        `modified_after`, `modified_before`: mtime in seconds since the epoch
+        """
+        self.refresh(lib_id)
+        prefix = path.rstrip('/')
+        regex = None
+        if pattern is not None:
+            literal, rest = split_pattern(pattern)
+            if literal:
+                prefix += '/' + '/'.join(literal)
+            if rest and rest[-1] != '**':
+                name = name or rest[-1]
+            if rest != ['**']:
+                regex = compile_pattern('/'.join(rest))
+        conditions = ['lib_id = ?', 'path > ?', 'path < ?']
+        # all paths below prefix/ sort between prefix/ and prefix0
+        params = [lib_id, prefix + '/', prefix + '0']
+        if name is not None:
+            conditions.append('name GLOB ?')
+            params.append(sql_glob(name))
+        if not files:
+            conditions.append('is_dir')
+        if not dirs:
+            conditions.append('NOT is_dir')
+        for condition, value in (('size >= ?', min_size), ('size <= ?', max_size),
+                                 ('mtime > ?', modified_after), ('mtime < ?', modified_before)):
+            if value is not None:
+                conditions.append(condition)
+                params.append(value)
+        rows = self._query('SELECT %s FROM entries WHERE %s ORDER BY path'
+                           % (COLUMNS, ' AND '.join(conditions)), params)
+        start = len(prefix) + 1
+        return [_entry(row) for row in rows if regex is None or regex.match(row[0][start:])]
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+"""
+Modules imported on first use, to keep `import seafile` fast.
+"""
+import importlib
+
+
+class LazyModule(object):
+    """
+    Stand-in for module `name` that imports it on first attribute access.
+    """
+
+    def __init__(self, name):
+        self.__dict__['_name'] = name
+        self.__dict__['_module'] = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self.__dict__['_module'] = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+    def __repr__(self):
+        return '<lazy module %s>' % self._name
+
+
+requests = LazyModule('requests')
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""
+Adaptive limit of concurrent requests per Seafile server.
+"""
+import threading
+import time
+import logging
+
+# responses that mean the server is overloaded
+OVERLOAD_STATUS = (429, 500, 502, 503, 504)
+
+
+class AdaptiveLimiter(object):
+    """
+    Limit of requests in flight to one server, adjusted by AIMD:
+    every response that was sent while the limit was used raises it
+    by 1/limit (so by 1 per round of requests), every overload
+    (429 or 5xx, connection errors, latency of API requests more than
+    `tolerance` times and at least `min_delay` seconds more than the usual one)
+    multiplies it by `backoff`, once per round.
+    The limit stays between `min_limit` and `max_limit`.
+    """
+
+    def __init__(self, limit=4, min_limit=1, max_limit=64, backoff=0.5, tolerance=4.0, min_delay=0.25):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff = backoff
+        self.tolerance = tolerance
+        self.min_delay = min_delay
+        self.limit = float(max(min_limit, min(limit, max_limit)))
+        self.in_flight = 0
+        self.requests = 0
+        self.overloads = 0
+        self.errors = 0
+        self.latency = None  # usual latency: slowly rising minimum
+        self._decreased = 0.0
+        self._streams = {}  # thread ident: number of streamed responses it holds
+        self._cond = threading.Condition()
+
+    def acquire(self, timeout=None, stream=False):
+        """
+        Wait for a free slot (at most `timeout` seconds) and take it.
+        Threads holding the slot of a `stream`ed response don’t wait,
+        so that they can send requests before they close it.
+        Return the start time to pass to `done`, None after a timeout
+        """
+        end = None if timeout is None else time.time() + timeout
+        ident = threading.get_ident()
+        with self._cond:
+            while self.in_flight >= int(self.limit) and not self._streams.get(ident):
+                if end is None:
+                    self._cond.wait()
+                    continue
+                remaining = end - time.time()
+                if remaining <= 0:
+                    return None
+                self._cond.wait(remaining)
+            self.in_flight += 1
+            if stream:
+                self._streams[ident] = self._streams.get(ident, 0) + 1
+        return time.time()
+
+    def release(self, stream_owner=None):
+        """
+        Free a slot taken by `acquire`; `stream_owner`: ident of the thread
+        that took it for a streamed response.
+        """
+        with self._cond:
+            self.in_flight -= 1
+            if stream_owner is not None:
+                self._streams[stream_owner] -= 1
+                if not self._streams[stream_owner]:
+                    del self._streams[stream_owner]
+            self._cond.notify()
+
+    def done(self, start, status=None, error=False, timed=True):
+        """
+        Adjust the limit by the response `status` (or `error`)
+        of a request started at `start`; its latency only counts if `timed`
+        (not for requests that transfer file contents).
+        """
+        now = time.time()
+        latency = now - start
+        with self._cond:
+            self.requests += 1
+            if error:
+                self.errors += 1
+            slow = (timed and self.tolerance is not None and self.latency is not None and
+                    latency > max(self.tolerance * self.latency, self.latency + self.min_delay))
+            if timed and (self.latency is None or latency < self.latency):
+                self.latency = latency
+            elif timed:
+                self.latency += (latency - self.latency) * 0.01
+            if error or status in OVERLOAD_STATUS or slow:
+                # requests sent before the last decrease don’t count again
+                if start >= self._decreased:
+                    self.overloads += 1
+                    self.limit = max(self.min_limit, self.limit * self.backoff)
+                    self._decreased = now
+                    logging.info('Concurrency limit lowered to %.1f (status %s, %.3f s)'
+                                 % (self.limit, status, latency))
+            elif self.in_flight >= int(self.limit):
+                self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+                self._cond.notify_all()
+
+    def metrics(self):
+        """
+        Return a dict of the current limit and counters.
+        """
+        with self._cond:
+            return {
+                'concurrency_limit': int(self.limit),
+                'in_flight': self.in_flight,
+                'requests': self.requests,
+                'overloads': self.overloads,
+                'errors': self.errors,
+                'latency': self.latency
+            }
+
+
+_limiters = {}
+_lock = threading.Lock()
+
+
+def shared_limiter(server, limit=4, max_limit=64):
+    """
+    Return the `AdaptiveLimiter` shared by all connections to `server`
+    with the same `max_limit`, so that every connection keeps its own cap.
+    """
+    with _lock:
+        limiter = _limiters.get((server, max_limit))
+        if limiter is None:
+            limiter = _limiters[server, max_limit] = AdaptiveLimiter(limit=limit, max_limit=max_limit)
+        return limiter
@@ -0,0 +1,394 @@
+# -*- coding: utf-8 -*-
+"""
+Load test: ``python -m seafile.loadtest`` runs concurrent clients doing
+mixed `SeafileFS` workloads against a local stand-in server
+(see `seafile.fakeserver`, with injectable latency, errors and 429s)
+or a real one, and reports per scenario the throughput, latency
+percentiles, error rate and the client’s CPU time and memory.
+"""
+import asyncio
+import collections
+import random
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+
+def op_listdir(fs, rnd, data):
+    fs.listdir(rnd.choice(data.dirs))
+
+
+def op_getinfo(fs, rnd, data):
+    fs.getinfo(rnd.choice(data.small_files), namespaces=['details'])
+
+
+def op_read_small(fs, rnd, data):
+    fs.getbytes(rnd.choice(data.small_files))
+
+
+def op_read_large(fs, rnd, data):
+    with fs.openbin(rnd.choice(data.large_files)) as fileobj:
+        while fileobj.read(1024 * 1024):
+            pass
+
+
+def op_write_small(fs, rnd, data):
+    fs.setbytes('%s/written-%d' % (rnd.choice(data.dirs), rnd.randrange(100)),
+               data.small_content)
+
+
+def op_write_large(fs, rnd, data):
+    fs.setbytes('%s/written-large-%d' % (data.root, rnd.randrange(4)), data.large_content)
+
+
+def op_walk(fs, rnd, data):
+    for _path in fs.walk.files(data.root):
+        pass
+
+
+OPERATIONS = {
+    'listdir': op_listdir,
+    'getinfo': op_getinfo,
+    'read_small': op_read_small,
+    'read_large': op_read_large,
+    'write_small': op_write_small,
+    'write_large': op_write_large,
+    'walk': op_walk,
+}
+
+# scenario: {operation: weight}
+SCENARIOS = {
+    'browse': {'listdir': 5, 'getinfo': 5, 'walk': 1},
+    'read': {'getinfo': 2, 'read_small': 7, 'read_large': 1},
+    'write': {'write_small': 9, 'write_large': 1},
+    'mixed': {'listdir': 3, 'getinfo': 3, 'read_small': 3, 'read_large': 1,
+              'write_small': 2, 'write_large': 1, 'walk': 1},
+}
+
+Dataset = collections.namedtuple(
+    'Dataset', 'root dirs small_files large_files small_content large_content')
+
+
+def create_dataset(fs, root, dirs=4, files=25, small_size=4096, large_size=8 * 1024 * 1024):
+    """
+    Create `dirs` directories of `files` small files and two large files
+    below `root` (in a library) of `fs` and return the `Dataset`.
+    """
+    small_content = bytes(bytearray(random.getrandbits(8) for _ in range(small_size)))
+    large_content = small_content * (large_size // small_size)
+    data = Dataset(root, [], [], [], small_content, large_content)
+    for number in range(dirs):
+        directory = '%s/dir-%d' % (root, number)
+        fs.makedirs(directory, recreate=True)
+        data.dirs.append(directory)
+        for index in range(files):
+            data.small_files.append('%s/small-%d' % (directory, index))
+            fs.setbytes(data.small_files[-1], small_content)
+    for index in range(2):
+        data.large_files.append('%s/large-%d' % (root, index))
+        fs.setbytes(data.large_files[-1], large_content)
+    return data
+
+
+def percentile(values, fraction):
+    """
+    Return the `fraction` (0..1) percentile of the sorted list `values`.
+    """
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+class Recorder(object):
+    """
+    Latencies and errors of the operations of one run, from all clients.
+    """
+
+    def __init__(self):
+        self.latencies = collections.defaultdict(list)  # operation: [seconds]
+        self.errors = collections.Counter()  # operation: number
+        self.error_types = collections.Counter()  # exception name: number
+        self._lock = threading.Lock()
+
+    def run(self, name, function, *args):
+        start = time.perf_counter()
+        try:
+            function(*args)
+        except Exception as error:
+            with self._lock:
+                self.errors[name] += 1
+                self.error_types[type(error).__name__] += 1
+        else:
+            latency = time.perf_counter() - start
+            with self._lock:
+                self.latencies[name].append(latency)
+
+
+def _choices(scenario, rnd):
+    names = sorted(SCENARIOS[scenario])
+    weights = [SCENARIOS[scenario][name] for name in names]
+    while True:
+        yield rnd.choices(names, weights)[0]
+
+
+def run_threads(filesystems, data, scenario, duration, recorder, seed=0):
+    """
+    Run a thread per filesystem of `filesystems`, doing operations
+    of `scenario` for `duration` seconds.
+    """
+    end = time.perf_counter() + duration
+
+    def client(number, fs):
+        rnd = random.Random(seed + number)
+        for name in _choices(scenario, rnd):
+            if time.perf_counter() >= end:
+                break
+            recorder.run(name, OPERATIONS[name], fs, rnd, data)
+
+    threads = [threading.Thread(target=client, args=(number, fs))
+               for number, fs in enumerate(filesystems)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def run_asyncio(filesystems, data, scenario, duration, recorder, seed=0):
+    """
+    Like `run_threads`, but with a coroutine per filesystem, all in one
+    event loop, that runs the (blocking) operations in an executor,
+    as an asyncio application would.
+    """
+    async def client(loop, executor, number, fs):
+        rnd = random.Random(seed + number)
+        for name in _choices(scenario, rnd):
+            if time.perf_counter() >= end:
+                break
+            await loop.run_in_executor(
+                executor, recorder.run, name, OPERATIONS[name], fs, rnd, data)
+
+    async def main():
+        loop = asyncio.get_event_loop()
+        with ThreadPoolExecutor(max_workers=len(filesystems)) as executor:
+            await asyncio.gather(*[client(loop, executor, number, fs)
+                                   for number, fs in enumerate(filesystems)])
+
+    end = time.perf_counter() + duration
+    asyncio.run(main())
+
+
+def _cpu_seconds():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _rss_mb():
+    """Return the current resident set size in MB, None if unknown (not Linux)."""
+    try:
+        with open('/proc/self/statm') as statm:
+            pages = int(statm.read().split()[1])
+    except (IOError, OSError, IndexError, ValueError):
+        return None
+    return pages * resource.getpagesize() / (1024.0 * 1024)
+
+
+def run_scenario(filesystems, data, scenario, duration=10.0, mode='threads',
+                 trace_memory=False):
+    """
+    Run one `scenario` (a key of `SCENARIOS`) with a thread or asyncio client
+    (`mode`) per filesystem of `filesystems` for `duration` seconds.
+    `trace_memory`: also measure the peak of Python allocations (slower)
+    Return dict of the results
+    """
+    recorder = Recorder()
+    runner = {'threads': run_threads, 'asyncio': run_asyncio}[mode]
+    if trace_memory:
+        tracemalloc.start()
+    rss = _rss_mb()
+    cpu = _cpu_seconds()
+    start = time.perf_counter()
+    try:
+        runner(filesystems, data, scenario, duration, recorder)
+        elapsed = time.perf_counter() - start
+        cpu = _cpu_seconds() - cpu
+        rss = None if rss is None else _rss_mb() - rss
+        peak = tracemalloc.get_traced_memory()[1] if trace_memory else None
+    finally:
+        if trace_memory:
+            tracemalloc.stop()
+    latencies = sorted(latency for values in recorder.latencies.values() for latency in values)
+    operations = len(latencies) + sum(recorder.errors.values())
+    return {
+        'scenario': scenario,
+        'mode': mode,
+        'clients': len(filesystems),
+        'seconds': elapsed,
+        'operations': operations,
+        'throughput': operations / elapsed,
+        'p50': percentile(latencies, 0.5),
+        'p95': percentile(latencies, 0.95),
+        'p99': percentile(latencies, 0.99),
+        'error_rate': sum(recorder.errors.values()) / float(operations or 1),
+        'errors': dict(recorder.error_types),
+        'per_operation': dict(
+            (name, {'count': len(recorder.latencies[name]) + recorder.errors[name],
+                    'p50': percentile(sorted(recorder.latencies[name]), 0.5),
+                    'p99': percentile(sorted(recorder.latencies[name]), 0.99),
+                    'errors': recorder.errors[name]})
+            for name in set(recorder.latencies) | set(recorder.errors)),
+        'cpu_seconds': cpu,
+        'cpu_percent': 100.0 * cpu / elapsed,
+        # change of the resident set size during this scenario
+        'rss_growth_mb': rss,
+        # peak of the whole process so far, earlier scenarios included;
+        # kilobytes on Linux, bytes on macOS
+        'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (
+            1024.0 * 1024 if sys.platform == 'darwin' else 1024.0),
+        'peak_traced_mb': None if peak is None else peak / (1024.0 * 1024),
+    }
+
+
+def _ms(seconds):
+    return '-' if seconds is None else '%.1f' % (seconds * 1000)
+
+
+def format_report(results):
+    """
+    Return the results of `run_scenario` as text table.
+    """
+    lines = ['%-8s %-7s %4s %7s %8s %8s %8s %8s %6s %6s %7s' % (
+        'scenario', 'mode', 'cli', 'ops', 'ops/s', 'p50 ms', 'p95 ms', 'p99 ms',
+        'err %', 'cpu %', '+rss MB')]
+    for result in results:
+        rss = result['rss_growth_mb']
+        lines.append('%-8s %-7s %4d %7d %8.1f %8s %8s %8s %6.2f %6.1f %7s' % (
+            result['scenario'], result['mode'], result['clients'], result['operations'],
+            result['throughput'], _ms(result['p50']), _ms(result['p95']), _ms(result['p99']),
+            result['error_rate'] * 100, result['cpu_percent'], '-' if rss is None else '%+.1f' % rss))
+        for name, stats in sorted(result['per_operation'].items()):
+            lines.append('  %-14s %7d ops  p50 %8s ms  p99 %8s ms  %d errors' % (
+                name, stats['count'], _ms(stats['p50']), _ms(stats['p99']), stats['errors']))
+        if result['errors']:
+            lines.append('  errors: ' + ', '.join(
+                '%s %d' % item for item in sorted(result['errors'].items())))
+        if result['peak_traced_mb'] is not None:
+            lines.append('  peak Python allocations: %.1f MB' % result['peak_traced_mb'])
+    return '\n'.join(lines)
+
+
+def _serve(queue, options):
+    from .fakeserver import serve
+    _server, url = serve(**options)
+    queue.put(url)
+    while True:
+        time.sleep(3600)
+
+
+def set_faults(url, **faults):
+    """
+    Change the faults (see `fakeserver.FAULTS`) of the stand-in server at `url`.
+    """
+    from .lazy import requests
+    requests.put(url + '/_fake/faults', json=faults).raise_for_status()
+
+
+def start_fake_server(**options):
+    """
+    Start a stand-in server (options of `fakeserver.FakeSeafile`)
+    in a separate process, so that its CPU time and memory don’t count
+    as the client’s. Return the process and the server’s URL
+    """
+    import multiprocessing
+    context = multiprocessing.get_context('spawn')
+    queue = context.Queue()
+    process = context.Process(target=_serve, args=(queue, options), daemon=True)
+    process.start()
+    return process, queue.get(timeout=30)
+
+
+def main(argv=None):
+    import argparse
+    import json
+    from .seafilefs import SeafileFS
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS),
+                        help='scenario to run, may be repeated (default: all)')
+    parser.add_argument('--clients', type=int, action='append',
+                        help='number of clients, may be repeated (default: 8)')
+    parser.add_argument('--mode', choices=('threads', 'asyncio'), default='threads')
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds per scenario')
+    parser.add_argument('--trace-memory', action='store_true',
+                        help='measure peak Python allocations (slower)')
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    parser.add_argument('--large-size', type=int, default=8 * 1024 * 1024)
+    parser.add_argument('--server', help='real server URL (default: a local stand-in)')
+    parser.add_argument('--username', default='test@example.com')
+    parser.add_argument('--password', default='test')
+    parser.add_argument('--library', default='My Library')
+    parser.add_argument('--latency', type=float, default=0.005,
+                        help='stand-in: seconds added to every response')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='stand-in: share of requests answered with 500')
+    parser.add_argument('--throttle-rate', type=float, default=0.0,
+                        help='stand-in: share of requests answered with 429')
+    parser.add_argument('--capacity', type=int, default=None,
+                        help='stand-in: concurrent requests before answering 429')
+    parser.add_argument('connection', nargs='*', metavar='key=value',
+                        help='further Connection or SeafileFS options, e.g. max_concurrency=16')
+    args = parser.parse_args(argv)
+
+    process = None
+    server = args.server
+    if server is None:
+        process, server = start_fake_server()
+    options = {}
+    for option in args.connection:
+        key, _, value = option.partition('=')
+        try:
+            options[key] = json.loads(value)
+        except ValueError:
+            options[key] = value
+
+    def make_fs():
+        return SeafileFS(server=server, username=args.username,
+                         password=args.password, **options)
+
+    try:
+        root = '/%s/loadtest-%d' % (args.library, time.time())
+        with make_fs() as fs:
+            data = create_dataset(fs, root, large_size=args.large_size)
+        results = []
+        for scenario in args.scenario or sorted(SCENARIOS):
+            for clients in args.clients or [8]:
+                filesystems = [make_fs() for _ in range(clients)]
+                if process is not None:
+                    # faults only while the clients run
+                    set_faults(server, latency=args.latency, error_rate=args.error_rate,
+                               throttle_rate=args.throttle_rate, capacity=args.capacity)
+                try:
+                    results.append(run_scenario(filesystems, data, scenario, args.duration,
+                                                args.mode, args.trace_memory))
+                finally:
+                    if process is not None:
+                        set_faults(server, latency=0, error_rate=0.0,
+                                   throttle_rate=0.0, capacity=None)
+                    for fs in filesystems:
+                        fs.close()
+                if not args.json:
+                    print(format_report(results[-1:]))
+        if args.json:
+            print(json.dumps(results, indent=2))
+        if args.server is not None:
+            with make_fs() as fs:
+                fs.removetree(root)
+    finally:
+        if process is not None:
+            process.terminate()
+
+
+if __name__ == '__main__':
+    main()
@@ -99,6 +99,15 @@ class SeaFileFile(io.RawIOBase):
         self.pos = self.pos + size if size != -1 else self.__length_hint__()
         return self.data.read(size)
 
+    def readinto(self, b):
+        if not self.mode.reading:
+            raise IOError("File is not in read mode")
+        bytes_read = self.data.readinto(b)
+        self.pos += bytes_read
+        return bytes_read
+
+    readinto1 = readinto
+
     def seekable(self):
         return True
 
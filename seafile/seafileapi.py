@@ -1,8 +1,23 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 import os
+import re
+import json
+import mmap
+import codecs
+import collections
+import hashlib
+import contextlib
+import uuid
 import logging
-import requests
+import threading
+import time
+import weakref
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from .cache import CommitCache
+from .lazy import requests
+from .limiter import shared_limiter
 
 # logging.basicConfig(
 #    level=logging.INFO,
@@ -35,6 +50,185 @@ STATUS_CODES = {
 # token = json.loads(the_page)['token']
 
 
+class RangeIgnored(IOError):
+    """
+    The server (or a proxy) answered a ranged request with the whole file.
+    """
+
+
+class StreamPart(object):
+    """
+    Part of a `MultipartUpload` with `size` bytes read from `fileobj`.
+    """
+
+    def __init__(self, fileobj, size):
+        self.fileobj = fileobj
+        self.size = size
+        self.sent = 0
+
+    def __len__(self):
+        return self.size
+
+    def read(self, size):
+        data = self.fileobj.read(min(size, self.size - self.sent))
+        if not data and self.sent < self.size:
+            raise IOError('Upload source ended after %d of %d bytes' % (self.sent, self.size))
+        self.sent += len(data)
+        return data
+
+    def release(self):
+        pass
+
+
+class MultipartUpload(object):
+    """
+    Streamed multipart/form-data body with some `fields` and `files`,
+    a list of (filename, buffer), sent from the buffers
+    (bytes, memoryview, mmap...) without copying them,
+    or of (filename, fileobj, size), read from the file-like `fileobj`.
+    Can be posted as `data` by requests.
+    """
+
+    def __init__(self, fields, files, boundary=None):
+        self.boundary = boundary or uuid.uuid4().hex
+        head = ''
+        for key, val in fields.items():
+            head += '--%s\r\nContent-Disposition: form-data; name="%s"\r\n\r\n%s\r\n' % (
+                self.boundary, key, val)
+        self._parts = []
+        for file in files:
+            filename = file[0]
+            head += ('--%s\r\nContent-Disposition: form-data; name="file"; filename="%s"\r\n'
+                     'Content-Type: application/octet-stream\r\n\r\n') % (self.boundary, filename)
+            if len(file) == 3:
+                view = StreamPart(file[1], file[2])
+            else:
+                view = memoryview(file[1])
+                if view.ndim != 1 or view.format != 'B':
+                    view = view.cast('B')
+            self._parts += [memoryview(head.encode('utf-8')), view]
+            head = '\r\n'
+        tail = head + '--%s--\r\n' % self.boundary
+        self._parts.append(memoryview(tail.encode('utf-8')))
+        self._part = 0
+        self._offset = 0
+
+    def close(self):
+        """
+        Release the views on the buffer, so that it can be closed.
+        """
+        for part in self._parts:
+            part.release()
+
+    @property
+    def content_type(self):
+        return 'multipart/form-data; boundary=%s' % self.boundary
+
+    def __len__(self):
+        return sum(len(part) for part in self._parts)
+
+    def read(self, size=-1):
+        """
+        Return the next `size` bytes of the body as memoryview (no copy).
+        """
+        if size is None or size < 0:
+            rest = [self.read(len(self))]
+            while rest[-1]:
+                rest.append(self.read(len(self)))
+            return b''.join(rest)
+        while self._part < len(self._parts):
+            part = self._parts[self._part]
+            if self._offset < len(part):
+                if isinstance(part, StreamPart):
+                    chunk = part.read(size)
+                else:
+                    chunk = part[self._offset:self._offset + size]
+                self._offset += len(chunk)
+                return chunk
+            self._part += 1
+            self._offset = 0
+        return b''
+
+
+def iter_json_array(response, chunk_size=65536):
+    """
+    Parse the JSON array body of a streamed `response` incrementally
+    and yield its elements as soon as they are complete,
+    so memory stays constant however long the array is.
+    """
+    decoder = json.JSONDecoder()
+    text = codecs.getincrementaldecoder(response.encoding or 'utf-8')()
+    whitespace = ' \t\r\n'
+    buf = ''
+    pos = 0
+    started = False
+    chunks = response.iter_content(chunk_size)
+    while True:
+        # skip whitespace, separators and the brackets of the array
+        while pos < len(buf) and buf[pos] in whitespace + ',':
+            pos += 1
+        if pos < len(buf):
+            if not started:
+                if buf[pos] != '[':
+                    raise ValueError('JSON array expected, got %r' % buf[pos:pos + 20])
+                started = True
+                pos += 1
+                continue
+            if buf[pos] == ']':
+                return
+            try:
+                element, end = decoder.raw_decode(buf, pos)
+            except ValueError:
+                pass  # incomplete element, read more
+            else:
+                # complete only if a separator follows: '3.' of '3.5' decodes as 3
+                after = end
+                while after < len(buf) and buf[after] in whitespace:
+                    after += 1
+                if after < len(buf) and buf[after] in ',]':
+                    yield element
+                    pos = after
+                    continue
+        chunk = next(chunks, None)
+        if chunk is None:
+            raise ValueError('Unterminated JSON array')
+        buf = buf[pos:] + text.decode(chunk)
+        pos = 0
+
+
+@contextlib.contextmanager
+def file_buffer(fileobj):
+    """
+    Yield the rest of the readable file-like `fileobj` as buffer:
+    memory-mapped for real files, the internal buffer of BytesIO,
+    else read into bytes.
+    """
+    if hasattr(fileobj, 'getbuffer'):
+        with fileobj.getbuffer() as buffer:
+            view = buffer[fileobj.tell():]
+            try:
+                yield view
+            finally:
+                view.release()
+        return
+    try:
+        fileno = fileobj.fileno()
+        fileobj.flush()
+        size = os.fstat(fileno).st_size
+    except (AttributeError, IOError, OSError):
+        size = None
+    if not size:
+        yield fileobj.read()
+        return
+    offset = fileobj.tell()
+    with mmap.mmap(fileno, 0, access=mmap.ACCESS_READ) as mapped:
+        view = memoryview(mapped)[offset:]
+        try:
+            yield view
+        finally:
+            view.release()
+
+
 class Connection:
 
     defaults = {
@@ -43,13 +237,25 @@ class Connection:
         'password': 'demo',
         'auth_token': None,
         'headers': {'Accept': 'application/json; charset=utf-8; indent=4'},
-        'open': False
+        'open': False,
+        'pool_size': 10,
+        'cache_interval': 30,
+        'missing_ttl': 5,
+        'max_concurrency': 64,
+        'coalesce': True,
+        'timeout': 120,
+        'hedge': None,
+        'hedge_budget': 0.05,
+        'transport': None
     }
 
     def _update(self, **kwargs):
         for key, val in self.defaults.items():
             if key in kwargs:
                 val = kwargs[key]
+            if isinstance(val, dict):
+                # don’t share mutable defaults between connections
+                val = dict(val)
             self.__dict__[key] = val
 
     def __init__(self, **kwargs):
@@ -60,77 +266,395 @@ class Connection:
         'password': ;)
         'auth_token': in case you already got that, then username and password are obsolete
         'headers': default should be good
+        'pool_size': max. number of pooled HTTP connections per host
+        'cache_interval': seconds between checks of a library’s head commit
+            by `cache`, None disables caching
+        'missing_ttl': seconds to remember paths that don’t exist, 0 disables
+        'max_concurrency': max. number of concurrent requests to the server
+            (at most `pool_size`); the actual limit adapts to its responses,
+            None disables the limit
+        'coalesce': concurrent identical GET requests share one response
+        'timeout': seconds to wait for the server to connect or send data,
+            per request (default 120); see also `deadline`
+        'hedge': percentile (e.g. 95) of the latencies of recent API GET requests
+            after which a second, hedged request is sent if there’s no response yet
+            (default None: no hedging)
+        'hedge_budget': max. share of hedged requests (default 0.05)
+        'transport': HTTP adapter to send requests with, e.g. a
+            `transport.RecordingTransport` or `ReplayTransport`, or its spec
+            like 'record:FILE', 'replay:FILE' (default None: the network)
         """
         self._update(**kwargs)
+        if isinstance(self.transport, str):
+            from .transport import open_transport
+            self.transport = open_transport(self.transport)
+        self.libraries = None
+        self._setup()
         if 'auth_token' in kwargs and kwargs['auth_token']:
             # no need to 'connect'
             self.headers['Authorization'] = 'Token ' + kwargs['auth_token']
             self.open = True  # TODO: check?
 
+    # state that doesn’t travel with pickles
+    _local_state = ('_connect_lock', '_session', '_request', 'cache', 'limiter',
+                    '_flights', '_flights_lock', 'coalesced', '_local',
+                    '_latencies', '_hedge_executor', '_hedgeable', 'hedged', '_writes')
+
+    def _setup(self):
+        """
+        Create locks and caches; the HTTP session is created on first use.
+        """
+        self._connect_lock = threading.RLock()
+        self._session = None
+        self._flights = {}  # key of GET request in flight: Future of its response
+        self._flights_lock = threading.Lock()
+        self._writes = 0  # number of finished requests that may change something
+        self.coalesced = 0
+        self._local = threading.local()  # deadline of the thread
+        self._latencies = collections.deque(maxlen=200)  # of recent API GET requests
+        self._hedge_executor = None
+        self._hedgeable = 0
+        self.hedged = 0
+        self.cache = CommitCache(self, self.cache_interval, self.missing_ttl)
+        self.limiter = None
+        if self.max_concurrency:
+            # more requests than pooled connections would open and discard connections
+            limit = min(self.pool_size, self.max_concurrency)
+            self.limiter = shared_limiter(self.server, limit, limit)
+
+    def __getstate__(self):
+        """
+        Pickle server, credentials, token and library index,
+        so that e.g. process pool workers don’t need to log in again.
+        """
+        return dict((key, val) for key, val in self.__dict__.items() if key not in self._local_state)
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._setup()
+
+    @property
+    def session(self):
+        """
+        `requests.Session` with a pool of `pool_size` connections,
+        or sending with `transport`.
+        """
+        if self._session is None:
+            with self._connect_lock:
+                if self._session is None:
+                    session = requests.Session()
+                    adapter = self.transport
+                    if adapter is None:
+                        adapter = requests.adapters.HTTPAdapter(
+                            pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+                    session.mount('http://', adapter)
+                    session.mount('https://', adapter)
+                    self._session = session
+        return self._session
+
+    @contextlib.contextmanager
+    def deadline(self, seconds=None, at=None):
+        """
+        Let all requests of this thread within the block end before `seconds`
+        from now (or the time `at`), also those of compound operations like
+        `account_create`, walks or parallel downloads. Every request’s
+        timeout is cut to the time left, requests after the deadline raise
+        `requests.exceptions.Timeout`. Nested deadlines can only be earlier.
+        """
+        previous = getattr(self._local, 'deadline', None)
+        if at is None and seconds is not None:
+            at = time.time() + seconds
+        if at is None or previous is not None and previous < at:
+            at = previous
+        self._local.deadline = at
+        try:
+            yield at
+        finally:
+            self._local.deadline = previous
+
+    def _remaining(self):
+        """
+        Return the seconds left until the deadline of this thread (or None),
+        raise `requests.exceptions.Timeout` if it passed.
+        """
+        deadline = getattr(self._local, 'deadline', None)
+        if deadline is None:
+            return None
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            raise requests.exceptions.Timeout('Deadline exceeded')
+        return remaining
+
+    def _call_within(self, deadline, function, *args, **kwargs):
+        """
+        Call `function` with the `deadline` of another thread.
+        """
+        with self.deadline(at=deadline):
+            return function(*args, **kwargs)
+
+    def bind_deadline(self, function):
+        """
+        Return `function` wrapped to run within the deadline of this thread,
+        e.g. for worker threads.
+        """
+        deadline = getattr(self._local, 'deadline', None)
+
+        def within_deadline(*args, **kwargs):
+            return self._call_within(deadline, function, *args, **kwargs)
+
+        return within_deadline
+
+    def _send(self, method, url, **kwargs):
+        """
+        Send a request with the session, within the concurrency limit
+        of the server and the deadline of this thread (or `timeout`).
+        Streamed responses keep their slot until closed; meanwhile
+        their thread may send more requests.
+        """
+        if method in ('GET', 'HEAD', 'OPTIONS'):
+            return self._send_limited(method, url, **kwargs)
+        try:
+            return self._send_limited(method, url, **kwargs)
+        finally:
+            # GET requests in flight may have started before the change
+            with self._flights_lock:
+                self._writes += 1
+
+    def _send_limited(self, method, url, **kwargs):
+        remaining = self._remaining()
+        timeout = kwargs.get('timeout', self.timeout)
+        if remaining is not None:
+            if isinstance(timeout, tuple):
+                timeout = tuple(remaining if t is None else min(t, remaining) for t in timeout)
+            else:
+                timeout = remaining if timeout is None else min(timeout, remaining)
+        kwargs['timeout'] = timeout
+        limiter = self.limiter if kwargs.pop('limit', True) else None
+        if limiter is None:
+            return self.session.request(method, url, **kwargs)
+        stream = bool(kwargs.get('stream'))
+        # contents take their time, only the latency of API requests tells about load
+        timed = not (stream or 'Range' in (kwargs.get('headers') or {}) or
+                     isinstance(kwargs.get('data'), MultipartUpload))
+        wait = remaining
+        if wait is None:
+            wait = (max(timeout) if isinstance(timeout, tuple) else timeout) or self.defaults['timeout']
+        start = limiter.acquire(wait, stream)
+        if start is None:
+            raise requests.exceptions.Timeout('Timed out waiting for a free connection')
+        owner = threading.get_ident() if stream else None
+        try:
+            r = self.session.request(method, url, **kwargs)
+        except requests.exceptions.RequestException:
+            limiter.done(start, error=True)
+            limiter.release(owner)
+            raise
+        except BaseException:
+            limiter.release(owner)
+            raise
+        limiter.done(start, r.status_code, timed=timed)
+        if not stream:
+            limiter.release()
+            return r
+        release = weakref.finalize(r, limiter.release, owner)
+        close = r.close
+
+        def close_and_release():
+            try:
+                close()
+            finally:
+                release()
+
+        r.close = close_and_release
+        return r
+
+    def metrics(self):
+        """
+        Return a dict of the current concurrency limit and request counters,
+        including the number of GET requests that shared a response
+        and of hedged requests.
+        """
+        metrics = {'concurrency_limit': None}
+        if self.limiter is not None:
+            metrics = self.limiter.metrics()
+        metrics['coalesced'] = self.coalesced
+        metrics['hedged'] = self.hedged
+        return metrics
+
     def connect(self, **kwargs):
-        kwargs.update(self.__dict__)
-        data = {
-            'username': kwargs['username'],
-            'password': kwargs['password']
-            }
-        logging.debug('Connect as %s' % data)
-        self._request = requests.post(
-            kwargs['server'] + '/api2/auth-token/',
-            data=data,
-            headers=kwargs['headers'])
-        logging.info('CONNECT Status %d, Headers %s' % (self._request.status_code, self._request.headers))
+        """
+        Log in and get a new auth token.
+        Only one thread at a time logs in.
+        """
+        with self._connect_lock:
+            kwargs.update(self.__dict__)
+            data = {
+                'username': kwargs['username'],
+                'password': kwargs['password']
+                }
+            logging.debug('Connect as %s' % data)
+            self._request = self._send(
+                'POST',
+                kwargs['server'] + '/api2/auth-token/',
+                data=data,
+                headers=kwargs['headers'])
+            logging.info('CONNECT Status %d, Headers %s' % (self._request.status_code, self._request.headers))
+            try:
+                self.auth_token = self._request.json()['token']
+                # replace, don’t change the headers other threads are sending
+                headers = dict(self.headers)
+                headers['Authorization'] = 'Token ' + self.auth_token
+                self.headers = headers
+                logging.debug('Headers: %s' % self.headers)
+                self.open = True
+            except KeyError as e:
+                logging.error(e)
+                self.open = False
+            return self.open
+
+    def reconnect(self, token=None):
+        """
+        Log in again, unless another thread already replaced
+        the expired auth `token` while we were waiting.
+        """
+        with self._connect_lock:
+            if not self.open or self.auth_token == token:
+                return self.connect()
+            return self.open
+
+    def request(self, method, path='', **kwargs):
+        """
+        Send a `method` request to API `path` of the server
+        (kwargs like `requests.request`). Logs in if necessary
+        and once more if the auth token expired.
+        Concurrent identical GET requests (not streamed) wait for the first
+        one and share its response (or error), if `coalesce`, unless it
+        started before a write finished; they are hedged, if `hedge`.
+        """
+        if method != 'GET' or kwargs.get('stream'):
+            return self._api_request(method, path, **kwargs)
+        if not self.coalesce:
+            return self._hedged_request(method, path, **kwargs)
+        key = (path, json.dumps(kwargs, sort_keys=True, default=str))
+        with self._flights_lock:
+            # no flight from before our last write
+            key = (self._writes,) + key
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = Future()
+            else:
+                self.coalesced += 1
+        if not leader:
+            try:
+                return flight.result(self._remaining())
+            except FutureTimeoutError:
+                raise requests.exceptions.Timeout('Deadline exceeded')
         try:
-            self.auth_token = self._request.json()['token']
-            self.headers['Authorization'] = 'Token ' + self.auth_token
-            logging.debug('Headers: %s' % self.headers)
-            self.open = True
-        except KeyError as e:
-            logging.error(e)
-            self.open = False
-        return self.open
+            r = self._hedged_request(method, path, **kwargs)
+        except BaseException as error:
+            with self._flights_lock:
+                del self._flights[key]
+            flight.set_exception(error)
+            raise
+        with self._flights_lock:
+            del self._flights[key]
+        flight.set_result(r)
+        return r
 
-    def get_request(self, path='', params={}):
+    def _hedge_delay(self):
+        """
+        Return the seconds to wait before hedging a request,
+        or None if it shouldn’t be hedged.
+        """
+        if not self.hedge:
+            return None
+        with self._flights_lock:
+            self._hedgeable += 1
+            spent = self.hedged >= self.hedge_budget * self._hedgeable
+        latencies = sorted(self._latencies)
+        if len(latencies) < 20 or spent:
+            return None
+        return latencies[min(len(latencies) - 1, int(len(latencies) * self.hedge / 100.0))]
+
+    def _hedged_request(self, method, path='', **kwargs):
+        """
+        Send an idempotent request; if there’s no response after the `hedge`
+        percentile of recent latencies, send it once more and return
+        the first successful response.
+        """
+        delay = self._hedge_delay()
+        started = time.time()
+        if delay is None:
+            r = self._api_request(method, path, **kwargs)
+            self._latencies.append(time.time() - started)
+            return r
+        if self._hedge_executor is None:
+            with self._connect_lock:
+                if self._hedge_executor is None:
+                    self._hedge_executor = ThreadPoolExecutor(max_workers=self.pool_size)
+        deadline = getattr(self._local, 'deadline', None)
+
+        def submit():
+            return self._hedge_executor.submit(
+                self._call_within, deadline, self._api_request, method, path, **kwargs)
+
+        first = submit()
+        first.add_done_callback(lambda future: self._latencies.append(time.time() - started))
+        pending = set([first])
+        done, _pending = wait(pending, timeout=delay)
+        if not done:
+            with self._flights_lock:
+                hedge = self.hedged < self.hedge_budget * self._hedgeable
+                if hedge:
+                    self.hedged += 1
+            if hedge:
+                logging.info('Hedging GET %s after %.3f s' % (path, delay))
+                pending.add(submit())
+        error = None
+        while pending:
+            done, pending = wait(pending, timeout=self._remaining(), return_when=FIRST_COMPLETED)
+            if not done:
+                raise requests.exceptions.Timeout('Deadline exceeded')
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+                error = error or future.exception()
+        raise error
+
+    def _api_request(self, method, path='', **kwargs):
         if not self.open:
-            self.connect()
-        r = requests.get(
-            self.server + path,
-            params=params,
-            headers=self.headers)
-        logging.info('GET %d %s %s' % (r.status_code, r.url, r.headers))
+            self.reconnect()
+        for attempt in (0, 1):
+            token = self.auth_token
+            r = self._send(
+                method,
+                self.server + path,
+                headers=self.headers,
+                **kwargs)
+            logging.info('%s %d %s %s' % (method[:3], r.status_code, r.url, r.headers))
+            if r.status_code != 401 or attempt or not self.username:
+                break
+            r.close()
+            self.reconnect(token)
+        if not r.ok and kwargs.get('stream'):
+            # read the error and free the connection of streamed responses
+            r.content
+            r.close()
         r.raise_for_status()
         return r
 
+    def get_request(self, path='', params={}):
+        return self.request('GET', path, params=params)
+
     def post_request(self, path='', params={}):
-        if not self.open:
-            self.connect()
-        r = requests.post(
-            self.server + path,
-            data=params,
-            headers=self.headers)
-        logging.info('POST %d %s %s' % (r.status_code, r.url, r.headers))
-        r.raise_for_status()
-        return r
+        return self.request('POST', path, data=params)
 
     def put_request(self, path='', params={}):
-        if not self.open:
-            self.connect()
-        r = requests.put(
-            self.server + path,
-            data=params,
-            headers=self.headers)
-        logging.info('PUT %d %s %s' % (r.status_code, r.url, r.headers))
-        r.raise_for_status()
-        return r
+        return self.request('PUT', path, data=params)
 
     def delete_request(self, path=''):
-        if not self.open:
-            self.connect()
-        r = requests.delete(
-            self.server + path,
-            headers=self.headers)
-        logging.info('DEL %d %s %s' % (r.status_code, r.url, r.headers))
-        r.raise_for_status()
-        return r
+        return self.request('DELETE', path)
 
     def server_version(self):
         """
@@ -213,6 +737,31 @@ class Connection:
             path += '?type=' + typ
         return self.get_request(path).json()
 
+    def library_list_iter(self, typ=None):
+        """
+        Like `library_list`, but yield the library dicts while they arrive.
+        """
+        path = '/api2/repos/'
+        if typ:
+            path += '?type=' + typ
+        with self.request('GET', path, stream=True) as r:
+            for lib in iter_json_array(r):
+                yield lib
+
+    def library_index(self, refresh=False):
+        """
+        Return dict of the current user’s libraries by id and by name,
+        listed only once per connection (or on `refresh`).
+        """
+        if self.libraries is None or refresh:
+            libraries = {}
+            for lib in self.library_list():
+                # find libraries by id or name
+                libraries[lib['id']] = lib
+                libraries[lib['name']] = lib
+            self.libraries = libraries
+        return self.libraries
+
     def library_info(self, lib_id):
         """
         Get information for library with id (hash) `lib_id`
@@ -230,7 +779,14 @@ class Connection:
             "type": "repo"
         }
         """
-        return self.get_request('/api2/repos/%s/' % lib_id)
+        return self.get_request('/api2/repos/%s/' % lib_id).json()
+
+    def library_head(self, lib_id):
+        """
+        Return the head commit id of library `lib_id`.
+        It changes whenever anything in the library changes.
+        """
+        return self.library_info(lib_id)['root']
 
     def library_get_default(self):
         """
@@ -281,13 +837,15 @@ class Connection:
             params['username'] = share_to
         return self.put_request('/api2/repos/%s/dir/shared_items/' % lib_id, params)
 
-    def file_find(self, lib_id='all', query='', typ='all', extension='', permissions=False):
+    def file_find(self, lib_id='all', query='', typ='all', extension='', permissions=False,
+                  page=None, per_page=None):
         """
         Search for files in library `lib_id` or 'all',
         containing `query` (in name or content),
         with `typ` Text, Document, Image, Video, Audio, PDF, Markdown
         (one of those or 'all') or with `extension`.
         Also return `permissions`?
+        `page`, `per_page`: page of the results (default: first 10)
         """
         valid_types = ('Text', 'Document', 'Image', 'Video', 'Audio', 'PDF', 'Markdown')
         data = {
@@ -298,17 +856,83 @@ class Connection:
         data['search_ftypes'] = 'all'
         if typ != 'all':
             data['search_ftypes'] = 'custom'
-            if type in valid_types:
+            if typ in valid_types:
                 data['ftype'] = typ
             if extension:
                 data['input_fexts'] = extension
+        if page is not None:
+            data['page'] = page
+        if per_page is not None:
+            data['per_page'] = per_page
         return self.get_request('/api2/search/', params=data).json()
 
-    def file_download(self, lib_id, filename):
+    def file_download(self, lib_id, filename, reuse=False):
         """
         Generate download link for `filename` of `lib_id`
+        `reuse`: link may be used more than once (e.g. for ranged reads)
+        """
+        path = '/api2/repos/%s/file/?p=%s' % (lib_id, filename)
+        if reuse:
+            path += '&reuse=1'
+        return self.get_request(path).json()
+
+    def file_read_range(self, link, start, stop):
+        """
+        Read bytes `start` up to `stop` (exclusive) from download `link`.
+        Raise `RangeIgnored` (without downloading the file) if the server
+        ignores the range.
         """
-        return self.get_request('/api2/repos/%s/file/?p=%s' % (lib_id, filename)).json()
+        r = self._send(
+            'GET',
+            link,
+            headers={'Range': 'bytes=%d-%d' % (start, stop - 1)},
+            stream=True)
+        logging.info('GET %d %s %s' % (r.status_code, r.url, r.headers))
+        with r:
+            r.raise_for_status()
+            if r.status_code != 206:
+                raise RangeIgnored('Server ignored range request for %s' % link)
+            return r.content
+
+    def file_readinto_range(self, link, start, buffer):
+        """
+        Read up to len(`buffer`) bytes from offset `start` of download `link`
+        straight into the writable `buffer`.
+        Raise `RangeIgnored` if the server ignores the range.
+        Return number of bytes read
+        """
+        view = memoryview(buffer).cast('B')
+        r = self._send(
+            'GET',
+            link,
+            headers={'Range': 'bytes=%d-%d' % (start, start + len(view) - 1)},
+            stream=True)
+        logging.info('GET %d %s %s' % (r.status_code, r.url, r.headers))
+        try:
+            r.raise_for_status()
+            if r.status_code != 206:
+                raise RangeIgnored('Server ignored range request for %s' % link)
+            count = 0
+            while count < len(view):
+                read = r.raw.readinto(view[count:])
+                if not read:
+                    break
+                count += read
+            return count
+        finally:
+            r.close()
+
+    def file_stream(self, link):
+        """
+        Return the streamed response of download `link`, to be read
+        from its `raw` file object and closed.
+        """
+        r = self._send('GET', link, stream=True)
+        logging.info('GET %d %s %s' % (r.status_code, r.url, r.headers))
+        if not r.ok:
+            r.close()
+        r.raise_for_status()
+        return r
 
     def file_move(self, lib_id, filename, targetdir='/', targetlib=None):
         """
@@ -331,10 +955,111 @@ class Connection:
         """
         return self.delete_request('/api2/repos/%s/file/?p=%s' % (lib_id, filename)).json()
 
+    def file_download_fileobj(self, lib_id, filename, fileobj, chunk_size=65536):
+        """
+        Download `filename` (path) of library `lib_id` into the
+        writable file-like `fileobj`.
+        Return number of bytes written
+        """
+        link = self.file_download(lib_id, filename)
+        r = self._send('GET', link, stream=True)
+        logging.info('GET %d %s %s' % (r.status_code, r.url, r.headers))
+        with r:
+            r.raise_for_status()
+            size = 0
+            for chunk in r.iter_content(chunk_size):
+                fileobj.write(chunk)
+                size += len(chunk)
+        return size
+
+    def file_download_parallel(self, lib_id, filename, destination, size=None,
+                               parts=4, part_size=8 * 1024 * 1024, retries=3):
+        """
+        Download `filename` (path) of library `lib_id` into `destination`
+        (local path or file object with a file descriptor),
+        fetching byte ranges of `part_size` over up to `parts` pooled connections
+        and writing them in place. A failed range is resumed up to `retries` times.
+        `size` defaults to the size from `file_info`; raise ValueError if the file
+        on the server has another size (it changed), IOError if the server
+        ignores or garbles the ranges.
+        Return number of bytes written
+        """
+        if size is None:
+            size = self.file_info(lib_id, filename)['size']
+        link = self.file_download(lib_id, filename, reuse=True)
+        if isinstance(destination, str):
+            fd = os.open(destination, os.O_WRONLY | os.O_CREAT, 0o666)
+            close = True
+        else:
+            destination.flush()
+            fd = destination.fileno()
+            close = False
+        write_lock = threading.Lock()
+
+        def write(data, offset):
+            if hasattr(os, 'pwrite'):
+                return os.pwrite(fd, data, offset)
+            with write_lock:
+                os.lseek(fd, offset, os.SEEK_SET)
+                return os.write(fd, data)
+
+        def check_range(r, offset):
+            if r.status_code != 206:
+                raise RangeIgnored('Server ignored range request for %s' % filename)
+            match = re.match(r'bytes (\d+)-\d+/(\d+|\*)$', r.headers.get('Content-Range', ''))
+            if match is None or int(match.group(1)) != offset:
+                raise IOError('Unexpected range %r of %s' % (r.headers.get('Content-Range'), filename))
+            if match.group(2) != '*' and int(match.group(2)) != size:
+                raise ValueError('%s has %s bytes, not %d' % (filename, match.group(2), size))
+
+        def fetch(start, stop):
+            offset = start
+            for attempt in range(retries + 1):
+                try:
+                    r = self._send(
+                        'GET',
+                        link,
+                        headers={'Range': 'bytes=%d-%d' % (offset, stop - 1)},
+                        stream=True)
+                    logging.info('GET %d %s %s' % (r.status_code, r.url, r.headers))
+                    with r:
+                        r.raise_for_status()
+                        check_range(r, offset)
+                        for chunk in r.iter_content(65536):
+                            if offset + len(chunk) > stop:
+                                raise IOError('Range %d-%d of %s is too long' % (start, stop, filename))
+                            view = memoryview(chunk)
+                            while view:
+                                written = write(view, offset)
+                                view = view[written:]
+                                offset += written
+                    if offset >= stop:
+                        return offset - start
+                    logging.warning('Range %d-%d of %s ended at %d' % (start, stop, filename, offset))
+                except (requests.exceptions.RequestException, IOError) as e:
+                    if attempt >= retries or isinstance(e, RangeIgnored):
+                        raise
+                    logging.warning('Retrying range %d-%d of %s: %s' % (offset, stop, filename, e))
+            raise IOError('Range %d-%d of %s incomplete' % (start, stop, filename))
+
+        try:
+            os.ftruncate(fd, size)
+            ranges = [(start, min(start + part_size, size)) for start in range(0, size, part_size)]
+            deadline = getattr(self._local, 'deadline', None)
+            with ThreadPoolExecutor(max_workers=max(1, min(parts, len(ranges)))) as executor:
+                written = sum(executor.map(lambda r: self._call_within(deadline, fetch, *r), ranges))
+            if written != size:
+                raise IOError('Downloaded %d of %d bytes of %s' % (written, size, filename))
+            return written
+        finally:
+            if close:
+                os.close(fd)
+
     def file_upload(self, lib_id, filepath, target_dir='/', target_filename=''):
         """
         Upload the file at local `filepath` as `target_filename`
         (or original name) into `target_dir` of library `lib_id`.
+        The file is sent memory-mapped, not read into memory.
         Return file info dict
         """
         if not target_filename:
@@ -343,9 +1068,28 @@ class Connection:
             logging.error('File not found: %s' % filepath)
             return False
         logging.info('Uploading "%s" to library "%s" as "%s"' % (filepath, lib_id, target_filename))
+        with open(filepath, 'rb') as fileobj:
+            return self.file_upload_fileobj(lib_id, fileobj, target_dir, target_filename)
+
+    def file_upload_fileobj(self, lib_id, fileobj, target_dir='/', target_filename='', replace=False):
+        """
+        Upload the content of the readable file-like `fileobj` as `target_filename`
+        into `target_dir` of library `lib_id`.
+        Real files are memory-mapped, BytesIO buffers are sent without copying.
+        `replace` overwrites an existing file of the same name.
+        Return file info dict
+        """
+        with file_buffer(fileobj) as buffer:
+            return self.file_upload_buffer(lib_id, buffer, target_dir, target_filename, replace)
+
+    def file_upload_buffer(self, lib_id, buffer, target_dir='/', target_filename='', replace=False):
+        """
+        Upload `buffer` (bytes, memoryview, mmap...) as `target_filename`
+        into `target_dir` of library `lib_id` without copying it.
+        `replace` overwrites an existing file of the same name.
+        Return file info dict
+        """
         # get upload link
-        # TODO: check first if file exists, then update
-        # https://cloud.seafile.com/api2/repos/{repo-id}/update-link/?p=/update-dir
         # https://cloud.seafile.com/api2/repos/{repo-id}/upload-link/?p=/upload-dir
         g = self.get_request('/api2/repos/%s/upload-link/?p=%s' % (lib_id, target_dir))
         # post file data
@@ -353,11 +1097,110 @@ class Connection:
             'parent_dir': target_dir,
             'ret-json': 1
             }
-        r = requests.post(
-            g.json(),
-            data=data,
-            files={'file': open(filepath, 'rb')},
-            headers=self.headers)
+        if replace:
+            data['replace'] = 1
+        return self._post_multipart(g.json(), data, [(target_filename, buffer)])
+
+    def file_upload_link(self, lib_id, target_dir='/'):
+        """
+        Return a link to upload files into `target_dir` of library `lib_id`.
+        """
+        return self.get_request('/api2/repos/%s/upload-link/?p=%s' % (lib_id, target_dir)).json()
+
+    def file_upload_stream(self, lib_id, fileobj, size, target_dir='/', target_filename='',
+                           replace=False, mtime=None, link=None):
+        """
+        Upload `size` bytes read from the readable file-like `fileobj`
+        (e.g. a pipe) as `target_filename` into `target_dir` of library `lib_id`,
+        streamed while they are read.
+        `mtime`: modification time (seconds since the epoch) to keep,
+        if the server supports it
+        `link`: upload link from `file_upload_link`; with a link, the upload
+        doesn’t wait for the concurrency limit, since it runs under the slot
+        of the download that feeds it
+        Return file info dict
+        """
+        limit = link is None
+        if link is None:
+            link = self.file_upload_link(lib_id, target_dir)
+        data = {
+            'parent_dir': target_dir,
+            'ret-json': 1
+            }
+        if replace:
+            data['replace'] = 1
+        if mtime is not None:
+            data['last_modify'] = time.strftime('%Y-%m-%dT%H:%M:%S+00:00', time.gmtime(mtime))
+        return self._post_multipart(link, data, [(target_filename, fileobj, size)], limit=limit)
+
+    def file_upload_blocks(self, lib_id, fileobj, target_dir='/', target_filename='',
+                           replace=False, block_size=1024 * 1024, batch_size=8 * 1024 * 1024):
+        """
+        Upload the content of the readable file-like `fileobj` as `target_filename`
+        into `target_dir` of library `lib_id`, block by block:
+        split it into blocks of `block_size`, ask the server which block ids
+        (SHA1 of the content) it already has, upload only the missing ones
+        (in requests of about `batch_size`), then commit the file.
+        Blocks are fixed-size, so changes in place deduplicate well,
+        insertions shift all following blocks.
+        Return dict of 'size', 'blocks', 'sent' and 'saved' bytes
+        """
+        with file_buffer(fileobj) as buffer:
+            view = memoryview(buffer).cast('B')
+            blocks = {}  # block id: view
+            try:
+                size = len(view)
+                block_ids = []
+                for offset in range(0, size, block_size):
+                    block = view[offset:offset + block_size]
+                    block_id = hashlib.sha1(block).hexdigest()
+                    block_ids.append(block_id)
+                    blocks.setdefault(block_id, block)
+                # which blocks are missing, where to upload them and commit the file?
+                r = self.post_request(
+                    '/api2/repos/%s/upload-blks-link/?p=%s' % (lib_id, target_dir),
+                    params={'blklist': ','.join(blocks)}).json()
+                link = r['commiturl']
+                missing = [block_id for block_id in r['blklist'] if block_id in blocks]
+                sent = 0
+                batch = []
+                for index, block_id in enumerate(missing):
+                    batch.append((block_id, blocks[block_id]))
+                    if sum(len(b) for _, b in batch) >= batch_size or index == len(missing) - 1:
+                        self._post_multipart(r['rawblksurl'], {}, batch)
+                        sent += sum(len(b) for _, b in batch)
+                        batch = []
+                data = {
+                    'parent_dir': target_dir,
+                    'file_name': target_filename,
+                    'file_size': size,
+                    'blockids': json.dumps(block_ids),
+                    'commitonly': 'true',
+                    'replace': 1 if replace else 0
+                    }
+                r = self._send('POST', link, data=data, headers=self.headers)
+                logging.info('POST %d %s %s' % (r.status_code, r.url, r.headers))
+                r.raise_for_status()
+            finally:
+                for block in blocks.values():
+                    block.release()
+                view.release()
+        logging.info('Uploaded %s: %d of %d bytes sent, %d saved' % (
+            target_filename, sent, size, size - sent))
+        return {'size': size, 'blocks': len(block_ids), 'sent': sent, 'saved': size - sent}
+
+    def _post_multipart(self, url, fields, files, limit=True):
+        """
+        Post `fields` and `files` (list of (filename, buffer)) to `url`
+        as streamed multipart body; `limit`: within the concurrency limit.
+        """
+        body = MultipartUpload(fields, files)
+        headers = dict(self.headers)
+        headers['Content-Type'] = body.content_type
+        try:
+            r = self._send('POST', url, data=body, headers=headers, limit=limit)
+        finally:
+            body.close()
         logging.info('POST %d %s %s' % (r.status_code, r.url, r.headers))
         r.raise_for_status()
         return r
@@ -373,8 +1216,10 @@ class Connection:
             "size": 22
         }
         """
-        return self.get_request('/api2/repos/%s/file/detail/?p=%s' % (
-            lib_id, filepath), params).json()
+        params = {
+            'p': filepath
+            }
+        return self.get_request('/api2/repos/%s/file/detail/' % lib_id, params).json()
 
     def dir_list(self, lib_id, root='/'):
         """
@@ -385,6 +1230,17 @@ class Connection:
             }
         return self.get_request('/api2/repos/%s/dir/' % lib_id, params).json()
 
+    def dir_list_iter(self, lib_id, root='/'):
+        """
+        Like `dir_list`, but yield the entry dicts while they arrive.
+        """
+        params = {
+            'p': root
+            }
+        with self.request('GET', '/api2/repos/%s/dir/' % lib_id, params=params, stream=True) as r:
+            for entry in iter_json_array(r):
+                yield entry
+
     def dir_tree(self, lib_id, root='/'):
         """
         Return the whole directory tree (without files)
@@ -393,26 +1249,125 @@ class Connection:
         params = {
             'p': root,
             't': 'd',
-            'recursive': True
+            'recursive': 1
             }
         return self.get_request('/api2/repos/%s/dir/' % lib_id, params).json()
 
-    def dir_create(self, lib_id, dirname, root='/'):
+    def dir_tree_iter(self, lib_id, root='/'):
+        """
+        Like `dir_tree`, but yield the directory dicts while they arrive.
+        """
+        params = {
+            'p': root,
+            't': 'd',
+            'recursive': 1
+            }
+        with self.request('GET', '/api2/repos/%s/dir/' % lib_id, params=params, stream=True) as r:
+            for entry in iter_json_array(r):
+                yield entry
+
+    def dir_walk_iter(self, lib_id, root='/'):
+        """
+        Yield the dicts of all files and directories below `root` of library `lib_id`
+        (with their 'parent_dir') from one recursive listing, while they arrive.
+        """
+        params = {
+            'p': root,
+            'recursive': 1
+            }
+        with self.request('GET', '/api2/repos/%s/dir/' % lib_id, params=params, stream=True) as r:
+            for entry in iter_json_array(r):
+                yield entry
+
+    def dir_create(self, lib_id, dirname, root='/', create_parents=False):
         """
         Create a directory `dirname` below `root` of library `lib_id`
+        `create_parents`: also create missing parent directories
+        (and leave an existing directory alone) in one call
         """
         logging.info('Creating new directory "%s" in Library %s' % (root+dirname, lib_id))
         data = {
             # 'p': root + dirname,
             'operation': 'mkdir'
             }
+        if create_parents:
+            data['create_parents'] = 'true'
         return self.post_request('/api2/repos/%s/dir/?p=%s' % (lib_id, root+dirname), params=data)
 
     def dir_delete(self, lib_id, dirname):
         """
-        Delete a directory `dirname` of library `lib_id`
+        Delete a directory `dirname` (path) of library `lib_id`
+        """
+        return self.delete_request('/api2/repos/%s/dir/?p=/%s' % (lib_id, dirname.lstrip('/')))
+
+    def dir_zip_task(self, lib_id, parent_dir, dirents):
+        """
+        Start zipping the files and directories `dirents` (names) in directory
+        `parent_dir` of library `lib_id` on the server.
+        Return the token of the zip task
+        """
+        params = {
+            'parent_dir': parent_dir,
+            'dirents': list(dirents)
+            }
+        return self.get_request('/api/v2.1/repos/%s/zip-task/' % lib_id, params).json()['zip_token']
+
+    def dir_zip_progress(self, token):
+        """
+        Return the progress dict ('zipped', 'total', 'failed'...) of zip task `token`.
         """
-        return self.delete_request('/api2/repos/%s/%s/' % (lib_id, dirname))
+        return self.get_request('/api/v2.1/query-zip-progress/', {'token': token}).json()
+
+    def dir_zip_link(self, lib_id, dirname, poll_interval=0.5, timeout=None):
+        """
+        Let the server zip directory `dirname` (path) of library `lib_id`
+        (the root directory zips all its entries)
+        and return the download link of the archive as soon as it’s ready.
+        Raise IOError if zipping fails or takes longer than `timeout` seconds.
+        """
+        dirname = '/' + dirname.strip('/')
+        if dirname == '/':
+            parent_dir, dirents = '/', [entry['name'] for entry in self.dir_list(lib_id, '/')]
+        else:
+            parent_dir, dirents = os.path.dirname(dirname), [os.path.basename(dirname)]
+        token = self.dir_zip_task(lib_id, parent_dir, dirents)
+        started = time.time()
+        while True:
+            progress = self.dir_zip_progress(token)
+            if progress.get('failed'):
+                raise IOError('Zipping %s failed: %s' % (dirname, progress.get('failed_reason')))
+            if progress.get('zipped', 0) >= progress.get('total', 0):
+                break
+            if timeout is not None and time.time() - started > timeout:
+                raise IOError('Zipping %s took longer than %s s' % (dirname, timeout))
+            time.sleep(poll_interval)
+        return '%s/seafhttp/zip/%s' % (self.server, token)
+
+    def dir_zip_iter(self, lib_id, dirname, chunk_size=65536, **kwargs):
+        """
+        Yield the zip archive of directory `dirname` (path) of library `lib_id`
+        in chunks while it arrives. kwargs are those of `dir_zip_link`.
+        """
+        r = self._send('GET', self.dir_zip_link(lib_id, dirname, **kwargs), stream=True)
+        logging.info('GET %d %s %s' % (r.status_code, r.url, r.headers))
+        with r:
+            r.raise_for_status()
+            for chunk in r.iter_content(chunk_size):
+                yield chunk
+
+    def dir_download_zip(self, lib_id, dirname, fileobj, chunk_size=65536, **kwargs):
+        """
+        Download directory `dirname` (path) of library `lib_id` as zip archive
+        into the writable file-like `fileobj` (a file, pipe or socket),
+        streamed, with a few requests however many files it contains.
+        kwargs are those of `dir_zip_link`.
+        Return number of bytes written
+        """
+        size = 0
+        for chunk in self.dir_zip_iter(lib_id, dirname, chunk_size, **kwargs):
+            fileobj.write(chunk)
+            size += len(chunk)
+        return size
 
     def accounts_list(self):
         """
@@ -424,6 +1379,18 @@ class Connection:
             }
         return self.get_request('/api2/accounts/', params).json()
 
+    def accounts_list_iter(self):
+        """
+        (Admin only) Like `accounts_list`, but yield the account dicts while they arrive.
+        """
+        params = {
+            'start': -1,
+            'limit': -1
+            }
+        with self.request('GET', '/api2/accounts/', params=params, stream=True) as r:
+            for account in iter_json_array(r):
+                yield account
+
     def account_create(self, email, password, name='', staff=False, groups=()):
         """
         Create new user account (admin only)
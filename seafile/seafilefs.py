@@ -1,39 +1,416 @@
 # -*- coding: utf-8 -*-
+import io
 import os
+import itertools
+import contextlib
+import shutil
+import threading
+import tempfile
+import time
+import weakref
+from concurrent.futures import Future, ThreadPoolExecutor
+from fs import errors, tools
 from fs.base import FS
 from fs.enums import ResourceType
 from fs.errors import FileExpected, ResourceNotFound
 from fs.info import Info
 from fs.mode import Mode
+from fs.opener import manage_fs
 from fs.subfs import SubFS
 from fs.time import datetime_to_epoch, epoch_to_datetime
-from .seafileapi import Connection
+from fs.path import basename, dirname, join
+from .lazy import requests
+from .seafileapi import Connection, RangeIgnored
+from .globbing import GlobMatch, compile_pattern, is_wild
+from .unzip import iter_zip
+from .writeback import WriteBackQueue
 # from seafile.files import DownloadError, FileMetadata, FolderMetadata, WriteMode
 # from seafile.exceptions import ApiError
-from fs_s3fs._s3fs import S3File
 
 
-class SeafileFile(S3File):
+@contextlib.contextmanager
+def seafile_errors(path):
+    """Translate Seafile API errors to FSErrors."""
+    try:
+        yield
+    except requests.exceptions.HTTPError as error:
+        status = error.response.status_code if error.response is not None else None
+        if status == 404:
+            raise errors.ResourceNotFound(path, exc=error)
+        elif status == 403:
+            raise errors.PermissionDenied(path, exc=error)
+        raise errors.OperationFailed(path, exc=error)
+    except requests.exceptions.RequestException as error:
+        raise errors.RemoteConnectionError(path, exc=error, msg='%s' % error)
+
+
+class SeafileFile(io.IOBase):
     """
-    Proxy for a Seafile file, backed by a temporary local file.
-    Inherits without changes from `fs_s3fs._s3fs.S3File`
-    by Will McGugan, MIT license,
+    Proxy for a Seafile file, backed by a temporary local file;
+    `on_close(proxy)` is called instead of closing it.
+    Follows `S3File` of fs_s3fs by Will McGugan, MIT license,
     see https://github.com/PyFilesystem/s3fs
     """
-    pass
+
+    @classmethod
+    def factory(cls, filename, mode, on_close):
+        """Create a SeafileFile backed by a temporary file."""
+        return cls(tempfile.TemporaryFile(), filename, mode, on_close=on_close)
+
+    def __init__(self, f, filename, mode, on_close=None):
+        self._f = f
+        self._filename = filename
+        self._mode = mode
+        self._on_close = on_close
+
+    def __repr__(self):
+        return "<SeafileFile %r %r>" % (self._filename, str(self._mode))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def raw(self):
+        return self._f
+
+    def close(self):
+        if self._on_close is not None:
+            self._on_close(self)
+
+    @property
+    def closed(self):
+        return self._f.closed
+
+    def fileno(self):
+        return self._f.fileno()
+
+    def flush(self):
+        return self._f.flush()
+
+    def isatty(self):
+        return self._f.isatty()
+
+    def readable(self):
+        return self._mode.reading
+
+    def readline(self, limit=-1):
+        return self._f.readline(limit)
+
+    def readlines(self, hint=-1):
+        return self._f.readlines(hint)
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence not in (os.SEEK_CUR, os.SEEK_END, os.SEEK_SET):
+            raise ValueError("invalid value for 'whence'")
+        self._f.seek(offset, whence)
+        return self._f.tell()
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._f.tell()
+
+    def writable(self):
+        return self._mode.writing
+
+    def writelines(self, lines):
+        if not self._mode.writing:
+            raise IOError('not open for writing')
+        return self._f.writelines(lines)
+
+    def read(self, n=-1):
+        if not self._mode.reading:
+            raise IOError('not open for reading')
+        return self._f.read(n)
+
+    def readall(self):
+        return self.read()
+
+    def readinto(self, b):
+        if not self._mode.reading:
+            raise IOError('not open for reading')
+        return self._f.readinto(b)
+
+    readinto1 = readinto
+
+    def write(self, b):
+        if not self._mode.writing:
+            raise IOError('not open for writing')
+        self._f.write(b)
+        return len(b)
+
+    def truncate(self, size=None):
+        if size is None:
+            size = self._f.tell()
+        self._f.truncate(size)
+        return size
+
+
+class SeafileReadFile(io.RawIOBase):
+    """
+    Streamed, read-only handle of a Seafile file, fetched in blocks
+    of `block_size` bytes with ranged requests.
+    As long as reads are sequential, up to `readahead` following blocks
+    are prefetched on a background thread; random access stops prefetching
+    until reads become sequential again.
+    If the server ignores ranges, the rest is read from one plain download
+    (opened again only to seek backwards).
+    """
+
+    def __init__(self, connection, lib_id, path, size, block_size=1024 * 1024, readahead=4):
+        super(SeafileReadFile, self).__init__()
+        self.connection = connection
+        self.lib_id = lib_id
+        self.path = path
+        self.size = size
+        self.block_size = block_size
+        self.readahead = readahead
+        self.pos = 0
+        self._link = None
+        self._blocks = {}  # block index: Future
+        self._last_block = -1
+        self._executor = None
+        self._lock = threading.Lock()
+        self._whole = False  # the server ignores ranges
+        self._stream = None  # plain download then
+        self._stream_pos = 0
+
+    def __repr__(self):
+        return "<SeafileReadFile %s:%s>" % (self.lib_id, self.path)
+
+    def _stop_prefetching(self):
+        with self._lock:
+            for future in self._blocks.values():
+                future.cancel()
+            self._blocks.clear()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def _read_stream(self, view):
+        """Read into `view` at the current position from the plain download."""
+        if self._stream is None or self._stream_pos > self.pos:
+            if self._stream is not None:
+                self._stream.close()
+            self._stream = self._with_link(self.connection.file_stream)
+            self._stream_pos = 0
+        raw = self._stream.raw
+        while self._stream_pos < self.pos:
+            skipped = raw.read(min(self.pos - self._stream_pos, 1024 * 1024))
+            if not skipped:
+                return 0
+            self._stream_pos += len(skipped)
+        count = 0
+        while count < len(view):
+            read = raw.readinto(view[count:])
+            if not read:
+                break
+            count += read
+        self._stream_pos += count
+        return count
+
+    def _with_link(self, method, *args):
+        """Call `method(link, *args)`, renewing an expired download link once."""
+        for attempt in (0, 1):
+            if self._link is None or attempt:
+                self._link = self.connection.file_download(self.lib_id, self.path, reuse=True)
+            try:
+                return method(self._link, *args)
+            except requests.exceptions.HTTPError as error:
+                if attempt or error.response is None or error.response.status_code not in (403, 404):
+                    raise
+
+    def _fetch(self, index):
+        """Download block `index`."""
+        start = index * self.block_size
+        stop = min(start + self.block_size, self.size)
+        return self._with_link(self.connection.file_read_range, start, stop)
+
+    def _schedule(self, index):
+        """Start prefetching the blocks following `index`."""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1)
+        last = min(index + self.readahead, (self.size - 1) // self.block_size)
+        for _index in range(index + 1, last + 1):
+            if _index not in self._blocks:
+                self._blocks[_index] = self._executor.submit(self._fetch, _index)
+
+    def _block(self, index):
+        """Return the content of block `index`, prefetching if reads are sequential."""
+        with self._lock:
+            sequential = index in (self._last_block, self._last_block + 1)
+            self._last_block = index
+            for _index in list(self._blocks):
+                # keep only the current block and the read-ahead window
+                if _index < index or not sequential and _index != index:
+                    self._blocks.pop(_index).cancel()
+            future = self._blocks.get(index)
+            if sequential and self.readahead:
+                self._schedule(index)
+        if future is not None:
+            data = future.result()
+        else:
+            data = self._fetch(index)
+            if sequential:
+                with self._lock:
+                    self._blocks[index] = _done(data)
+        return data
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        if self.closed:
+            raise ValueError('I/O operation on closed file')
+        if self.pos >= self.size:
+            return 0
+        if not self._whole:
+            try:
+                count = self._readinto_ranged(b)
+            except RangeIgnored:
+                self._stop_prefetching()
+                self._whole = True
+        if self._whole:
+            view = memoryview(b).cast('B')
+            count = self._read_stream(view[:min(len(view), self.size - self.pos)])
+        self.pos += count
+        return count
+
+    def _readinto_ranged(self, b):
+        index, offset = divmod(self.pos, self.block_size)
+        with self._lock:
+            direct = index not in self._blocks and index not in (self._last_block, self._last_block + 1)
+        if direct:
+            # random access: read straight into the caller’s buffer
+            with self._lock:
+                self._last_block = index
+                for future in self._blocks.values():
+                    future.cancel()
+                self._blocks.clear()
+            view = memoryview(b).cast('B')
+            view = view[:min(len(view), self.size - self.pos)]
+            count = self._with_link(self.connection.file_readinto_range, self.pos, view)
+        else:
+            data = self._block(index)
+            count = min(len(b), len(data) - offset)
+            if count <= 0:
+                return 0
+            memoryview(b).cast('B')[:count] = memoryview(data)[offset:offset + count]
+        return count
+
+    readinto1 = readinto
+
+    def seekable(self):
+        return True
+
+    def seek(self, pos, whence=os.SEEK_SET):
+        if whence == os.SEEK_SET:
+            if pos < 0:
+                raise ValueError('Negative seek position {}'.format(pos))
+            self.pos = pos
+        elif whence == os.SEEK_CUR:
+            self.pos = max(0, self.pos + pos)
+        elif whence == os.SEEK_END:
+            self.pos = max(0, self.size + pos)
+        else:
+            raise ValueError("invalid value for 'whence'")
+        return self.pos
+
+    def tell(self):
+        return self.pos
+
+    def close(self):
+        if not self.closed:
+            self._stop_prefetching()
+            if self._stream is not None:
+                self._stream.close()
+        super(SeafileReadFile, self).close()
+
+
+def _done(result):
+    """Return a finished Future of `result`."""
+    future = Future()
+    future.set_result(result)
+    return future
+
+
+class PathLocks(object):
+    """
+    Reentrant locks per path, created on demand
+    and dropped as soon as nobody holds them.
+    """
+
+    def __init__(self):
+        self._locks = weakref.WeakValueDictionary()
+        self._lock = threading.Lock()
+
+    def __call__(self, path):
+        with self._lock:
+            lock = self._locks.get(path)
+            if lock is None:
+                lock = self._locks[path] = threading.RLock()
+            return lock
 
 
 class SeafileFS(FS):
+
+    # longer directory listings are streamed, but not cached
+    cache_listing_size = 10000
+
     def __init__(self, **kwargs):
         """
         kwargs = kwargs of `seafileapi.Connection`:
         'server': including protocol and port, e.g. https://cloud.seafile.com:9999
         'username': email address
         'password': ;)
+        'cache_interval': seconds between checks of a library’s head commit,
+            None disables caching (default 30)
+        or 'connection': an existing `seafileapi.Connection` to share
+        (with its pool, token, library index and caches)
+        other kwargs:
+        'cache_content_size': max. size of files whose contents are cached
+            in memory (default 1 MiB)
+        'read_block_size': size of ranged requests of streamed reads (default 1 MiB)
+        'readahead': number of blocks prefetched by sequential reads (default 4, 0 disables)
+        'download_parts': number of concurrent ranged requests of `getfile` (default 4)
+        'download_part_size': size of these ranges (default 8 MiB)
+        'write_back': max. number of closed files waiting for their upload
+            in the background (default 0: upload on close)
+        'write_back_workers': number of background upload threads (default 2)
+        'dedup_upload_size': min. size of files uploaded block by block,
+            sending only blocks the server doesn’t have (default None: off)
+        'upload_block_size': size of these blocks (default 1 MiB)
+        'index': file name of a SQLite index of library trees for `search`
+            (':memory:' for one that isn’t kept, default None: no index)
+        'index_max_age': max. age in seconds of `search` results (default 60)
+        'content_cache': directory of a cache of file contents by file id,
+            may be shared by processes (default None: no cache)
+        'content_cache_size': max. size of this cache in bytes (default 1 GiB)
         """
         super().__init__()
-        self.connection = Connection(**kwargs)
-        self.connection.connect()
+        self.cache_content_size = kwargs.pop('cache_content_size', 1024 * 1024)
+        self.read_block_size = kwargs.pop('read_block_size', 1024 * 1024)
+        self.readahead = kwargs.pop('readahead', 4)
+        self.download_parts = kwargs.pop('download_parts', 4)
+        self.download_part_size = kwargs.pop('download_part_size', 8 * 1024 * 1024)
+        self.dedup_upload_size = kwargs.pop('dedup_upload_size', None)
+        self.upload_block_size = kwargs.pop('upload_block_size', 1024 * 1024)
+        self.upload_saved = 0  # bytes not sent thanks to block deduplication
+        write_back = kwargs.pop('write_back', 0)
+        write_back_workers = kwargs.pop('write_back_workers', 2)
+        index = kwargs.pop('index', None)
+        index_max_age = kwargs.pop('index_max_age', 60)
+        content_cache = kwargs.pop('content_cache', None)
+        content_cache_size = kwargs.pop('content_cache_size', 1024 * 1024 * 1024)
+        self.connection = kwargs.pop('connection', None)
+        if self.connection is None:
+            self.connection = Connection(**kwargs)
+        if not self.connection.open:
+            self.connection.connect()
         _meta = self._meta = {
             "case_insensitive": False,
             "invalid_path_chars": ":",  # not sure what else
@@ -41,85 +418,249 @@ class SeafileFS(FS):
             "max_sys_path_length": None,  # there's no syspath
             "network": True,
             "read_only": False,
-            "supports_rename": False  # since we don't have a syspath...
+            "supports_rename": False,  # since we don't have a syspath...
+            "thread_safe": True
         }
-        self.libraries = {}
-        self._get_libraries()
+        # writes lock only their path, not the whole filesystem
+        self._path_locks = PathLocks()
+        self.cache = self.connection.cache
+        self.libraries = self.connection.library_index()
+        self._write_back = None
+        if write_back:
+            self._write_back = WriteBackQueue(self._upload_queued, write_back, write_back_workers)
+        self.index = None
+        if index:
+            from .index import MetadataIndex
+            self.index = MetadataIndex(self.connection, index, index_max_age)
+        self.content_cache = None
+        if content_cache:
+            from .contentcache import ContentCache
+            self.content_cache = ContentCache(content_cache, content_cache_size)
 
     def __repr__(self):
         return "<SeafileFS>"
 
+    def __getstate__(self):
+        """
+        Pickle the settings and the connection (with token and library index),
+        but no locks and caches, e.g. for process pool workers.
+        """
+        state = self.__dict__.copy()
+        for key in ('_lock', '_path_locks', 'cache', '_write_back'):
+            state.pop(key, None)
+        if self._write_back is not None:
+            state['_write_back'] = (self._write_back.size, self._write_back.workers)
+        return state
+
+    def __setstate__(self, state):
+        write_back = state.pop('_write_back', None)
+        self.__dict__.update(state)
+        self._lock = threading.RLock()
+        self._path_locks = PathLocks()
+        self.cache = self.connection.cache
+        self._write_back = None
+        if write_back:
+            self._write_back = WriteBackQueue(self._upload_queued, *write_back)
+
     """
     The following methods MUST be implemented in a PyFilesystem interface.
 
     (√) getinfo() Get info regarding a file or directory.
     √ listdir() Get a list of resources in a directory.
     √ makedir() Make a directory.
-    openbin() Open a binary file.
+    √ openbin() Open a binary file.
     √ remove() Remove a file.
     √ removedir() Remove a directory.
     setinfo() Set resource information.
     """
 
-    def _get_libraries(self):
-        libs = self.connection.library_list()
-        for lib in libs:
-            # find libraries by id or name
-            self.libraries[lib['id']] = lib
-            self.libraries[lib['name']] = lib
-
     def _get_lib_id_and_path(self, path):
+        """
+        Split `path` into library id and absolute path within the library.
+        """
         parts = list(e for e in path.split('/') if e)
+        if not parts:
+            raise ResourceNotFound(path, None, 'No library in "%s"' % path)
         lib = parts[0]
         if lib in self.libraries:
-            return self.libraries[lib]['id'], '/'.join(parts[1:])
+            return self.libraries[lib]['id'], '/' + '/'.join(parts[1:])
         raise ResourceNotFound(path, None, 'Unknown library "%s"' % lib)
 
     def _get_lib_id(self, path):
         return self._get_lib_id_and_path(path)[0]
 
-    def getinfo(self, path, namespaces=None):
-        # namespaces: basic, details
-        # TODO: access, history, comments, stars
-        namespaces = namespaces or ()
-        _path = self.validatepath(path)
-        if not _path.startswith('/'):
-            _path = '/' + _path
-        _lib_id, _subpath = self._get_lib_id_and_path(_path)
-        _parts = list(e for e in _path.split('/') if e)
+    @staticmethod
+    def _info_from_entry(entry):
+        """
+        Make an `Info` from a file or directory dict of `file_info` or `dir_list`.
+        """
         info_dict = {
             "basic": {
-                "name": "",
-                "is_dir": True
+                "name": entry['name'],
+                "is_dir": entry.get('type', 'dir') != 'file'
             },
             "details": {
                 "accessed": None,
                 "created": None,
                 "metadata_changed": None,
-                "modified": None,
-                "size": 0,
+                "modified": entry.get('mtime'),
+                "size": entry.get('size', 0),
                 "type": ResourceType.directory
             }
         }
+        if 'id' in entry:
+            info_dict['basic']['id'] = entry['id']
+        if not info_dict['basic']['is_dir']:
+            info_dict['details']['type'] = ResourceType.file
+        return Info(info_dict)
+
+    def _get_listing(self, lib_id, path):
+        """
+        Return the (cached) list of entry dicts of directory `path` of library `lib_id`.
+        """
+        listing = self.cache.get(lib_id, 'listing', path)
+        if listing is None:
+            listing = self.connection.dir_list(lib_id, path)
+            self.cache.set(lib_id, 'listing', path, listing)
+        return listing
+
+    def _iter_listing(self, lib_id, path):
+        """
+        Yield the entry dicts of directory `path` of library `lib_id`
+        while they arrive, and cache listings that aren’t too long.
+        """
+        listing = self.cache.get(lib_id, 'listing', path)
+        if listing is not None:
+            for entry in listing:
+                yield entry
+            return
+        listing = []
+        for entry in self.connection.dir_list_iter(lib_id, path):
+            if listing is not None:
+                listing.append(entry)
+                if len(listing) > self.cache_listing_size:
+                    listing = None
+            yield entry
+        if listing is not None:
+            self.cache.set(lib_id, 'listing', path, listing)
+
+    def _get_entry(self, lib_id, path):
+        """
+        Return the (cached) entry dict of file or directory `path` of library `lib_id`.
+        """
+        if self.cache.is_missing(lib_id, path):
+            # without checking the head commit
+            raise ResourceNotFound(path)
+        entry = self.cache.get(lib_id, 'info', path)
+        if entry is not None:
+            return entry
+        parent, name = dirname(path), basename(path)
+        listing = self.cache.get(lib_id, 'listing', parent)
+        if listing is None:
+            try:
+                entry = self.connection.file_info(lib_id, path)
+            except requests.exceptions.HTTPError as error:
+                if error.response is None or error.response.status_code != 404:
+                    raise
+                # file details don’t work for directories, look into the parent
+                try:
+                    listing = self._get_listing(lib_id, parent)
+                except requests.exceptions.HTTPError as error:
+                    if error.response is None or error.response.status_code != 404:
+                        raise
+                    self.cache.add_missing(lib_id, parent)
+                    raise ResourceNotFound(path)
+        if listing is not None:
+            for _entry in listing:
+                if _entry['name'] == name:
+                    entry = _entry
+                    break
+            else:
+                self.cache.add_missing(lib_id, path)
+                raise ResourceNotFound(path)
+        self.cache.set(lib_id, 'info', path, entry)
+        if entry.get('type', 'dir') != 'file':
+            self.cache.add_dir(lib_id, path)
+        return entry
 
-        if len(_parts) == 1:  # library only
-            info = self.connection.library_info(_lib_id)
-            info_dict['basic']['name'] = info['name']
-            info_dict['details']['modified'] = info['mtime']
-            info_dict['details']['size'] = info['size']
-        elif _path == '/':
+    def getinfo(self, path, namespaces=None):
+        # namespaces: basic, details
+        # TODO: access, history, comments, stars
+        namespaces = namespaces or ()
+        _path = self.validatepath(path)
+        if _path == '/':
             # Root doesn’t really exist in SeaFile
-            pass
-        else:
-            info = self.connection.file_info(_lib_id, '/'.join(_parts[1:]))
-            info_dict['basic']['name'] = info['name']
-            info_dict['basic']['is_dir'] = info['type'] != 'file'
-            info_dict['basic']['id'] = info['id']
-            info_dict['details']['modified'] = info['mtime']
-            info_dict['details']['size'] = info['size']
-            if info['type'] == 'file':
-                info_dict['details']['type'] = ResourceType.file
-        return Info(info_dict)
+            return Info({
+                "basic": {
+                    "name": "",
+                    "is_dir": True
+                },
+                "details": {
+                    "type": ResourceType.directory
+                }
+            })
+        _lib_id, _subpath = self._get_lib_id_and_path(_path)
+        self._wait_for_upload(_path)
+        with seafile_errors(path):
+            if _subpath == '/':  # library only
+                info = self.cache.get(_lib_id, 'info', _subpath)
+                if info is None:
+                    info = self.connection.library_info(_lib_id)
+                    self.cache.set(_lib_id, 'info', _subpath, info)
+                return self._info_from_entry({
+                    'name': info['name'],
+                    'type': 'dir',
+                    'mtime': info['mtime'],
+                    'size': info['size']
+                })
+            return self._info_from_entry(self._get_entry(_lib_id, _subpath))
+
+    def getinfo_many(self, paths, namespaces=None, workers=None):
+        """
+        Return a dict of `Info` for every path of `paths`, None for missing ones.
+        Paths are grouped by library and parent directory, every parent
+        is listed once (from the cache if possible), up to `workers`
+        (default: `pool_size`) at a time.
+        """
+        result = {}
+        groups = {}  # (lib_id, parent): [(path, name)]
+        for path in paths:
+            _path = self.validatepath(path)
+            try:
+                lib_id, _subpath = self._get_lib_id_and_path(_path)
+            except ResourceNotFound:
+                result[path] = self.getinfo(path) if _path == '/' else None
+                continue
+            if _subpath == '/':
+                result[path] = self.getinfo(path)
+                continue
+            self._wait_for_upload(_path)
+            key = (lib_id, dirname(_subpath))
+            groups.setdefault(key, []).append((path, basename(_subpath)))
+
+        def listing(key):
+            lib_id, parent = key
+            if self.cache.is_missing(lib_id, parent):
+                return None
+            try:
+                return self._get_listing(lib_id, parent)
+            except requests.exceptions.HTTPError as error:
+                if error.response is None or error.response.status_code != 404:
+                    raise
+                self.cache.add_missing(lib_id, parent)
+                return None
+
+        keys = list(groups)
+        workers = workers or self.connection.pool_size
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(keys)))) as executor:
+            with seafile_errors('/'):
+                listings = list(executor.map(self.connection.bind_deadline(listing), keys))
+        for key, entries in zip(keys, listings):
+            entries = dict((entry['name'], entry) for entry in entries or ())
+            for path, name in groups[key]:
+                entry = entries.get(name)
+                result[path] = None if entry is None else self._info_from_entry(entry)
+        return result
 
     def setinfo(self, path, info):
         # seafile doesn't support changing any of the metadata values
@@ -127,97 +668,732 @@ class SeafileFS(FS):
         pass
 
     def listdir(self, path):
-        lib_id, path = self._get_lib_id_and_path(path)
-        return self.connection.dir_list(lib_id, path)
+        _path = self.validatepath(path)
+        if _path == '/':
+            return sorted(set(lib['name'] for lib in self.libraries.values()))
+        lib_id, _subpath = self._get_lib_id_and_path(_path)
+        with seafile_errors(path):
+            return [entry['name'] for entry in self._get_listing(lib_id, _subpath)]
+
+    def _path_lock(self, path):
+        """Return the lock for writes to `path`."""
+        return self._path_locks(self.validatepath(path))
+
+    @contextlib.contextmanager
+    def _paths_locked(self, *paths):
+        """Hold the locks of all `paths`, taken in sorted order."""
+        with contextlib.ExitStack() as stack:
+            for path in sorted(set(self.validatepath(path) for path in paths)):
+                stack.enter_context(self._path_locks(path))
+            yield
+
+    def _isdir(self, lib_id, path):
+        """
+        Tell if `path` of library `lib_id` is a directory, from the index
+        of known directories if possible.
+        """
+        if self.cache.is_dir(lib_id, path):
+            return True
+        try:
+            return self._info_from_entry(self._get_entry(lib_id, path)).is_dir
+        except ResourceNotFound:
+            return False
+
+    def scandir(self, path, namespaces=None, page=None):
+        """
+        Yield `Info` of the entries of directory `path` while the listing
+        arrives, without a request per entry.
+        """
+        _path = self.validatepath(path)
+
+        def entries():
+            if _path == '/':
+                for lib_id, lib in self.libraries.items():
+                    if lib_id == lib['id']:
+                        yield {'name': lib['name'], 'type': 'dir', 'mtime': lib.get('mtime'),
+                               'size': lib.get('size', 0)}
+                return
+            lib_id, _subpath = self._get_lib_id_and_path(_path)
+            with seafile_errors(path):
+                for entry in self._iter_listing(lib_id, _subpath):
+                    yield entry
+
+        infos = (self._info_from_entry(entry) for entry in entries())
+        if page is not None:
+            start, end = page
+            infos = itertools.islice(infos, start, end)
+        return infos
+
+    def glob(self, pattern, path='/', namespaces=None, case_sensitive=True, search=False):
+        """
+        Yield a `GlobMatch` (path, `Info`) for every file and directory
+        below `path` matching `pattern`, e.g. '*.txt' or '**/*.pdf'.
+
+        Literal parts of the pattern need no requests, wildcard parts
+        one listing of every matching directory and '**' one recursive
+        listing of the whole subtree; no entry needs a request of its own.
+        `search`: find '**/*.ext' patterns with the server’s search
+        (Seafile Professional), which can lag behind recent changes
+        """
+        segments = [segment for segment in pattern.strip('/').split('/') if segment]
+        if not segments:
+            return iter(())
+        return self._glob(self.validatepath(path), segments, case_sensitive, search)
+
+    def _glob(self, path, segments, case_sensitive, search):
+        segment, rest = segments[0], segments[1:]
+        if segment == '**':
+            for match in self._glob_tree(path, segments, case_sensitive, search):
+                yield match
+            return
+        if not is_wild(segment) and case_sensitive:
+            child = join(path, segment)
+            if rest:
+                matches = self._glob(child, rest, case_sensitive, search)
+            else:
+                try:
+                    matches = [GlobMatch(child, self.getinfo(child))]
+                except errors.ResourceNotFound:
+                    matches = []
+            for match in matches:
+                yield match
+            return
+        regex = compile_pattern(segment, case_sensitive)
+        try:
+            for info in self.scandir(path):
+                if not regex.match(info.name):
+                    continue
+                child = join(path, info.name)
+                if not rest:
+                    yield GlobMatch(child, info)
+                elif info.is_dir:
+                    for match in self._glob(child, rest, case_sensitive, search):
+                        yield match
+        except (errors.ResourceNotFound, errors.DirectoryExpected):
+            return
+
+    def _glob_tree(self, path, segments, case_sensitive, search, base=None):
+        """
+        Yield the matches of `segments` (from '**' on) relative to `base`
+        (default: `path`) below `path` from recursive listings.
+        """
+        base = (base or path).rstrip('/')
+        regex = compile_pattern('/'.join(segments), case_sensitive)
+        if path == '/':
+            for name in self.listdir('/'):
+                if regex.match(name):
+                    yield GlobMatch('/' + name, self.getinfo('/' + name))
+                for match in self._glob_tree('/' + name, segments, case_sensitive, search, '/'):
+                    yield match
+            return
+        extension = segments[-1][2:]
+        try:
+            lib_id, _subpath = self._get_lib_id_and_path(path)
+            if search and segments[:-1] == ['**'] and segments[-1][:2] == '*.' and not is_wild(extension):
+                entries = self._search_tree(lib_id, _subpath, extension)
+            else:
+                entries = self._walk_tree(lib_id, _subpath)
+            start = len(_subpath.rstrip('/'))
+            for entry_path, entry in entries:
+                match_path = path.rstrip('/') + entry_path[start:]
+                if regex.match(match_path[len(base) + 1:]):
+                    yield GlobMatch(match_path, self._info_from_entry(entry))
+        except (errors.ResourceNotFound, errors.DirectoryExpected):
+            return
+
+    def _walk_tree(self, lib_id, path):
+        """
+        Yield (path, entry dict) of everything below directory `path`
+        of library `lib_id` from one recursive listing.
+        """
+        with seafile_errors(path):
+            for entry in self.connection.dir_walk_iter(lib_id, path):
+                parent = '/' + entry.get('parent_dir', '/').strip('/')
+                yield parent.rstrip('/') + '/' + entry['name'], entry
+
+    def _search_tree(self, lib_id, path, extension, per_page=100):
+        """
+        Yield (path, entry dict) of the files with `extension` below directory
+        `path` of library `lib_id` from the server’s search.
+        """
+        prefix = path.rstrip('/') + '/'
+        page = 1
+        while True:
+            with seafile_errors(path):
+                found = self.connection.file_find(lib_id, query=extension, typ='custom',
+                                                  extension=extension, page=page, per_page=per_page)
+            for result in found.get('results', []):
+                if result['fullpath'].startswith(prefix) and not result.get('is_dir'):
+                    yield result['fullpath'], {
+                        'name': result['name'], 'type': 'file', 'size': result.get('size', 0),
+                        'mtime': result.get('last_modified')}
+            if not found.get('has_more'):
+                return
+            page += 1
+
+    def _index_scope(self, path):
+        """
+        Return (library path, library id, path within library)
+        of the indexed directories `path` stands for.
+        """
+        if self.index is None:
+            raise errors.Unsupported('SeafileFS was opened without index')
+        _path = self.validatepath(path)
+        if _path == '/':
+            return [('/' + lib['name'], lib_id, '/')
+                    for lib_id, lib in self.libraries.items() if lib_id == lib['id']]
+        lib_id, _subpath = self._get_lib_id_and_path(_path)
+        return [('/' + _path.strip('/').split('/')[0], lib_id, _subpath)]
+
+    def refresh_index(self, path='/', force=False):
+        """
+        Update the index of the libraries of `path` now if their head commit
+        moved (or if `force`), regardless of `index_max_age`.
+        """
+        for _lib_path, lib_id, _subpath in self._index_scope(path):
+            with seafile_errors(path):
+                commit, _checked = self.index.library_state(lib_id)
+                if force or commit is None or commit != self.connection.library_head(lib_id):
+                    self.index.refresh(lib_id, force=True)
+
+    def search(self, path='/', pattern=None, **conditions):
+        """
+        Yield (path, `Info`) of files and directories below directory `path`
+        matching `pattern` (e.g. '**/*.pdf') and `conditions` (`name`, `files`, `dirs`,
+        `min_size`, `max_size`, `modified_after`, `modified_before`, see `MetadataIndex.find`)
+        from the local index, which is not older than `index_max_age` seconds.
+        """
+        for lib_path, lib_id, _subpath in self._index_scope(path):
+            with seafile_errors(path):
+                entries = self.index.find(lib_id, _subpath, pattern, **conditions)
+            for entry in entries:
+                yield lib_path + entry['path'], self._info_from_entry(entry)
 
     def makedir(self, path, permissions=None, recreate=False):
-        # TODO: set permissions, check for errors
-        lib_id, path = self._get_lib_id_and_path(path)
-        self.connection.dir_create(lib_id, path)
-        return SubFS(self, path)
+        # TODO: set permissions
+        _path = self.validatepath(path)
+        lib_id, _subpath = self._get_lib_id_and_path(_path)
+        with self._path_lock(_path), seafile_errors(path):
+            if self._isdir(lib_id, _subpath):
+                if not recreate:
+                    raise errors.DirectoryExists(path)
+                return SubFS(self, _path)
+            if not self._isdir(lib_id, dirname(_subpath)):
+                raise errors.ResourceNotFound(path)
+            # with parents, Seafile doesn’t rename an existing directory
+            self.connection.dir_create(lib_id, _subpath.lstrip('/'), create_parents=True)
+        self.cache.invalidate(lib_id)
+        self.cache.add_dir(lib_id, _subpath)
+        return SubFS(self, _path)
+
+    def makedirs(self, path, permissions=None, recreate=False):
+        """
+        Make a directory and missing parents with one request.
+        Directories known to exist aren’t checked or created again.
+        """
+        _path = self.validatepath(path)
+        lib_id, _subpath = self._get_lib_id_and_path(_path)
+        with self._path_lock(_path), seafile_errors(path):
+            if self.cache.is_dir(lib_id, _subpath) or not recreate and self._isdir(lib_id, _subpath):
+                if not recreate:
+                    raise errors.DirectoryExists(path)
+                return SubFS(self, _path)
+            self.connection.dir_create(lib_id, _subpath.lstrip('/'), create_parents=True)
+        self.cache.invalidate(lib_id)
+        self.cache.add_dir(lib_id, _subpath)
+        return SubFS(self, _path)
 
     def remove(self, path):
-        lib_id, path = self._get_lib_id_and_path(path)
-        self.connection.file_delete(lib_id, path)
+        _path = self.validatepath(path)
+        lib_id, _subpath = self._get_lib_id_and_path(_path)
+        with self._path_lock(_path), seafile_errors(path):
+            dropped = self._drop_uploads(_path)
+            try:
+                self.connection.file_delete(lib_id, _subpath)
+            except requests.exceptions.HTTPError as error:
+                # a new file only written to the queue so far
+                if not dropped or error.response is None or error.response.status_code != 404:
+                    raise
+        self.cache.invalidate(lib_id)
+        self.cache.add_missing(lib_id, _subpath)
 
     def removedir(self, path):
-        lib_id, path = self._get_lib_id_and_path(path)
-        self.connection.dir_delete(lib_id, path)
+        _path = self.validatepath(path)
+        lib_id, _subpath = self._get_lib_id_and_path(_path)
+        with self._path_lock(_path), seafile_errors(path):
+            self._drop_uploads(_path, tree=True)
+            self.connection.dir_delete(lib_id, _subpath.lstrip('/'))
+        self.cache.invalidate(lib_id)
+        self.cache.discard_dir(lib_id, _subpath)
+        self.cache.add_missing(lib_id, _subpath)
+
+    def _open_cached(self, lib_id, path, info):
+        """
+        Return the content of file `path` of library `lib_id` (with `Info`
+        `info`) from the content cache, open for reading, downloading it
+        if it’s missing (or just evicted), or None if it can’t be cached.
+        """
+        file_id = info.get('basic', 'id')
+        if self.content_cache is None or not file_id or info.size > self.content_cache.max_size:
+            return None
+        cached = self.content_cache.get(file_id)
+        if cached is None:
+            def download(fileobj):
+                if self.download_parts > 1 and info.size > self.download_part_size:
+                    self.connection.file_download_parallel(
+                        lib_id, path, fileobj, size=info.size,
+                        parts=self.download_parts, part_size=self.download_part_size)
+                else:
+                    self.connection.file_download_fileobj(lib_id, path, fileobj)
+
+            cached = self.content_cache.add(file_id, download)
+        return cached
+
+    def _download(self, lib_id, path, fileobj, size=None, info=None):
+        """
+        Write the content of file `path` of library `lib_id` into `fileobj`,
+        from the content caches if possible.
+        """
+        cached = self._open_cached(lib_id, path, info) if info is not None else None
+        if cached is not None:
+            with cached:
+                shutil.copyfileobj(cached, fileobj)
+            return
+        content = self.cache.get(lib_id, 'content', path)
+        if content is None and size is not None and size <= self.cache_content_size:
+            data = io.BytesIO()
+            self.connection.file_download_fileobj(lib_id, path, data)
+            content = data.getvalue()
+            self.cache.set(lib_id, 'content', path, content)
+        if content is not None:
+            fileobj.write(content)
+        else:
+            self.connection.file_download_fileobj(lib_id, path, fileobj)
+
+    def _upload(self, lib_id, path, fileobj):
+        """
+        Upload `fileobj` as file `path` of library `lib_id`, replacing it.
+        Large files only send the blocks the server doesn’t have yet.
+        If the directory is gone (though known to exist), it’s made again
+        and the upload retried once.
+        """
+        start = fileobj.tell()
+        size = fileobj.seek(0, os.SEEK_END) - start
+        parent = dirname(path)
+        for attempt in (0, 1):
+            fileobj.seek(start)
+            try:
+                if self.dedup_upload_size is not None and size >= self.dedup_upload_size:
+                    stats = self.connection.file_upload_blocks(
+                        lib_id, fileobj, parent, basename(path), replace=True,
+                        block_size=self.upload_block_size)
+                    with self._lock:
+                        self.upload_saved += stats['saved']
+                else:
+                    self.connection.file_upload_fileobj(
+                        lib_id, fileobj, parent, basename(path), replace=True)
+                break
+            except requests.exceptions.HTTPError as error:
+                if (error.response is None or error.response.status_code != 404 or
+                        attempt or parent == '/'):
+                    raise
+                # the directory was removed behind our back: don’t take it
+                # for granted any more, make it again and retry once
+                self.cache.discard_dir(lib_id, parent)
+                self.connection.dir_create(lib_id, parent.lstrip('/'), create_parents=True)
+                self.cache.add_dir(lib_id, parent)
+        self.cache.invalidate(lib_id)
+        self.cache.discard_missing(lib_id, path)
+
+    def _upload_path(self, path, fileobj):
+        """
+        Upload `fileobj` as file `path`, replacing it.
+        """
+        _lib_id, _subpath = self._get_lib_id_and_path(path)
+        with self._path_lock(path), seafile_errors(path):
+            self._upload(_lib_id, _subpath, fileobj)
+
+    def _upload_queued(self, path, fileobj):
+        """
+        Upload `fileobj` from the write-back queue as file `path`: without
+        its lock, which writers waiting for the upload may hold (the queue
+        never runs two uploads of a path at the same time).
+        """
+        _lib_id, _subpath = self._get_lib_id_and_path(path)
+        with seafile_errors(path):
+            self._upload(_lib_id, _subpath, fileobj)
+
+    def _wait_for_upload(self, path):
+        """
+        Wait for a pending write-back upload of `path`, so that we read what we wrote.
+        """
+        if self._write_back is not None and self._write_back.pending(path):
+            self._write_back.wait(path)
+
+    def _drop_uploads(self, path, tree=False):
+        """
+        Drop pending write-back uploads of `path` (and below it if `tree`)
+        about to be removed, so they don’t bring it back.
+        Return number of dropped uploads
+        """
+        if self._write_back is None:
+            return 0
+        return self._write_back.discard(path, tree)
+
+    def metrics(self):
+        """
+        Return a dict of counters: those of `Connection.metrics`
+        (with the current `concurrency_limit`), bytes saved by deduplicated
+        uploads, content cache hits and misses, pending and replaced
+        write-back uploads.
+        """
+        metrics = self.connection.metrics()
+        metrics['upload_saved'] = self.upload_saved
+        if self.content_cache is not None:
+            metrics['content_cache_hits'] = self.content_cache.hits
+            metrics['content_cache_misses'] = self.content_cache.misses
+        if self._write_back is not None:
+            metrics['write_back_pending'] = len(self._write_back)
+            metrics['write_back_coalesced'] = self._write_back.coalesced
+        return metrics
+
+    def sync(self):
+        """
+        Wait until all write-back uploads are done
+        and raise the first error of failed uploads.
+        """
+        if self._write_back is not None:
+            self._write_back.sync()
+
+    flush = sync
+
+    def close(self):
+        if not self.isclosed() and self._write_back is not None:
+            self._write_back.close()
+        if not self.isclosed() and self.index is not None:
+            self.index.close()
+        super(SeafileFS, self).close()
 
     def openbin(self, path, mode="r", buffering=-1, **options):
-        # inherited from fs_s3fs
+        # following fs_s3fs
         _mode = Mode(mode)
         _mode.validate_bin()
         self.check()
         _path = self.validatepath(path)
-        _key = self._path_to_key(_path)
-
-        if _mode.create:
-
-            def on_close_create(sffile):
-                """Called when the SeaFile file closes, to upload data."""
-                try:
-                    sffile.raw.seek(0)
-                    with s3errors(path):
-                        self.connection.upload_fileobj(
-                            sffile.raw, self._bucket_name, _key
-                        )
-                finally:
-                    sffile.raw.close()
+        _lib_id, _subpath = self._get_lib_id_and_path(_path)
 
+        def on_close(sffile):
+            """Called when the Seafile file closes, to upload the data."""
+            if sffile.raw.closed:
+                return
+            if _mode.writing and self._write_back is not None:
+                # upload in the background, the queue closes the file
+                sffile.raw.seek(0, os.SEEK_SET)
+                self._write_back.put(_path, sffile.raw)
+                sffile._on_close = None
+                return
             try:
-                dir_path = dirname(_path)
-                if dir_path != '/':
-                    _dir_key = self._path_to_dir_key(dir_path)
-                    self._get_object(dir_path, _dir_key)
-            except errors.ResourceNotFound:
-                raise errors.ResourceNotFound(path)
+                if _mode.writing:
+                    sffile.raw.seek(0, os.SEEK_SET)
+                    self._upload_path(_path, sffile.raw)
+            finally:
+                sffile.raw.close()
 
-            try:
-                info = self._getinfo(path)
-            except errors.ResourceNotFound:
-                pass
-            else:
+        if _mode.create:
+            with seafile_errors(path):
+                if not self._isdir(_lib_id, dirname(_subpath)):
+                    raise errors.ResourceNotFound(path)
+
+            if _mode.truncate and not _mode.exclusive:
+                # replaced anyway, no need to look it up
+                if self.cache.is_dir(_lib_id, _subpath):
+                    raise errors.FileExpected(path)
+                info = None
+            elif (self._write_back is not None and not _mode.appending and
+                    self._write_back.pending(_path)):
+                # a file as soon as the pending upload is done,
+                # don’t wait for it, we’ll replace it anyway
                 if _mode.exclusive:
                     raise errors.FileExists(path)
-                if info.is_dir:
-                    raise errors.FileExpected(path)
-
-            sffile = SeafileFile.factory(path, _mode, on_close=on_close_create)
-            if _mode.appending:
+                info = None
+            else:
                 try:
-                    with s3errors(path):
-                        self.connection.download_fileobj(
-                            self._bucket_name, _key, sffile.raw
-                        )
+                    info = self.getinfo(_path)
                 except errors.ResourceNotFound:
-                    pass
+                    info = None
                 else:
-                    sffile.seek(0, os.SEEK_END)
+                    if _mode.exclusive:
+                        raise errors.FileExists(path)
+                    if info.is_dir:
+                        raise errors.FileExpected(path)
 
+            sffile = SeafileFile.factory(path, _mode, on_close=on_close)
+            if _mode.appending and info is not None:
+                with seafile_errors(path):
+                    self._download(_lib_id, _subpath, sffile.raw, info.size, info)
+                sffile.seek(0, os.SEEK_END)
             return sffile
 
-        if self.strict:
-            info = self.getinfo(path)
-            if info.is_dir:
-                raise errors.FileExpected(path)
+        info = self.getinfo(path)
+        if info.is_dir:
+            raise errors.FileExpected(path)
 
-        def on_close(sffile):
-            """Called when the S3 file closes, to upload the data."""
-            try:
-                if _mode.writing:
-                    sffile.raw.seek(0, os.SEEK_SET)
-                    with s3errors(path):
-                        self.connection.upload_fileobj(
-                            sffile.raw, self._bucket_name, _key
-                        )
-            finally:
-                sffile.raw.close()
+        if not _mode.writing and self.content_cache is not None:
+            with seafile_errors(path):
+                try:
+                    cached = self._open_cached(_lib_id, _subpath, info)
+                except requests.exceptions.RequestException:
+                    raise
+                except (IOError, ValueError) as error:
+                    raise errors.OperationFailed(path, exc=error)
+            if cached is not None:
+                return cached
+
+        if not _mode.writing and info.size > self.cache_content_size:
+            # large files are streamed instead of downloaded as a whole
+            block_size = options.get('block_size', self.read_block_size)
+            raw = SeafileReadFile(
+                self.connection, _lib_id, _subpath, info.size,
+                block_size=block_size, readahead=options.get('readahead', self.readahead))
+            if buffering == 0:
+                return raw
+            # readline and small reads are served from the buffer, not byte by byte
+            return io.BufferedReader(raw, buffer_size=buffering if buffering > 1 else block_size)
 
         sffile = SeafileFile.factory(path, _mode, on_close=on_close)
-        with s3errors(path):
-            self.connection.download_fileobj(
-                self._bucket_name, _key, sffile.raw
-            )
+        with seafile_errors(path):
+            self._download(_lib_id, _subpath, sffile.raw, info.size, info)
         sffile.seek(0, os.SEEK_SET)
         return sffile
+
+    def getfile(self, path, file, chunk_size=None, **options):
+        """
+        Copy file `path` into the binary file-like `file`.
+        Large files are downloaded in `parts` concurrent byte ranges
+        written in place, if `file` is a real local file at its start.
+        """
+        parts = options.pop('parts', self.download_parts)
+        part_size = options.pop('part_size', self.download_part_size)
+        info = self.getinfo(path)
+        if info.is_dir:
+            raise errors.FileExpected(path)
+        try:
+            file.fileno()
+            parallel = parts > 1 and info.size > part_size and file.tell() == 0
+        except (AttributeError, IOError, OSError):
+            parallel = False
+        if self.content_cache is not None and info.get('basic', 'id'):
+            # from (or through) the content cache
+            parallel = False
+        if not parallel:
+            # like FS.getfile, but without the global lock
+            with self.openbin(path, **options) as read_file:
+                tools.copy_file_data(read_file, file, chunk_size=chunk_size)
+            return
+        _lib_id, _subpath = self._get_lib_id_and_path(self.validatepath(path))
+        with seafile_errors(path):
+            try:
+                self.connection.file_download_parallel(
+                    _lib_id, _subpath, file, size=info.size, parts=parts, part_size=part_size)
+            except requests.exceptions.RequestException:
+                raise
+            except (IOError, ValueError) as error:
+                raise errors.OperationFailed(path, exc=error)
+        file.seek(info.size)
+
+    def download_zip(self, path, file, chunk_size=65536, **options):
+        """
+        Write directory `path` as zip archive into the binary file-like `file`
+        (a file, pipe or socket), zipped by the server and streamed,
+        with a few requests however many files it contains.
+        options are those of `Connection.dir_zip_link` (`poll_interval`, `timeout`).
+        Return number of bytes written
+        """
+        _lib_id, _subpath = self._get_lib_id_and_path(self.validatepath(path))
+        with seafile_errors(path):
+            try:
+                return self.connection.dir_download_zip(_lib_id, _subpath, file, chunk_size, **options)
+            except requests.exceptions.RequestException:
+                raise
+            except IOError as error:
+                raise errors.OperationFailed(path, exc=error)
+
+    def download_dir(self, path, dst_fs, dst_path='/', **options):
+        """
+        Copy the contents of directory `path` into directory `dst_path`
+        of `dst_fs` (FS or FS URL), unpacking the server’s zip archive
+        on the fly, without storing it.
+        options are those of `Connection.dir_zip_link` (`poll_interval`, `timeout`).
+        Return number of files written
+        """
+        _lib_id, _subpath = self._get_lib_id_and_path(self.validatepath(path))
+        count = 0
+        with manage_fs(dst_fs, writeable=True, create=True) as _dst_fs, seafile_errors(path):
+            _dst_fs.makedirs(dst_path, recreate=True)
+            try:
+                chunks = self.connection.dir_zip_iter(_lib_id, _subpath, **options)
+                for name, data in iter_zip(chunks):
+                    parts = name.strip('/').split('/')
+                    if _subpath != '/':
+                        # the archive contains the directory itself
+                        parts = parts[1:]
+                    if '..' in parts:
+                        raise IOError('Illegal path in zip archive: %s' % name)
+                    if not parts:
+                        continue
+                    target = join(dst_path, *parts)
+                    if name.endswith('/'):
+                        _dst_fs.makedirs(target, recreate=True)
+                        continue
+                    _dst_fs.makedirs(dirname(target), recreate=True)
+                    with _dst_fs.openbin(target, 'w') as dst_file:
+                        for chunk in data:
+                            dst_file.write(chunk)
+                    count += 1
+            except requests.exceptions.RequestException:
+                raise
+            except (IOError, ValueError) as error:
+                raise errors.OperationFailed(path, exc=error)
+        return count
+
+    def transfer(self, path, dst_fs, dst_path, workers=4, pipe_size=4 * 1024 * 1024):
+        """
+        Copy file or directory `path` to `dst_path` of `SeafileFS` `dst_fs`
+        (another library or server), downloading and uploading every file
+        at the same time through a bounded in-memory pipe, `workers` files
+        at a time, without local files. Keeps mtimes if the server supports it.
+        Return number of files copied
+        """
+        from .transfer import transfer_files
+
+        info = self.getinfo(path)
+        _lib_id, _subpath = self._get_lib_id_and_path(self.validatepath(path))
+        _dst_path = dst_fs.validatepath(dst_path)
+        dst_lib_id, dst_subpath = dst_fs._get_lib_id_and_path(_dst_path)
+        jobs, dirs = [], set()
+        if info.is_dir:
+            start = len(_subpath.rstrip('/'))
+            dirs.add(dst_subpath)
+            for entry_path, entry in self._walk_tree(_lib_id, _subpath):
+                target = dst_subpath.rstrip('/') + entry_path[start:]
+                if entry.get('type') == 'file':
+                    jobs.append((_lib_id, entry_path, dst_lib_id, target, entry.get('size'), entry.get('mtime')))
+                else:
+                    dirs.add(target)
+        else:
+            jobs.append((_lib_id, _subpath, dst_lib_id, dst_subpath, info.size, info.raw['details']['modified']))
+        # directories with create_parents, so the deepest ones suffice
+        for target in sorted(dirs):
+            if target != '/' and not any(other.startswith(target + '/') for other in dirs):
+                dst_fs.makedirs(dst_path.rstrip('/') + target[len(dst_subpath.rstrip('/')):] or '/',
+                                recreate=True)
+        with seafile_errors(path):
+            try:
+                transfer_files(self.connection, dst_fs.connection, jobs, workers, pipe_size)
+            except requests.exceptions.RequestException:
+                raise
+            except IOError as error:
+                raise errors.OperationFailed(path, exc=error)
+        dst_fs.cache.invalidate(dst_lib_id)
+        for job in jobs:
+            dst_fs.cache.discard_missing(dst_lib_id, job[3])
+        return len(jobs)
+
+    def setbinfile(self, path, file):
+        with self._path_lock(path):
+            with self.openbin(path, 'wb') as dst_file:
+                tools.copy_file_data(file, dst_file)
+
+    def appendbytes(self, path, data):
+        if not isinstance(data, bytes):
+            raise TypeError('must be bytes')
+        with self._path_lock(path):
+            with self.openbin(path, 'ab') as append_file:
+                append_file.write(data)
+
+    def create(self, path, wipe=False):
+        with self._path_lock(path):
+            if not wipe and self.exists(path):
+                return False
+            with self.openbin(path, 'wb'):
+                pass
+            return True
+
+    # like the methods of FS, but with the locks of the paths instead of the global lock
+
+    def copy(self, src_path, dst_path, overwrite=False):
+        with self._path_lock(dst_path):
+            if not overwrite and self.exists(dst_path):
+                raise errors.DestinationExists(dst_path)
+            with self.openbin(src_path) as read_file:
+                self.setbinfile(dst_path, read_file)
+
+    def move(self, src_path, dst_path, overwrite=False):
+        with self._paths_locked(src_path, dst_path):
+            if not overwrite and self.exists(dst_path):
+                raise errors.DestinationExists(dst_path)
+            if self.getinfo(src_path).is_dir:
+                raise errors.FileExpected(src_path)
+            with self.openbin(src_path) as read_file:
+                self.setbinfile(dst_path, read_file)
+            self.remove(src_path)
+
+    def copydir(self, src_path, dst_path, create=False):
+        if not create and not self.exists(dst_path):
+            raise errors.ResourceNotFound(dst_path)
+        if not self.getinfo(src_path).is_dir:
+            raise errors.DirectoryExpected(src_path)
+        _src_path, _dst_path = self.validatepath(src_path), self.validatepath(dst_path)
+        self.makedirs(_dst_path, recreate=True)
+        for path, info in self.walk.info(_src_path):
+            target = join(_dst_path, path[len(_src_path):].lstrip('/'))
+            if info.is_dir:
+                self.makedirs(target, recreate=True)
+            else:
+                self.copy(path, target, overwrite=True)
+
+    def movedir(self, src_path, dst_path, create=False):
+        self.copydir(src_path, dst_path, create=create)
+        self.removetree(src_path)
+
+    def removetree(self, dir_path):
+        """
+        Remove directory `dir_path` with all its contents, with one request
+        (Seafile removes directory trees); libraries stay, only their
+        contents are removed.
+        """
+        _dir_path = self.validatepath(dir_path)
+        if _dir_path == '/':
+            for name in self.listdir('/'):
+                self.removetree(join('/', name))
+            return
+        if not self.getinfo(_dir_path).is_dir:
+            raise errors.DirectoryExpected(dir_path)
+        _lib_id, _subpath = self._get_lib_id_and_path(_dir_path)
+        if _subpath != '/':
+            self.removedir(_dir_path)
+            return
+        for info in list(self.scandir(_dir_path)):
+            if info.is_dir:
+                self.removedir(join(_dir_path, info.name))
+            else:
+                self.remove(join(_dir_path, info.name))
+
+    def touch(self, path):
+        with self._path_lock(path):
+            if not self.create(path):
+                now = time.time()
+                self.setinfo(path, {'details': {'accessed': now, 'modified': now}})
+
+    def setfile(self, path, file, encoding=None, errors=None, newline=''):
+        with self._path_lock(path):
+            with self.open(path, mode='wb' if encoding is None else 'wt',
+                           encoding=encoding, errors=errors, newline=newline) as dst_file:
+                tools.copy_file_data(file, dst_file)
+
+    def appendtext(self, path, text, encoding='utf-8', errors=None, newline=''):
+        if not isinstance(text, str):
+            raise TypeError('must be unicode string')
+        with self._path_lock(path):
+            with self.open(path, 'at', encoding=encoding, errors=errors, newline=newline) as append_file:
+                append_file.write(text)
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""
+Base of tests against the local stand-in server of `seafile.fakeserver`.
+"""
+import threading
+import unittest
+
+from seafile.fakeserver import serve
+
+
+class ServerTestCase(unittest.TestCase):
+    """
+    Starts a fresh stand-in server per test; `make_fs` opens a `SeafileFS` on it.
+    """
+    server_options = {}
+
+    def setUp(self):
+        self.server, self.url = serve(**self.server_options)
+        self.seafile = self.server.seafile
+        self.library = self.seafile.library('My Library')
+        self.filesystems = []
+
+    def tearDown(self):
+        for fs in self.filesystems:
+            fs.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def make_fs(self, **kwargs):
+        from seafile.seafilefs import SeafileFS
+        kwargs.setdefault('server', self.url)
+        kwargs.setdefault('username', self.seafile.username)
+        kwargs.setdefault('password', self.seafile.password)
+        fs = SeafileFS(**kwargs)
+        self.filesystems.append(fs)
+        return fs
+
+    def add_file(self, path, content=b'content'):
+        """Put a file into 'My Library' behind the client’s back."""
+        with self.seafile.lock:
+            self.library.add_dir(path.rsplit('/', 1)[0] or '/')
+            self.library.files[path] = (content, 1700000000)
+            self.library.changed()
+
+    def run_within(self, function, seconds=20):
+        """
+        Run `function` in a thread, fail if it doesn’t end within `seconds`
+        (instead of hanging the test run). Return its result
+        """
+        result = {}
+
+        def target():
+            try:
+                result['value'] = function()
+            except BaseException as error:
+                result['error'] = error
+
+        thread = threading.Thread(target=target)
+        thread.daemon = True
+        thread.start()
+        thread.join(seconds)
+        if thread.is_alive():
+            self.fail('%r still running after %d s' % (function, seconds))
+        if 'error' in result:
+            raise result['error']
+        return result.get('value')
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import unittest
+
+from seafile.contentcache import ContentCache
+from seafile.tests.base import ServerTestCase
+
+FILE_ID = '0123456789abcdef0123456789abcdef01234567'
+
+
+class ContentCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def test_get_returns_open_file(self):
+        cache = ContentCache(self.directory)
+        self.assertIsNone(cache.get(FILE_ID))
+        with cache.add(FILE_ID, lambda fileobj: fileobj.write(b'content')) as added:
+            self.assertEqual(added.read(), b'content')
+            self.assertRaises(OSError, added.write, b'x')
+        with cache.get(FILE_ID) as cached:
+            self.assertEqual(cached.read(), b'content')
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_open_file_survives_eviction(self):
+        cache = ContentCache(self.directory)
+        cache.add(FILE_ID, lambda fileobj: fileobj.write(b'content')).close()
+        cached = cache.get(FILE_ID)
+        # another process evicts it
+        shutil.rmtree(os.path.join(self.directory, FILE_ID[:2]))
+        with cached:
+            self.assertEqual(cached.read(), b'content')
+        self.assertIsNone(cache.get(FILE_ID))
+
+
+class SeafileFSContentCacheTest(ServerTestCase):
+
+    def test_evicted_content_is_downloaded_again(self):
+        self.add_file('/a.txt', b'a' * 1000)
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        fs = self.make_fs(content_cache=directory, cache_content_size=0)
+        download = 'GET /seafhttp/files/%s/a.txt' % self.library.id
+        with fs.openbin('/My Library/a.txt') as fileobj:
+            shutil.rmtree(os.path.join(directory, fs.getinfo('/My Library/a.txt').get('basic', 'id')[:2]))
+            self.assertEqual(fileobj.read(), b'a' * 1000)
+        self.assertEqual(self.seafile.counts[download], 1)
+        self.assertEqual(fs.getbytes('/My Library/a.txt'), b'a' * 1000)
+        self.assertEqual(self.seafile.counts[download], 2)
+        self.assertEqual(fs.getbytes('/My Library/a.txt'), b'a' * 1000)
+        self.assertEqual(self.seafile.counts[download], 2)
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+
+from seafile.tests.base import ServerTestCase
+
+
+class IndexTest(ServerTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.add_file('/docs/a.pdf', b'a' * 10)
+        self.add_file('/docs/old/b.pdf', b'b' * 20)
+        self.add_file('/docs/c.txt', b'c')
+
+    def found(self, fs, *args, **kwargs):
+        return sorted(path for path, _info in fs.search(*args, **kwargs))
+
+    def test_refresh_index(self):
+        fs = self.make_fs(index=os.path.join(self.directory, 'index.sqlite'), index_max_age=3600)
+        listings = self.seafile.counts.get('GET /api2/repos/<id>/dir/', 0)
+        self.assertEqual(self.found(fs, '/My Library', '**/*.pdf'),
+                         ['/My Library/docs/a.pdf', '/My Library/docs/old/b.pdf'])
+        self.assertEqual(self.found(fs, '/My Library/docs', '**/*.pdf', min_size=15),
+                         ['/My Library/docs/old/b.pdf'])
+        # one recursive listing for all searches
+        self.assertEqual(self.seafile.counts['GET /api2/repos/<id>/dir/'], listings + 1)
+
+        self.add_file('/docs/new/d.pdf', b'd')
+        self.assertNotIn('/My Library/docs/new/d.pdf', self.found(fs, '/My Library', '**/*.pdf'))
+        fs.refresh_index('/My Library')
+        self.assertEqual(self.found(fs, '/My Library', '**/*.pdf'),
+                         ['/My Library/docs/a.pdf', '/My Library/docs/new/d.pdf',
+                          '/My Library/docs/old/b.pdf'])
+        self.assertEqual(self.seafile.counts['GET /api2/repos/<id>/dir/'], listings + 2)
+        # the head commit didn't move
+        heads = self.seafile.counts['GET /api2/repos/<id>/']
+        fs.refresh_index('/My Library')
+        self.assertEqual(self.seafile.counts['GET /api2/repos/<id>/'], heads + 1)
+        self.assertEqual(self.seafile.counts['GET /api2/repos/<id>/dir/'], listings + 2)
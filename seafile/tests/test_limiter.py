@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+import unittest
+
+from seafile.limiter import AdaptiveLimiter
+from seafile.tests.base import ServerTestCase
+
+
+class AdaptiveLimiterTest(unittest.TestCase):
+
+    def test_acquire_times_out(self):
+        limiter = AdaptiveLimiter(limit=1)
+        self.assertIsNotNone(limiter.acquire(1))
+        self.assertIsNone(limiter.acquire(0.05))
+
+    def test_stream_holder_may_nest(self):
+        limiter = AdaptiveLimiter(limit=1)
+        limiter.acquire(1, stream=True)
+        # same thread: no wait while it holds the stream
+        self.assertIsNotNone(limiter.acquire(0.05))
+        limiter.release()
+        # other threads wait
+        other = []
+        thread = threading.Thread(target=lambda: other.append(limiter.acquire(0.05)))
+        thread.start()
+        thread.join()
+        self.assertEqual(other, [None])
+        limiter.release(threading.get_ident())
+        self.assertIsNotNone(limiter.acquire(0.05))
+
+    def test_untimed_requests_are_no_overload(self):
+        limiter = AdaptiveLimiter(limit=8)
+        for _ in range(5):
+            limiter.done(time.time() - 0.01, 200)
+        limiter.done(time.time() - 5, 200, timed=False)
+        self.assertEqual(limiter.metrics()['overloads'], 0)
+        limiter.done(time.time() - 5, 200)
+        self.assertEqual(limiter.metrics()['overloads'], 1)
+
+
+class LimitedConnectionTest(ServerTestCase):
+
+    def test_nested_request_with_open_stream(self):
+        self.add_file('/a/b/x.txt')
+        fs = self.make_fs(max_concurrency=1)
+        matches = self.run_within(lambda: [match.path for match in fs.glob('*/b/x.txt', '/My Library')])
+        self.assertEqual(matches, ['/My Library/a/b/x.txt'])
+
+    def test_limit_at_most_pool_size(self):
+        fs = self.make_fs(pool_size=3, max_concurrency=64)
+        self.assertEqual(fs.connection.limiter.max_limit, 3)
+
+    def test_limiter_per_cap(self):
+        small = self.make_fs(pool_size=2, max_concurrency=2).connection.limiter
+        large = self.make_fs(pool_size=8, max_concurrency=8).connection.limiter
+        self.assertIsNot(small, large)
+        self.assertEqual((small.max_limit, large.max_limit), (2, 8))
+        self.assertIs(self.make_fs(pool_size=2, max_concurrency=4).connection.limiter, small)
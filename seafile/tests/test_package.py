@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+import subprocess
+import sys
+import unittest
+
+import seafile
+
+
+class PackageTest(unittest.TestCase):
+
+    def test_exports(self):
+        for name in seafile.__all__:
+            self.assertEqual(getattr(seafile, name).__name__, name)
+        with self.assertRaises(AttributeError):
+            seafile.SeaFile
+
+    def test_import_is_lazy(self):
+        code = 'import sys, seafile; print(sorted({"fs", "requests"} & set(sys.modules)))'
+        output = subprocess.check_output([sys.executable, '-c', code])
+        self.assertEqual(output.strip(), b'[]')
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+import os
+import pickle
+import shutil
+import tempfile
+
+from seafile.tests.base import ServerTestCase
+
+
+class PickleTest(ServerTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.add_file('/a.txt', b'a')
+
+    def assertRoundTrip(self, **kwargs):
+        fs = self.make_fs(**kwargs)
+        self.assertEqual(fs.listdir('/My Library'), ['a.txt'])
+        logins = self.seafile.counts['POST /api2/auth-token/']
+        listings = self.seafile.counts['GET /api2/repos/']
+        clone = pickle.loads(pickle.dumps(fs))
+        self.filesystems.append(clone)
+        self.assertEqual(clone.getbytes('/My Library/a.txt'), b'a')
+        clone.setbytes('/My Library/b.txt', b'b')
+        clone.sync()
+        self.assertEqual(clone.getbytes('/My Library/b.txt'), b'b')
+        self.assertEqual(self.library.files['/b.txt'][0], b'b')
+        # neither a login nor a library listing
+        self.assertEqual(self.seafile.counts['POST /api2/auth-token/'], logins)
+        self.assertEqual(self.seafile.counts['GET /api2/repos/'], listings)
+        return clone
+
+    def test_plain(self):
+        clone = self.assertRoundTrip()
+        self.assertEqual(clone.connection.auth_token, self.filesystems[0].connection.auth_token)
+
+    def test_index(self):
+        clone = self.assertRoundTrip(index=os.path.join(self.directory, 'index.sqlite'))
+        self.assertEqual(sorted(path for path, _info in clone.search('/My Library', '*.txt')),
+                         ['/My Library/a.txt', '/My Library/b.txt'])
+
+    def test_content_cache(self):
+        clone = self.assertRoundTrip(content_cache=os.path.join(self.directory, 'cache'))
+        self.assertEqual(clone.content_cache.directory, os.path.join(self.directory, 'cache'))
+
+    def test_write_back(self):
+        clone = self.assertRoundTrip(write_back=4)
+        self.assertIsNotNone(clone._write_back)
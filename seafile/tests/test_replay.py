@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+Replays exchanges recorded against `seafile.fakeserver`; to record them again:
+``python -m seafile.tests.test_replay``
+"""
+import os
+import unittest
+
+from seafile.transport import RecordingTransport, ReplayTransport
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+WALK = os.path.join(FIXTURES, 'walk.json')
+FILES = {
+    '/a.txt': b'a',
+    '/docs/b.txt': b'b',
+    '/docs/c.txt': b'c',
+    '/docs/old/d.txt': b'd',
+    '/src/e.py': b'e',
+}
+# the requests of a walk after logging in
+MAX_WALK_REQUESTS = 6
+
+
+def walk(fs):
+    return sorted(fs.walk.files('/My Library'))
+
+
+def record_walk(filename=WALK):
+    """Record a walk of a small library in `filename`."""
+    from seafile.fakeserver import serve
+    from seafile.seafilefs import SeafileFS
+
+    server, url = serve()
+    try:
+        seafile = server.seafile
+        seafile.libraries.clear()
+        library = seafile.add_library('My Library', '2b1c4f7e-0f3a-4d4e-9a57-4b0c2f3e6d10')
+        for path, content in FILES.items():
+            library.add_dir(os.path.dirname(path))
+            library.files[path] = (content, 1700000000)
+        transport = RecordingTransport(filename)
+        fs = SeafileFS(server=url, username=seafile.username, password=seafile.password,
+                       transport=transport)
+        with transport.measure('walk'):
+            walk(fs)
+        fs.close()
+        transport.save()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+class ReplayTest(unittest.TestCase):
+
+    def test_walk(self):
+        from seafile.seafilefs import SeafileFS
+
+        transport = ReplayTransport(WALK)
+        fs = SeafileFS(server='https://seafile.example.com', username='test@example.com',
+                       password='test', transport=transport)
+        self.addCleanup(fs.close)
+        with transport.measure('walk') as usage:
+            files = walk(fs)
+        self.assertEqual(files, sorted('/My Library' + path for path in FILES))
+        self.assertLessEqual(usage.requests, MAX_WALK_REQUESTS)
+
+
+if __name__ == '__main__':
+    record_walk()
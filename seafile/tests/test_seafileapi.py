@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+import json
+import tempfile
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from fs import errors
+
+from seafile.lazy import requests
+from seafile.seafileapi import Connection, iter_json_array
+from seafile.tests.base import ServerTestCase
+
+
+class ChunkedResponse(object):
+    """Stand-in for a streamed `requests.Response` with `body`."""
+    encoding = 'utf-8'
+
+    def __init__(self, body):
+        self.body = body.encode('utf-8')
+
+    def iter_content(self, chunk_size):
+        for start in range(0, len(self.body), chunk_size):
+            yield self.body[start:start + chunk_size]
+
+
+class IterJsonArrayTest(unittest.TestCase):
+
+    def test_any_chunk_boundary(self):
+        for body in ('[3.5]', '[1, 22, 3e10 ,-4.25 ]', ' [ ]', '[{"name": "ä,]"}, [1, 2], "x", true, null]'):
+            expected = json.loads(body)
+            for chunk_size in range(1, len(body.encode('utf-8')) + 1):
+                self.assertEqual(list(iter_json_array(ChunkedResponse(body), chunk_size)), expected,
+                                 '%r in chunks of %d' % (body, chunk_size))
+
+    def test_unterminated(self):
+        for body in ('[1, 2', '[3.5', '[{"a": 1}'):
+            with self.assertRaises(ValueError):
+                list(iter_json_array(ChunkedResponse(body), 1))
+
+    def test_not_an_array(self):
+        with self.assertRaises(ValueError):
+            list(iter_json_array(ChunkedResponse('{"a": 1}')))
+
+
+class ConnectionTestCase(ServerTestCase):
+
+    def make_connection(self, **kwargs):
+        connection = Connection(server=self.url, username=self.seafile.username,
+                                password=self.seafile.password, **kwargs)
+        connection.connect()
+        return connection
+
+    def run_together(self, function, count=8):
+        """Call `function` from `count` threads at once, return their results or errors."""
+        barrier = threading.Barrier(count)
+
+        def call(_number):
+            barrier.wait()
+            try:
+                return function()
+            except Exception as error:
+                return error
+
+        with ThreadPoolExecutor(count) as executor:
+            return list(executor.map(call, range(count)))
+
+
+class CoalescingTest(ConnectionTestCase):
+    server_options = {'latency': 0.2}
+
+    def test_identical_requests_share_one(self):
+        connection = self.make_connection()
+        results = self.run_together(lambda: connection.get_request('/api2/repos/').json())
+        self.assertEqual(self.seafile.counts['GET /api2/repos/'], 1)
+        self.assertTrue(all(result == results[0] for result in results))
+        self.assertEqual(connection.coalesced, 7)
+
+    def test_errors_are_shared(self):
+        connection = self.make_connection()
+        results = self.run_together(lambda: connection.get_request('/api2/repos/nope/'))
+        self.assertEqual(self.seafile.counts['GET /api2/repos/<id>/'], 1)
+        for result in results:
+            self.assertIsInstance(result, requests.exceptions.HTTPError)
+
+    def test_no_flight_from_before_a_write(self):
+        connection = self.make_connection()
+        self.seafile.latency = 0.5
+        slow = threading.Thread(target=connection.get_request, args=('/api2/repos/',))
+        slow.start()
+        time.sleep(0.1)
+        self.seafile.latency = 0
+        connection.dir_create(self.library.id, 'new')
+        # the slow listing may not know the change yet
+        connection.get_request('/api2/repos/')
+        slow.join()
+        self.assertEqual(self.seafile.counts['GET /api2/repos/'], 2)
+
+
+class DeadlineTest(ConnectionTestCase):
+
+    def assertTimesOut(self, function, seconds):
+        started = time.time()
+        with self.assertRaises((requests.exceptions.Timeout, errors.RemoteConnectionError)):
+            function()
+        self.assertLess(time.time() - started, seconds + 0.3)
+
+    def test_walk(self):
+        for number in range(3):
+            self.add_file('/%d/a.txt' % number)
+        fs = self.make_fs()
+        self.seafile.latency = 1
+
+        def walk():
+            with fs.connection.deadline(0.5):
+                list(fs.walk.files('/My Library'))
+
+        self.assertTimesOut(walk, 0.5)
+
+    def test_getinfo_many_workers(self):
+        for number in range(5):
+            self.add_file('/%d/a.txt' % number)
+        fs = self.make_fs()
+        fs.getinfo('/My Library')
+        # each listing alone would make it in time
+        self.seafile.latency = 0.3
+
+        def getinfo_many():
+            with fs.connection.deadline(0.2):
+                fs.getinfo_many(['/My Library/%d/a.txt' % number for number in range(5)])
+
+        self.assertTimesOut(getinfo_many, 0.2)
+
+    def test_parallel_download_workers(self):
+        self.add_file('/big.bin', b'x' * 4000)
+        connection = self.make_connection()
+        self.seafile.latency = 0.3
+
+        def download():
+            with tempfile.TemporaryFile() as fileobj, connection.deadline(0.5):
+                # the link takes 0.3 s, every range 0.3 s more
+                connection.file_download_parallel(self.library.id, '/big.bin', fileobj,
+                                                  size=4000, parts=4, part_size=1000)
+
+        self.assertTimesOut(download, 0.5)
+
+    def test_wait_for_slot(self):
+        self.add_file('/a.txt')
+        connection = self.make_connection(max_concurrency=1)
+        link = connection.file_download(self.library.id, '/a.txt')
+        # another thread holds the only slot with an open stream
+        holder = []
+        thread = threading.Thread(target=lambda: holder.append(connection._send('GET', link, stream=True)))
+        thread.start()
+        thread.join()
+
+        def request():
+            with connection.deadline(0.3):
+                connection.get_request('/api2/repos/')
+
+        self.assertTimesOut(request, 0.3)
+        holder[0].close()
+        connection.get_request('/api2/repos/')
+
+
+class HedgingTest(ConnectionTestCase):
+
+    def test_hedge_within_budget(self):
+        connection = self.make_connection(hedge=50, hedge_budget=0.1, coalesce=False)
+        for _number in range(20):
+            connection.get_request('/api2/repos/')
+        self.assertEqual(connection.hedged, 0)
+        self.seafile.latency = 0.05
+        for _number in range(20):
+            connection.get_request('/api2/repos/')
+        # a hedge after the median of fast requests, as long as the budget allows
+        self.assertEqual(connection.hedged, int(0.1 * 40))
+        self.assertEqual(self.seafile.counts['GET /api2/repos/'], 40 + connection.hedged)
@@ -0,0 +1,312 @@
+# -*- coding: utf-8 -*-
+import io
+import os
+import tempfile
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from fs import errors
+
+from seafile.seafilefs import PathLocks
+from seafile.tests.base import ServerTestCase
+
+
+class MakedirsTest(ServerTestCase):
+
+    def test_makedirs_creates_parents(self):
+        fs = self.make_fs()
+        fs.makedirs('/My Library/a/b/c')
+        self.assertTrue(fs.isdir('/My Library/a/b/c'))
+        self.assertIn('/a/b', self.library.dirs)
+        with self.assertRaises(errors.DirectoryExists):
+            fs.makedirs('/My Library/a/b/c')
+        fs.makedirs('/My Library/a/b/c', recreate=True)
+
+    def test_removed_by_somebody_else_after_own_write(self):
+        fs = self.make_fs()
+        other = self.make_fs()
+        fs.makedirs('/My Library/2026/10/19', recreate=True)
+        fs.setbytes('/My Library/2026/10/19/a.txt', b'a')
+        other.removetree('/My Library/2026')
+        fs.makedirs('/My Library/2026/10/19', recreate=True)
+        fs.setbytes('/My Library/2026/10/19/b.txt', b'b')
+        self.assertEqual(other.listdir('/My Library/2026/10/19'), ['b.txt'])
+
+    def test_upload_into_removed_directory(self):
+        fs = self.make_fs()
+        fs.makedirs('/My Library/x', recreate=True)
+        with self.seafile.lock:
+            self.library.remove('/x')  # without a new commit
+        fs.setbytes('/My Library/x/a.txt', b'a')
+        self.assertIn('/x', self.library.dirs)
+        self.assertEqual(fs.getbytes('/My Library/x/a.txt'), b'a')
+
+    def test_writes_into_known_directory(self):
+        fs = self.make_fs()
+        fs.makedirs('/My Library/2024/01/02', recreate=True)
+        fs.setbytes('/My Library/2024/01/02/0.txt', b'0')
+        before = sum(self.seafile.counts.values())
+        for number in range(1, 5):
+            fs.makedirs('/My Library/2024/01/02', recreate=True)
+            fs.setbytes('/My Library/2024/01/02/%d.txt' % number, b'%d' % number)
+        # upload link and upload
+        self.assertEqual(sum(self.seafile.counts.values()) - before, 4 * 2)
+        self.assertEqual(fs.listdir('/My Library/2024/01/02'), ['%d.txt' % n for n in range(5)])
+
+
+class MissingTest(ServerTestCase):
+
+    def test_repeated_misses_are_local(self):
+        fs = self.make_fs()
+        self.assertFalse(fs.exists('/My Library/nope.txt'))
+        before = sum(self.seafile.counts.values())
+        self.assertFalse(fs.exists('/My Library/nope.txt'))
+        self.assertEqual(sum(self.seafile.counts.values()), before)
+        fs.setbytes('/My Library/other.txt', b'other')
+        before = sum(self.seafile.counts.values())
+        self.assertFalse(fs.exists('/My Library/nope.txt'))
+        self.assertFalse(fs.exists('/My Library/nope.txt/below'))
+        self.assertEqual(sum(self.seafile.counts.values()), before)
+        # but not after writing it
+        fs.setbytes('/My Library/nope.txt', b'there')
+        self.assertTrue(fs.exists('/My Library/nope.txt'))
+
+
+class GetinfoManyTest(ServerTestCase):
+
+    def test_one_listing_per_parent(self):
+        for n in range(5):
+            for name in ('a.txt', 'b.txt'):
+                self.add_file('/d%d/%s' % (n, name), b'x' * (n + 1))
+        fs = self.make_fs()
+        fs.listdir('/')
+        paths = ['/My Library/d%d/%s' % (n, name)
+                 for n in range(5) for name in ('a.txt', 'b.txt', 'missing.txt')]
+        listings = self.seafile.counts.get('GET /api2/repos/<id>/dir/', 0)
+        infos = fs.getinfo_many(paths, namespaces=['details'])
+        self.assertEqual(self.seafile.counts['GET /api2/repos/<id>/dir/'], listings + 5)
+        self.assertEqual(set(infos), set(paths))
+        for n in range(5):
+            info = infos['/My Library/d%d/a.txt' % n]
+            self.assertEqual((info.name, info.is_dir, info.size), ('a.txt', False, n + 1))
+            self.assertEqual(infos['/My Library/d%d/b.txt' % n].name, 'b.txt')
+            self.assertIsNone(infos['/My Library/d%d/missing.txt' % n])
+        # a missing parent is listed once, its children are all missing
+        infos = fs.getinfo_many(['/My Library/nodir/a.txt', '/My Library/nodir/b.txt'])
+        self.assertEqual(infos, {'/My Library/nodir/a.txt': None, '/My Library/nodir/b.txt': None})
+        self.assertEqual(self.seafile.counts['GET /api2/repos/<id>/dir/'], listings + 6)
+
+
+class BlockUploadTest(ServerTestCase):
+
+    def test_only_missing_blocks_are_sent(self):
+        fs = self.make_fs(dedup_upload_size=100000, upload_block_size=65536)
+        data = bytearray(os.urandom(512 * 1024))
+        fs.setbytes('/My Library/vm.img', bytes(data))
+        self.assertEqual(self.library.files['/vm.img'][0], data)
+        data[100000:100010] = b'0123456789'
+        fs.setbytes('/My Library/vm.img', bytes(data))
+        self.assertEqual(self.library.files['/vm.img'][0], data)
+        self.assertEqual(fs.upload_saved, len(data) - 65536)
+
+
+class StreamedReadTest(ServerTestCase):
+
+    def test_readline_is_buffered(self):
+        lines = [('%d,name-%d,%s\n' % (number, number, 'x' * (number % 50))).encode('ascii')
+                 for number in range(20000)]
+        self.add_file('/data.csv', b''.join(lines))
+        fs = self.make_fs(cache_content_size=1024, read_block_size=64 * 1024)
+        with fs.openbin('/My Library/data.csv') as fileobj:
+            self.assertEqual(list(fileobj), lines)
+            fileobj.seek(len(lines[0]))
+            self.assertEqual(fileobj.readline(), lines[1])
+        blocks = sum(len(line) for line in lines) // (64 * 1024) + 1
+        self.assertLessEqual(self.seafile.counts['GET /seafhttp/files/%s/data.csv' % self.library.id],
+                             blocks + 1)
+
+    def test_server_ignoring_ranges(self):
+        self.seafile.ranges = False
+        content = os.urandom(8 * 64 * 1024)
+        self.add_file('/big.bin', content)
+        fs = self.make_fs(cache_content_size=1024, read_block_size=64 * 1024)
+        download = 'GET /seafhttp/files/%s/big.bin' % self.library.id
+        with fs.openbin('/My Library/big.bin', readahead=0) as fileobj:
+            self.assertEqual(fileobj.read(), content)
+            # the ignored range and one plain download
+            self.assertEqual(self.seafile.counts[download], 2)
+            fileobj.seek(100)
+            self.assertEqual(fileobj.read(100), content[100:200])
+        with fs.openbin('/My Library/big.bin') as fileobj:
+            self.assertEqual(b''.join(iter(lambda: fileobj.read(1000), b'')), content)
+
+
+class TransferTest(ServerTestCase):
+
+    def test_transfer_within_one_slot(self):
+        content = os.urandom(3 * 1024 * 1024)
+        self.add_file('/big.bin', content)
+        fs = self.make_fs(max_concurrency=1)
+        fs.makedirs('/My Library/copy')
+        copied = self.run_within(lambda: fs.transfer(
+            '/My Library/big.bin', fs, '/My Library/copy/big.bin', pipe_size=256 * 1024))
+        self.assertEqual(copied, 1)
+        self.assertEqual(self.library.files['/copy/big.bin'][0], content)
+
+    def transfer_sized(self, size):
+        from seafile.transfer import transfer_file
+
+        self.add_file('/big.bin', os.urandom(3 * 1024 * 1024))
+        fs = self.make_fs()
+        connection = fs.connection
+        with self.assertRaises(IOError):
+            self.run_within(lambda: transfer_file(
+                connection, self.library.id, '/big.bin', connection, self.library.id,
+                '/copy.bin', size=size, mtime=0, pipe_size=64 * 1024))
+        self.assertNotIn('/copy.bin', self.library.files)
+
+    def test_grown_source(self):
+        self.transfer_sized(1024 * 1024)
+
+    def test_shrunk_source(self):
+        self.transfer_sized(4 * 1024 * 1024)
+
+    def test_changed_source_fails(self):
+        self.add_file('/a.bin', os.urandom(100000))
+        fs = self.make_fs()
+        fs.getinfo('/My Library/a.bin')
+        # changed behind the cached info
+        self.add_file('/a.bin', os.urandom(200000))
+        with self.assertRaises(errors.OperationFailed):
+            self.run_within(lambda: fs.transfer('/My Library/a.bin', fs, '/My Library/b.bin',
+                                                pipe_size=16 * 1024))
+
+
+class ParallelDownloadTest(ServerTestCase):
+
+    def getfile(self, fs, path):
+        with tempfile.TemporaryFile() as fileobj:
+            fs.getfile(path, fileobj, parts=4, part_size=1000)
+            fileobj.seek(0)
+            return fileobj.read()
+
+    def test_ranges(self):
+        content = os.urandom(10000)
+        self.add_file('/a.bin', content)
+        fs = self.make_fs()
+        self.assertEqual(self.getfile(fs, '/My Library/a.bin'), content)
+        self.assertEqual(self.seafile.counts['GET /seafhttp/files/%s/a.bin' % self.library.id], 10)
+
+    def test_ignored_ranges(self):
+        self.seafile.ranges = False
+        self.add_file('/a.bin', os.urandom(10000))
+        fs = self.make_fs()
+        with self.assertRaises(errors.OperationFailed):
+            self.getfile(fs, '/My Library/a.bin')
+
+    def test_changed_size(self):
+        self.add_file('/a.bin', os.urandom(10000))
+        fs = self.make_fs()
+        fs.getinfo('/My Library/a.bin')
+        # changed behind the cached info
+        self.add_file('/a.bin', os.urandom(12000))
+        with self.assertRaises(errors.OperationFailed):
+            self.getfile(fs, '/My Library/a.bin')
+
+
+class ConcurrencyTest(ServerTestCase):
+
+    def test_many_threads(self):
+        for number in range(32):
+            self.add_file('/read/%d.txt' % number, b'read %d' % number)
+        fs = self.make_fs(max_concurrency=16, pool_size=16)
+        fs.makedirs('/My Library/write')
+
+        def work(number):
+            if number % 2:
+                self.assertEqual(fs.getbytes('/My Library/read/%d.txt' % (number // 2)),
+                                 b'read %d' % (number // 2))
+                self.assertEqual(len(fs.listdir('/My Library/read')), 32)
+            else:
+                fs.setbytes('/My Library/write/%d.txt' % number, b'write %d' % number)
+                self.assertEqual(fs.getinfo('/My Library/write/%d.txt' % number).name,
+                                 '%d.txt' % number)
+
+        with ThreadPoolExecutor(64) as executor:
+            self.run_within(lambda: list(executor.map(work, range(64))), 60)
+        self.assertEqual(sorted(fs.listdir('/My Library/write')),
+                         sorted('%d.txt' % number for number in range(0, 64, 2)))
+        for number in range(0, 64, 2):
+            self.assertEqual(self.library.files['/write/%d.txt' % number][0],
+                             b'write %d' % number)
+
+    def test_expired_token_logs_in_once(self):
+        for number in range(32):
+            self.add_file('/%d.txt' % number, b'%d' % number)
+        fs = self.make_fs()
+        self.assertEqual(len(fs.listdir('/My Library')), 32)
+        logins = self.seafile.counts['POST /api2/auth-token/']
+        with self.seafile.lock:
+            self.seafile.token = uuid.uuid4().hex
+        barrier = threading.Barrier(32)
+
+        def work(number):
+            barrier.wait()
+            return fs.getbytes('/My Library/%d.txt' % number)
+
+        with ThreadPoolExecutor(32) as executor:
+            contents = self.run_within(lambda: list(executor.map(work, range(32))))
+        self.assertEqual(contents, [b'%d' % number for number in range(32)])
+        self.assertEqual(self.seafile.counts['POST /api2/auth-token/'], logins + 1)
+
+    def test_writes_lock_their_path_only(self):
+        fs = self.make_fs()
+        written = threading.Event()
+
+        def write_same_path():
+            fs.setbytes('/My Library/a.txt', b'a')
+            written.set()
+
+        with fs._path_lock('/My Library/a.txt'):
+            # another path isn’t blocked
+            self.run_within(lambda: fs.setbytes('/My Library/b.txt', b'b'))
+            thread = threading.Thread(target=write_same_path)
+            thread.start()
+            self.assertFalse(written.wait(0.5))
+        thread.join(20)
+        self.assertTrue(written.is_set())
+        self.assertEqual(fs.getbytes('/My Library/a.txt'), b'a')
+
+    def test_no_global_lock(self):
+        self.add_file('/dir/a.txt', b'a')
+        self.add_file('/dir/sub/b.txt', b'b')
+        fs = self.make_fs()
+
+        def work():
+            fs.copy('/My Library/dir/a.txt', '/My Library/c.txt')
+            fs.move('/My Library/c.txt', '/My Library/d.txt')
+            fs.copydir('/My Library/dir', '/My Library/copy', create=True)
+            fs.movedir('/My Library/copy', '/My Library/moved', create=True)
+            fs.touch('/My Library/e.txt')
+            fs.setfile('/My Library/f.txt', io.BytesIO(b'f'))
+            fs.appendtext('/My Library/f.txt', 'g')
+            fs.removetree('/My Library/dir')
+
+        # all of them with the global lock held by another thread
+        with fs._lock:
+            self.run_within(work)
+        self.assertEqual(sorted(fs.walk.files('/My Library')), [
+            '/My Library/d.txt', '/My Library/e.txt', '/My Library/f.txt',
+            '/My Library/moved/a.txt', '/My Library/moved/sub/b.txt'])
+        self.assertEqual(fs.getbytes('/My Library/d.txt'), b'a')
+        self.assertEqual(fs.getbytes('/My Library/moved/sub/b.txt'), b'b')
+        self.assertEqual(fs.gettext('/My Library/f.txt'), 'fg')
+
+    def test_path_locks_are_dropped(self):
+        locks = PathLocks()
+        lock = locks('/a')
+        self.assertIs(locks('/a'), lock)
+        self.assertIsNot(locks('/b'), lock)
+        del lock
+        self.assertEqual(len(locks._locks), 0)
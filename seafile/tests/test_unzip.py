@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+import io
+import os
+import unittest
+import zipfile
+
+from fs.memoryfs import MemoryFS
+
+from seafile.tests.base import ServerTestCase
+from seafile.unzip import iter_zip
+
+
+class Unseekable(io.RawIOBase):
+    """Write-only stream without `tell`, zipfile writes data descriptors into it."""
+
+    def __init__(self):
+        self.data = bytearray()
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self.data += b
+        return len(b)
+
+
+def chunked(data, size=1000):
+    return [bytes(data[start:start + size]) for start in range(0, len(data), size)]
+
+
+def unpacked(chunks):
+    return [(name, b''.join(data)) for name, data in iter_zip(chunks)]
+
+
+class IterZipTest(unittest.TestCase):
+
+    members = [('a.txt', b'a' * 5000), ('dir/', b''), ('dir/b.bin', os.urandom(20000))]
+
+    def test_data_descriptors(self):
+        stream = Unseekable()
+        with zipfile.ZipFile(stream, 'w', zipfile.ZIP_DEFLATED) as archive:
+            for name, content in self.members:
+                archive.writestr(name, content)
+        first_flags = int.from_bytes(stream.data[6:8], 'little')
+        self.assertTrue(first_flags & 8)
+        self.assertEqual(unpacked(chunked(stream.data)), self.members)
+
+    def test_crc_error(self):
+        stream = io.BytesIO()
+        with zipfile.ZipFile(stream, 'w', zipfile.ZIP_STORED) as archive:
+            for name, content in self.members:
+                archive.writestr(name, content)
+        data = bytearray(stream.getvalue())
+        offset = data.index(b'a' * 5000)
+        data[offset + 100] = ord('b')
+        with self.assertRaisesRegex(ValueError, 'CRC error in zip member a.txt'):
+            unpacked(chunked(data))
+
+
+class DownloadDirTest(ServerTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.add_file('/photos/a.jpg', b'a' * 3000)
+        self.add_file('/photos/2024/b.jpg', os.urandom(100000))
+        self.add_file('/other.txt', b'other')
+
+    def requests(self):
+        return sum(self.seafile.counts.values())
+
+    def test_download_dir(self):
+        fs = self.make_fs()
+        fs.listdir('/')
+        before = self.requests()
+        with MemoryFS() as dst_fs:
+            self.assertEqual(fs.download_dir('/My Library/photos', dst_fs, '/copy', poll_interval=0), 2)
+            # zip task, progress and archive
+            self.assertEqual(self.requests(), before + 3)
+            self.assertEqual(sorted(dst_fs.walk.files()), ['/copy/2024/b.jpg', '/copy/a.jpg'])
+            self.assertEqual(dst_fs.getbytes('/copy/2024/b.jpg'), self.library.files['/photos/2024/b.jpg'][0])
+            self.assertEqual(dst_fs.getbytes('/copy/a.jpg'), b'a' * 3000)
+
+    def test_download_zip(self):
+        fs = self.make_fs()
+        fs.listdir('/')
+        before = self.requests()
+        file = io.BytesIO()
+        size = fs.download_zip('/My Library/photos', file, poll_interval=0)
+        self.assertEqual(self.requests(), before + 3)
+        self.assertEqual(size, len(file.getvalue()))
+        with zipfile.ZipFile(file) as archive:
+            self.assertEqual(archive.read('photos/a.jpg'), b'a' * 3000)
+            self.assertEqual(sorted(name for name in archive.namelist() if not name.endswith('/')),
+                             ['photos/2024/b.jpg', 'photos/a.jpg'])
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+import io
+import threading
+import unittest
+
+from seafile.tests.base import ServerTestCase
+from seafile.writeback import WriteBackQueue
+
+
+class WriteBackQueueTest(unittest.TestCase):
+
+    def test_pending_uploads_are_coalesced(self):
+        uploaded = []
+        running = threading.Event()
+        proceed = threading.Event()
+
+        def upload(key, fileobj):
+            running.set()
+            proceed.wait(10)
+            uploaded.append((key, fileobj.read()))
+
+        queue = WriteBackQueue(upload, workers=1)
+        queue.put('a', io.BytesIO(b'1'))
+        running.wait(10)
+        # while 1 is uploading, 2 is replaced by 3
+        queue.put('a', io.BytesIO(b'2'))
+        queue.put('a', io.BytesIO(b'3'))
+        proceed.set()
+        queue.sync()
+        self.assertEqual(uploaded, [('a', b'1'), ('a', b'3')])
+        self.assertEqual(queue.coalesced, 1)
+        queue.close()
+
+    def test_sync_raises_upload_errors(self):
+        def upload(key, fileobj):
+            if key == 'bad':
+                raise IOError('upload of %s failed' % key)
+
+        queue = WriteBackQueue(upload)
+        queue.put('good', io.BytesIO(b'1'))
+        queue.put('bad', io.BytesIO(b'2'))
+        with self.assertRaises(IOError):
+            queue.sync()
+        # reported once
+        queue.sync()
+        queue.close()
+
+    def test_discard(self):
+        proceed = threading.Event()
+        uploaded = []
+
+        def upload(key, fileobj):
+            proceed.wait(10)
+            uploaded.append(key)
+
+        queue = WriteBackQueue(upload, workers=1)
+        for key in ('/x', '/d/a', '/d/b', '/dd'):
+            queue.put(key, io.BytesIO(b''))
+        self.assertEqual(queue.discard('/d', tree=True), 2)
+        proceed.set()
+        queue.sync()
+        self.assertEqual(uploaded, ['/x', '/dd'])
+        queue.close()
+
+
+class SeafileFSWriteBackTest(ServerTestCase):
+    server_options = {'latency': 0.02}
+
+    def test_read_after_write(self):
+        fs = self.make_fs(write_back=8)
+        for number in range(5):
+            fs.setbytes('/My Library/a.txt', b'%d' % number)
+            self.assertEqual(fs.getbytes('/My Library/a.txt'), b'%d' % number)
+        fs.setbytes('/My Library/b.txt', b'b')
+        self.assertTrue(fs.exists('/My Library/b.txt'))
+        fs.sync()
+        self.assertEqual(self.library.files['/b.txt'][0], b'b')
+
+    def test_remove_drops_pending_upload(self):
+        fs = self.make_fs(write_back=8)
+        fs.setbytes('/My Library/a.txt', b'a')
+        fs.remove('/My Library/a.txt')
+        fs.sync()
+        self.assertFalse(fs.exists('/My Library/a.txt'))
+        self.assertNotIn('/a.txt', self.library.files)
+
+    def test_removedir_drops_pending_uploads(self):
+        fs = self.make_fs(write_back=8)
+        fs.makedirs('/My Library/d/e')
+        fs.setbytes('/My Library/d/e/a.txt', b'a')
+        fs.setbytes('/My Library/d/b.txt', b'b')
+        fs.removetree('/My Library/d')
+        fs.sync()
+        self.assertFalse(fs.exists('/My Library/d'))
+        self.assertNotIn('/d/b.txt', self.library.files)
+
+    def test_move_of_pending_file(self):
+        fs = self.make_fs(write_back=8)
+        fs.setbytes('/My Library/a.txt', b'a')
+        fs.move('/My Library/a.txt', '/My Library/b.txt')
+        fs.sync()
+        self.assertEqual(fs.listdir('/My Library'), ['b.txt'])
+        self.assertEqual(fs.getbytes('/My Library/b.txt'), b'a')
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+"""
+Streamed transfers between libraries of the same or different
+Seafile servers, without local files.
+"""
+import collections
+import posixpath
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Pipe(object):
+    """
+    Bounded in-memory pipe from a writing to a reading thread.
+    `write` blocks while `size` bytes are waiting; an error set by `fail`
+    is raised on both sides.
+    """
+
+    def __init__(self, size=4 * 1024 * 1024):
+        self.size = size
+        self._chunks = collections.deque()
+        self._buffered = 0
+        self._closed = False
+        self._error = None
+        self._cond = threading.Condition()
+
+    def write(self, data):
+        data = bytes(data)
+        with self._cond:
+            while self._buffered >= self.size and self._error is None:
+                self._cond.wait()
+            if self._error is not None:
+                raise self._error
+            if self._closed:
+                raise ValueError('write to closed pipe')
+            self._chunks.append(data)
+            self._buffered += len(data)
+            self._cond.notify_all()
+        return len(data)
+
+    def read(self, size=-1):
+        with self._cond:
+            while not self._chunks and not self._closed and self._error is None:
+                self._cond.wait()
+            if self._error is not None:
+                raise self._error
+            if size is None or size < 0:
+                while not self._closed and self._error is None:
+                    self._cond.wait()
+                size = self._buffered
+            parts = []
+            count = 0
+            while self._chunks and count < size:
+                chunk = self._chunks.popleft()
+                if count + len(chunk) > size:
+                    chunk, rest = chunk[:size - count], chunk[size - count:]
+                    self._chunks.appendleft(rest)
+                parts.append(chunk)
+                count += len(chunk)
+            self._buffered -= count
+            self._cond.notify_all()
+            return b''.join(parts)
+
+    def close(self):
+        """
+        End the data; the reader gets the rest, then b''.
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def fail(self, error):
+        """
+        Abort the transfer with `error`.
+        """
+        with self._cond:
+            if self._error is None:
+                self._error = error
+            self._cond.notify_all()
+
+
+class ExactReader(object):
+    """
+    Reads `size` bytes from `fileobj` (a `Pipe`), then makes sure it ends
+    there; IOError if it ends early or goes on.
+    """
+
+    def __init__(self, fileobj, size, name=''):
+        self.fileobj = fileobj
+        self.remaining = size
+        self.size = size
+        self.name = name
+        self.ended = False
+
+    def read(self, size=-1):
+        if self.remaining <= 0:
+            return b''
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.fileobj.read(size)
+        if not data:
+            raise IOError('%s ended after %d of %d bytes' % (
+                self.name, self.size - self.remaining, self.size))
+        self.remaining -= len(data)
+        if not self.remaining:
+            self.check_end()
+        return data
+
+    def check_end(self):
+        """Raise IOError if `fileobj` goes on after `size` bytes."""
+        if not self.ended:
+            if self.fileobj.read(1):
+                raise IOError('%s is longer than %d bytes' % (self.name, self.size))
+            self.ended = True
+
+
+def transfer_file(source, src_lib_id, src_path, destination, dst_lib_id, dst_path,
+                  size=None, mtime=None, pipe_size=4 * 1024 * 1024):
+    """
+    Copy file `src_path` of library `src_lib_id` of `Connection` `source`
+    to `dst_path` of library `dst_lib_id` of `Connection` `destination`
+    (replacing it), downloading and uploading at the same time through
+    a `Pipe` of `pipe_size` bytes. `size` and `mtime` default to those
+    from `file_info`; the mtime is kept if the destination server supports it.
+    Raise IOError (before the upload completes) if the source doesn’t
+    have exactly `size` bytes, e.g. because it changed.
+    The upload doesn’t take a slot of the concurrency limit, it runs
+    under the slot of the download (even on the same server).
+    Return number of bytes transferred
+    """
+    if size is None or mtime is None:
+        info = source.file_info(src_lib_id, src_path)
+        size = info['size'] if size is None else size
+        mtime = info.get('mtime') if mtime is None else mtime
+    dst_dir = posixpath.dirname(dst_path) or '/'
+    # before the download holds a slot of the concurrency limit
+    link = destination.file_upload_link(dst_lib_id, dst_dir)
+    pipe = Pipe(pipe_size)
+
+    def download():
+        try:
+            source.file_download_fileobj(src_lib_id, src_path, pipe)
+        except BaseException as error:
+            pipe.fail(error)
+        else:
+            pipe.close()
+
+    thread = threading.Thread(target=source.bind_deadline(download), name='seafile-transfer')
+    thread.daemon = True
+    thread.start()
+    try:
+        reader = ExactReader(pipe, size, '%s:%s' % (src_lib_id, src_path))
+        destination.file_upload_stream(
+            dst_lib_id, reader, size, dst_dir, posixpath.basename(dst_path),
+            replace=True, mtime=mtime, link=link)
+        # empty files aren’t read at all
+        reader.check_end()
+    except BaseException as error:
+        pipe.fail(error)
+        raise
+    finally:
+        # never leave the download blocked in a full pipe
+        pipe.fail(IOError('Transfer of %s:%s ended' % (src_lib_id, src_path)))
+        thread.join()
+    logging.info('Transferred %s:%s to %s:%s (%d bytes)' % (
+        src_lib_id, src_path, dst_lib_id, dst_path, size))
+    return size
+
+
+def transfer_files(source, destination, jobs, workers=4, pipe_size=4 * 1024 * 1024):
+    """
+    Run `transfer_file` for every (src_lib_id, src_path, dst_lib_id, dst_path,
+    size, mtime) of `jobs`, `workers` at a time.
+    Return the total number of bytes transferred
+    """
+    def transfer(job):
+        src_lib_id, src_path, dst_lib_id, dst_path, size, mtime = job
+        return transfer_file(source, src_lib_id, src_path, destination, dst_lib_id, dst_path,
+                             size, mtime, pipe_size)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return sum(executor.map(source.bind_deadline(transfer), jobs))
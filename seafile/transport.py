@@ -0,0 +1,294 @@
+# -*- coding: utf-8 -*-
+"""
+Transports for `Connection` (its ``transport`` option): HTTP adapters
+that record the request/response exchanges with a server to a file,
+with secrets scrubbed, and replay them without a server, optionally
+with the recorded timing. Both count requests and bytes per operation:
+
+    >>> transport = ReplayTransport('walk.json')
+    >>> fs = SeafileFS(server='https://seafile.example.com', transport=transport)
+    >>> with transport.measure('walk') as usage:
+    ...     list(fs.walk.files('/My Library'))
+    >>> assert usage.requests <= 3
+"""
+import atexit
+import base64
+import collections
+import contextlib
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+import logging
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3 import HTTPResponse
+
+# form fields, query parameters and JSON keys whose values are replaced
+SECRET_KEYS = frozenset(('password', 'token', 'auth_token', 'old_password', 'new_password'))
+SECRET_HEADERS = frozenset(('authorization', 'cookie', 'set-cookie'))
+SCRUBBED = 'scrubbed'
+# response headers that don’t fit the recorded (decoded) body
+DROPPED_HEADERS = frozenset(('content-encoding', 'transfer-encoding', 'content-length', 'connection'))
+
+
+def scrub_query(query):
+    """
+    Return the urlencoded `query` (or form) with secrets scrubbed.
+    """
+    return urlencode([(key, SCRUBBED if key in SECRET_KEYS else value)
+                      for key, value in parse_qsl(query, keep_blank_values=True)])
+
+
+def scrub_json(value):
+    """
+    Return the decoded JSON `value` with secrets scrubbed.
+    """
+    if isinstance(value, dict):
+        return dict((key, SCRUBBED if key in SECRET_KEYS else scrub_json(val))
+                    for key, val in value.items())
+    if isinstance(value, list):
+        return [scrub_json(val) for val in value]
+    return value
+
+
+def request_key(method, url):
+    """
+    Return the key that matches a request to its recorded exchange:
+    method, path and sorted, scrubbed query, but not the host.
+    """
+    parts = urlsplit(url)
+    query = scrub_query(parts.query)
+    return '%s %s%s' % (method, parts.path, '?' + '&'.join(sorted(query.split('&'))) if query else '')
+
+
+class Usage(object):
+    """
+    Number of requests and bytes sent and received during `Transport.measure`.
+    `by_request`: number of requests per method and path
+    """
+
+    def __init__(self, name=None):
+        self.name = name
+        self.requests = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.by_request = collections.Counter()
+
+    def add(self, exchange):
+        self.requests += 1
+        self.bytes_sent += exchange['request_size']
+        self.bytes_received += exchange['size']
+        self.by_request['%s %s' % (exchange['method'], urlsplit(exchange['url']).path)] += 1
+
+    def __repr__(self):
+        return '<Usage %s: %d requests, %d bytes sent, %d received>' % (
+            self.name, self.requests, self.bytes_sent, self.bytes_received)
+
+
+class Transport(HTTPAdapter):
+    """
+    Base of the recording and replaying adapters: responses are built
+    from exchange dicts, every exchange is counted by the active `measure`s.
+    """
+
+    def __init__(self, filename, **kwargs):
+        super().__init__(**kwargs)
+        self.filename = filename
+        self._measures = []
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        return {'filename': self.filename}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    @contextlib.contextmanager
+    def measure(self, name=None):
+        """
+        Count the requests of all threads within the block into a `Usage`.
+        Exchanges recorded within are tagged with the innermost `name`.
+        """
+        usage = Usage(name)
+        with self._lock:
+            self._measures.append(usage)
+        try:
+            yield usage
+        finally:
+            with self._lock:
+                self._measures.remove(usage)
+
+    def _count(self, exchange):
+        with self._lock:
+            names = [usage.name for usage in self._measures if usage.name]
+            if names and 'operation' not in exchange:
+                exchange['operation'] = names[-1]
+            for usage in self._measures:
+                usage.add(exchange)
+
+    def _build(self, request, exchange):
+        """
+        Return a `requests.Response` to `request` from the recorded `exchange`.
+        """
+        if 'body_base64' in exchange:
+            content = base64.b64decode(exchange['body_base64'])
+        else:
+            content = exchange.get('body', '').encode('utf-8')
+        headers = dict(exchange['headers'])
+        headers['Content-Length'] = str(len(content))
+        raw = HTTPResponse(body=io.BytesIO(content), headers=headers, status=exchange['status'],
+                           reason=exchange.get('reason'), preload_content=False,
+                           decode_content=False)
+        return self.build_response(request, raw)
+
+
+class RecordingTransport(Transport):
+    """
+    Send requests to the server and record the exchanges, written to
+    `filename` by `save`, `close` or at exit (as JSON). Authorization
+    and cookies, passwords and tokens are scrubbed. Streamed responses
+    are read completely before they are returned.
+    """
+
+    def __init__(self, filename, **kwargs):
+        super().__init__(filename, **kwargs)
+        self.exchanges = []
+        self._saved = 0
+        atexit.register(self._save_at_exit)
+
+    def _save_at_exit(self):
+        if len(self.exchanges) > self._saved:
+            self.save()
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        request_size = 0
+        if request.body is not None:
+            request_size = int(request.headers.get('Content-Length') or
+                               requests.utils.super_len(request.body))
+        content_type = request.headers.get('Content-Type', '')
+        start = time.time()
+        r = super().send(request, stream=True, timeout=timeout, verify=verify, cert=cert,
+                         proxies=proxies)
+        try:
+            content = r.content
+        finally:
+            r.close()
+        parts = urlsplit(request.url)
+        exchange = {
+            'method': request.method,
+            'url': parts._replace(query=scrub_query(parts.query)).geturl(),
+            'request_size': request_size,
+            'status': r.status_code,
+            'reason': r.reason,
+            'headers': dict((key, value) for key, value in r.headers.items()
+                            if key.lower() not in SECRET_HEADERS | DROPPED_HEADERS),
+            'size': len(content),
+            'elapsed': time.time() - start,
+        }
+        if isinstance(request.body, (bytes, str)) and 'urlencoded' in content_type:
+            body = request.body.decode('utf-8') if isinstance(request.body, bytes) else request.body
+            exchange['request_body'] = scrub_query(body)
+        recorded = content
+        if 'json' in r.headers.get('Content-Type', ''):
+            try:
+                recorded = json.dumps(scrub_json(json.loads(content.decode('utf-8')))).encode('utf-8')
+            except ValueError:
+                pass
+        try:
+            exchange['body'] = recorded.decode('utf-8')
+        except UnicodeDecodeError:
+            exchange['body_base64'] = base64.b64encode(recorded).decode('ascii')
+        self._count(exchange)
+        with self._lock:
+            self.exchanges.append(exchange)
+        # the client gets the secrets
+        return self._build(request, dict(exchange, body_base64=base64.b64encode(content)))
+
+    def save(self, filename=None):
+        """
+        Write the exchanges recorded so far to `filename` (default: `self.filename`).
+        """
+        filename = filename or self.filename
+        with self._lock:
+            exchanges = list(self.exchanges)
+        directory = os.path.dirname(os.path.abspath(filename))
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'w') as fileobj:
+                json.dump({'version': 1, 'exchanges': exchanges}, fileobj, indent=1)
+            os.replace(temp_path, filename)
+            self._saved = len(exchanges)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+        logging.info('Recorded %d exchanges to %s' % (len(exchanges), filename))
+
+    def close(self):
+        super().close()
+        self.save()
+
+
+class ReplayTransport(Transport):
+    """
+    Answer requests with the exchanges recorded in `filename`, matched by
+    method, path and query (see `request_key`), in the recorded order;
+    the last of several identical requests answers all further ones.
+    Within `measure(name)`, exchanges recorded within `measure(name)` come
+    first, so an operation can be replayed without the ones recorded before.
+    Request bodies aren’t compared. Unknown requests raise
+    `requests.exceptions.ConnectionError`.
+    `timing`: factor of the recorded time each response is delayed by
+    (default None: no delay, 1.0: as recorded)
+    """
+
+    def __init__(self, filename, timing=None, **kwargs):
+        super().__init__(filename, **kwargs)
+        self.timing = timing
+        with open(filename) as fileobj:
+            self.exchanges = json.load(fileobj)['exchanges']
+        self._queues = collections.defaultdict(collections.deque)  # (operation, key): exchanges
+        for exchange in self.exchanges:
+            key = request_key(exchange['method'], exchange['url'])
+            self._queues[(exchange.get('operation'), key)].append(exchange)
+
+    def __getstate__(self):
+        return {'filename': self.filename, 'timing': self.timing}
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        key = request_key(request.method, request.url)
+        with self._lock:
+            names = [usage.name for usage in self._measures if usage.name]
+            queue = self._queues.get((names[-1] if names else None, key))
+            if not queue:
+                queue = self._queues.get((None, key))
+            if not queue:
+                queue = next((queue for (_name, queue_key), queue in self._queues.items()
+                              if queue_key == key), None)
+            if not queue:
+                raise requests.exceptions.ConnectionError(
+                    'No recorded response for %s' % key, request=request)
+            exchange = queue.popleft() if len(queue) > 1 else queue[0]
+        if self.timing:
+            time.sleep(exchange.get('elapsed', 0) * self.timing)
+        self._count(dict(exchange))
+        return self._build(request, exchange)
+
+
+def open_transport(spec):
+    """
+    Return the transport described by `spec`: ``record:FILE``,
+    ``replay:FILE`` or ``replay-timed:FILE`` (with the recorded timing).
+    """
+    mode, _, filename = spec.partition(':')
+    if mode == 'record':
+        return RecordingTransport(filename)
+    if mode == 'replay':
+        return ReplayTransport(filename)
+    if mode == 'replay-timed':
+        return ReplayTransport(filename, timing=1.0)
+    raise ValueError('Unknown transport %r' % spec)
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""
+Unpack zip archives while they are read from a stream,
+e.g. directory downloads of `SeafileFS`, without seeking.
+"""
+import struct
+import zlib
+
+LOCAL_HEADER = struct.Struct('<4sHHHHHIIIHH')
+LOCAL_SIGNATURE = b'PK\x03\x04'
+DESCRIPTOR_SIGNATURE = b'PK\x07\x08'
+STORED, DEFLATED = 0, 8
+
+
+class ChunkReader(object):
+    """
+    Readable stream of an iterable of byte chunks that can push back data.
+    """
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buffer = b''
+
+    def read(self, size):
+        """Return up to `size` bytes, less only at the end."""
+        while len(self._buffer) < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            self._buffer += chunk
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    def read1(self, size=65536):
+        """Return up to `size` bytes with one chunk at most, b'' at the end."""
+        if not self._buffer:
+            self._buffer = next(self._chunks, b'')
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    def read_exactly(self, size):
+        data = self.read(size)
+        if len(data) < size:
+            raise ValueError('Truncated zip archive')
+        return data
+
+    def unread(self, data):
+        self._buffer = data + self._buffer
+
+
+def _zip64_sizes(extra, csize, usize):
+    """Return the sizes of a local header, replaced by those of a zip64 extra field."""
+    position = 0
+    while position + 4 <= len(extra):
+        tag, length = struct.unpack_from('<HH', extra, position)
+        if tag == 1:
+            values = list(struct.unpack_from('<%dQ' % (length // 8), extra, position + 4))
+            if usize == 0xFFFFFFFF and values:
+                usize = values.pop(0)
+            if csize == 0xFFFFFFFF and values:
+                csize = values.pop(0)
+            return csize, usize, True
+        position += 4 + length
+    return csize, usize, False
+
+
+def _stored(reader, size):
+    while size > 0:
+        data = reader.read1(min(size, 65536))
+        if not data:
+            raise ValueError('Truncated zip archive')
+        size -= len(data)
+        yield data
+
+
+def _deflated(reader):
+    decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+    while not decompressor.eof:
+        data = reader.read1()
+        if not data:
+            raise ValueError('Truncated zip archive')
+        output = decompressor.decompress(data)
+        if output:
+            yield output
+    reader.unread(decompressor.unused_data)
+
+
+def iter_zip(chunks):
+    """
+    Yield (name, chunks) of every member of the zip archive arriving as
+    iterable of byte `chunks`. Directory names end with '/'.
+    The data of a member must be read before the next one,
+    the rest is skipped otherwise. CRCs are checked.
+    """
+    reader = ChunkReader(chunks)
+    while True:
+        signature = reader.read(4)
+        if signature != LOCAL_SIGNATURE:
+            # central directory, end of archive or nothing
+            return
+        (_signature, _version, flags, method, _time, _date,
+         crc, csize, usize, name_length, extra_length) = LOCAL_HEADER.unpack(
+            signature + reader.read_exactly(LOCAL_HEADER.size - 4))
+        name = reader.read_exactly(name_length)
+        name = name.decode('utf-8' if flags & 0x800 else 'cp437')
+        csize, usize, zip64 = _zip64_sizes(reader.read_exactly(extra_length), csize, usize)
+        if flags & 1:
+            raise ValueError('Encrypted zip member %s' % name)
+        descriptor = flags & 8
+        if method == DEFLATED:
+            data = _deflated(reader)
+        elif method == STORED and not descriptor:
+            data = _stored(reader, csize)
+        else:
+            raise ValueError('Unsupported compression %d of zip member %s' % (method, name))
+        checksum = [0]
+
+        def member(data=data, checksum=checksum):
+            for chunk in data:
+                checksum[0] = zlib.crc32(chunk, checksum[0])
+                yield chunk
+
+        yield name, member()
+        for _chunk in member():
+            pass
+        if descriptor:
+            first = reader.read_exactly(4)
+            if first == DESCRIPTOR_SIGNATURE:
+                first = reader.read_exactly(4)
+            crc, = struct.unpack('<I', first)
+            reader.read_exactly(16 if zip64 else 8)
+        if checksum[0] & 0xFFFFFFFF != crc:
+            raise ValueError('CRC error in zip member %s' % name)
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""
+Write-back upload queue for `SeafileFS`.
+"""
+import collections
+import threading
+import logging
+
+
+class WriteBackQueue(object):
+    """
+    Bounded queue of uploads, sent by up to `workers` background threads.
+
+    `upload(key, fileobj)` is called for every queued file object,
+    which is closed afterwards. A pending upload of the same `key`
+    is replaced by a later one before it is sent; uploads of one key
+    never run at the same time, so the last version wins.
+    `put` blocks while `size` uploads are pending.
+    Errors are kept and raised by `sync`.
+    """
+
+    def __init__(self, upload, size=16, workers=2):
+        self.upload = upload
+        self.size = size
+        self.workers = workers
+        self.coalesced = 0
+        self._pending = collections.OrderedDict()  # key: fileobj
+        self._active = set()  # keys being uploaded
+        self._errors = []  # (key, exception)
+        self._threads = []
+        self._closed = False
+        self._cond = threading.Condition()
+
+    def __len__(self):
+        with self._cond:
+            return len(self._pending) + len(self._active)
+
+    def put(self, key, fileobj):
+        """
+        Queue `fileobj` for upload as `key`, replacing a pending upload of `key`.
+        """
+        with self._cond:
+            if self._closed:
+                raise ValueError('write-back queue is closed')
+            old = self._pending.pop(key, None)
+            if old is not None:
+                logging.debug('Replacing pending upload of %s' % (key,))
+                self.coalesced += 1
+                old.close()
+            else:
+                while len(self._pending) >= self.size:
+                    self._cond.wait()
+            self._pending[key] = fileobj
+            if len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._work, name='seafile-write-back')
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+            self._cond.notify_all()
+
+    def _next(self):
+        """Return the oldest pending key that isn’t being uploaded, or None."""
+        for key in self._pending:
+            if key not in self._active:
+                return key
+        return None
+
+    def _work(self):
+        while True:
+            with self._cond:
+                key = self._next()
+                while key is None:
+                    if self._closed and not self._pending:
+                        return
+                    self._cond.wait()
+                    key = self._next()
+                fileobj = self._pending.pop(key)
+                self._active.add(key)
+                self._cond.notify_all()
+            try:
+                self.upload(key, fileobj)
+            except Exception as error:
+                logging.error('Upload of %s failed: %s' % (key, error))
+                with self._cond:
+                    self._errors.append((key, error))
+            finally:
+                fileobj.close()
+                with self._cond:
+                    self._active.discard(key)
+                    self._cond.notify_all()
+
+    def pending(self, key):
+        """
+        Tell if an upload of `key` is queued or running.
+        """
+        with self._cond:
+            return key in self._pending or key in self._active
+
+    def discard(self, key, tree=False):
+        """
+        Drop the pending uploads of `key` (and of the keys below it
+        if `tree`, for path keys) and wait for a running one.
+        Return number of dropped uploads
+        """
+        prefix = key.rstrip('/') + '/'
+
+        def matches(other):
+            return other == key or tree and other.startswith(prefix)
+
+        with self._cond:
+            dropped = [other for other in self._pending if matches(other)]
+            for other in dropped:
+                logging.debug('Dropping pending upload of %s' % (other,))
+                self._pending.pop(other).close()
+            self._cond.notify_all()
+            while any(matches(other) for other in self._active):
+                self._cond.wait()
+        return len(dropped)
+
+    def wait(self, key=None):
+        """
+        Wait until the uploads of `key` (or all uploads) are done.
+        """
+        with self._cond:
+            if key is None:
+                while self._pending or self._active:
+                    self._cond.wait()
+            else:
+                while key in self._pending or key in self._active:
+                    self._cond.wait()
+
+    def sync(self):
+        """
+        Wait until all uploads are done, then raise the first error
+        of failed uploads since the last `sync`, if any.
+        """
+        self.wait()
+        with self._cond:
+            failed, self._errors = self._errors, []
+        for key, error in failed[1:]:
+            logging.error('Upload of %s failed: %s' % (key, error))
+        if failed:
+            raise failed[0][1]
+
+    def close(self):
+        """
+        Send all pending uploads and stop the worker threads.
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join()
+        self.sync()